@@ -0,0 +1,31 @@
+import asyncio
+
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from migrate import load_env
+from services.link_graph import analyze_link_graph
+
+
+async def main():
+    logger.info('Link graph analysis started.')
+
+    # Load env variables.
+    postgres_user, postgres_password, postgres_db = load_env()
+
+    # Setup database manager.
+    database_manager = DatabaseManager(url=f"postgresql+asyncpg://"
+                                           f"{postgres_user}:"
+                                           f"{postgres_password}@localhost:5432/"
+                                           f"{postgres_db}")
+
+    # Create metrics tables if they don't exist yet.
+    await database_manager.create_models()
+
+    await analyze_link_graph(database_manager=database_manager)
+
+    # Clean database manager.
+    await database_manager.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
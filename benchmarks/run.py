@@ -0,0 +1,230 @@
+"""
+Microbenchmarks of functions that are called for every crawled page or found url.
+
+The corpus is synthetic (pages and urls shaped like gov.si pages), so results show relative changes of the measured
+functions, not the crawler's speed on real pages. Replace the files in benchmarks/corpus with saved real pages and
+update the baseline to measure those.
+
+Run from the repository root:
+    python -m benchmarks.run                 compare with the baseline and fail on regressions
+    python -m benchmarks.run --update        save the current results as the new baseline
+    python -m benchmarks.run canonicalize    run only benchmarks whose names contain 'canonicalize'
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tracemalloc
+from time import perf_counter
+from typing import Callable
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from bs4 import BeautifulSoup
+
+from services.link_extractor import find_links, find_browser_links
+from services.page_extractor import find_images, extract_binary_links, find_browser_images
+from services.robots_matcher import filter_allowed_urls
+from util.util import canonicalize, is_url, fill_url, check_if_binary, is_url_allowed, is_domain_allowed
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCHMARKS_DIR, 'corpus')
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+# A benchmark fails if it's slower than the baseline by more than this fraction.
+DEFAULT_THRESHOLD = 0.25
+# Minimum duration of a single measurement in seconds and the number of measurements (the median one is used).
+MIN_TIME = 0.2
+REPEATS = 9
+
+
+def load_corpus() -> (list[str], list[str], RobotFileParser):
+    with open(os.path.join(CORPUS_DIR, 'urls.txt'), encoding='utf-8') as file:
+        urls = [line.strip() for line in file if line.strip()]
+    pages = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as file:
+                pages.append(file.read())
+    robot_file_parser = RobotFileParser()
+    with open(os.path.join(CORPUS_DIR, 'robots.txt'), encoding='utf-8') as file:
+        robot_file_parser.parse(file.read().splitlines())
+    return urls, pages, robot_file_parser
+
+
+def collect_browser_links(html: str, page_url: str) -> (str, list[str], list[str], list[str]):
+    """
+    Collects links the same way the browser script does, so browser link filtering can be measured.
+    """
+    beautiful_soup = BeautifulSoup(html, 'html.parser')
+    current_url = urlparse(page_url)
+    return (page_url,
+            [fill_url(a.attrs['href'], current_url) for a in beautiful_soup.select('a[href]')],
+            [element.attrs['onclick'] for element in beautiful_soup.select('[onclick]')],
+            [fill_url(img.attrs['src'], current_url) for img in beautiful_soup.select('img[src]')])
+
+
+def create_benchmarks() -> dict[str, (Callable[[], None], int)]:
+    """
+    Creates benchmarks by name. Each benchmark is a function and the number of items it processes per call.
+    """
+    urls, pages, robot_file_parser = load_corpus()
+    page_url = 'https://www.gov.si/teme/zdravje/'
+    current_url = urlparse(page_url)
+    absolute_urls = [url for url in urls if urlparse(url).scheme in ['http', 'https']]
+    canonical_urls = canonicalize(set(absolute_urls))
+    soups = [BeautifulSoup(html, 'html.parser') for html in pages]
+    browser_links = [collect_browser_links(html, page_url) for html in pages]
+    page_links = [find_links(soup, current_url, robot_file_parser=robot_file_parser) for soup in soups]
+    encoded_pages = len(pages)
+
+    def run_extract_binary_links():
+        for links in page_links:
+            extract_binary_links(urls=set(links))
+
+    return {
+        'canonicalize': (lambda: canonicalize(set(absolute_urls)), len(absolute_urls)),
+        'is_url': (lambda: [is_url(url) for url in urls], len(urls)),
+        'fill_url': (lambda: [fill_url(url, current_url) for url in urls], len(urls)),
+        'check_if_binary': (lambda: [check_if_binary(url) for url in canonical_urls], len(canonical_urls)),
+        'is_url_allowed': (lambda: [is_url_allowed(url, robot_file_parser=robot_file_parser)
+                                    for url in canonical_urls], len(canonical_urls)),
+        'filter_allowed_urls': (lambda: filter_allowed_urls(canonical_urls, robot_file_parser=robot_file_parser),
+                                len(canonical_urls)),
+        'is_domain_allowed': (lambda: [is_domain_allowed(url) for url in canonical_urls], len(canonical_urls)),
+        'parse_html': (lambda: [BeautifulSoup(html, 'html.parser') for html in pages], encoded_pages),
+        'find_links': (lambda: [find_links(soup, current_url, robot_file_parser=robot_file_parser)
+                                for soup in soups], encoded_pages),
+        'find_browser_links': (lambda: [find_browser_links(base_url=base_url, hrefs=hrefs, onclicks=onclicks,
+                                                           robot_file_parser=robot_file_parser)
+                                        for base_url, hrefs, onclicks, _ in browser_links], encoded_pages),
+        'find_images': (lambda: [find_images(soup, current_url=page_url) for soup in soups], encoded_pages),
+        'find_browser_images': (lambda: [find_browser_images(image_urls)
+                                         for _, _, _, image_urls in browser_links], encoded_pages),
+        'extract_binary_links': (run_extract_binary_links, encoded_pages),
+        'hash_html': (lambda: [hashlib.sha256(html.encode('utf-8')).hexdigest() for html in pages], encoded_pages),
+    }
+
+
+def count_calls(function: Callable[[], None]) -> int:
+    """
+    Returns the number of calls of the function that take about MIN_TIME.
+    """
+    calls = 1
+    while True:
+        start_time = perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = perf_counter() - start_time
+        if elapsed >= MIN_TIME / 4:
+            break
+        calls *= 2
+    return max(int(calls * MIN_TIME / elapsed), 1)
+
+
+def time_calls(function: Callable[[], None], calls: int) -> float:
+    start_time = perf_counter()
+    for _ in range(calls):
+        function()
+    return perf_counter() - start_time
+
+
+CALIBRATION_WORDS = [f'https://www.gov.si/{index}/{index * 7 % 13}/' for index in range(1000)]
+
+
+def calibration_workload():
+    """
+    A fixed pure Python workload. Results are compared relative to its speed, so baselines can be compared between
+    machines and machine load affects all benchmarks alike.
+    """
+    sorted({word.split('/')[3]: word.upper() for word in CALIBRATION_WORDS}.items())
+
+
+def measure_speed(function: Callable[[], None], items: int) -> (float, float):
+    """
+    Measures the function's speed relative to the calibration workload. Measurements of the function and of the
+    calibration workload are interleaved and the median of REPEATS ratios is used, so changes of the machine's load
+    during the run affect both alike.
+    Returns the relative speed and the median number of processed items per second.
+    """
+    calls, calibration_calls = count_calls(function), count_calls(calibration_workload)
+    ratios, speeds = [], []
+    for _ in range(REPEATS):
+        calibration_speed = calibration_calls * len(CALIBRATION_WORDS) / time_calls(calibration_workload,
+                                                                               calibration_calls)
+        speed = calls * items / time_calls(function, calls)
+        ratios.append(speed / calibration_speed)
+        speeds.append(speed)
+    return statistics.median(ratios), statistics.median(speeds)
+
+
+def measure_allocations(function: Callable[[], None], items: int) -> (float, float):
+    """
+    Returns the number of allocated memory blocks and the peak allocated memory in bytes per processed item.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(statistic.count_diff for statistic in after.compare_to(before, 'lineno') if statistic.count_diff > 0)
+    return blocks / items, peak / items
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Runs microbenchmarks of the crawler hot paths.')
+    parser.add_argument('names', nargs='*', help='run only benchmarks whose names contain one of these')
+    parser.add_argument('--update', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown compared to the baseline (default %(default)s)')
+    parser.add_argument('--with-logging', action='store_true',
+                        help='keep debug logging enabled, as it is while crawling')
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        logging.disable(logging.DEBUG)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as file:
+            baseline = json.load(file)
+
+    results = {}
+    regressions = []
+    print(f'{"benchmark":<22}{"items/s":>14}{"baseline":>14}{"change":>9}{"blocks/item":>13}{"peak B/item":>13}')
+    for name, (function, items) in create_benchmarks().items():
+        if args.names and not any(selected in name for selected in args.names):
+            continue
+        # Speeds are saved and compared relative to the calibration speed.
+        relative_speed, speed = measure_speed(function, items)
+        blocks, peak = measure_allocations(function, items)
+        results[name] = relative_speed
+        # Baseline speed scaled to the speed of this machine.
+        baseline_speed = baseline[name] * speed / relative_speed if name in baseline else None
+        change = f'{relative_speed / baseline[name] - 1:+.0%}' if baseline_speed else ''
+        if baseline_speed and relative_speed < baseline[name] * (1 - args.threshold):
+            regressions.append(name)
+            change += ' !'
+        print(f'{name:<22}{speed:>14,.0f}{baseline_speed or 0:>14,.0f}{change:>9}{blocks:>13.1f}{peak:>13,.0f}')
+
+    if args.update:
+        with open(BASELINE_PATH, 'w') as file:
+            json.dump({**baseline, **{name: round(speed, 6) for name, speed in results.items()}}, file, indent=4,
+                      sort_keys=True)
+            file.write('\n')
+        print(f'Baseline saved to {BASELINE_PATH}.')
+        return 0
+    if regressions:
+        print(f'Slower than the baseline by more than {args.threshold:.0%}: {", ".join(regressions)}.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
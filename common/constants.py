@@ -31,6 +31,41 @@ navigation_func_regex = re.compile(".*(.)?location(.href)?.(.*)\([\"\'](.*)[\"\'
 
 USER_AGENT = "fri-wier-besela"
 DEFAULT_DOMAIN_DELAY = 5  # seconds
+# Lowest delay in seconds between requests to a healthy host. Robots.txt crawl delay is never undercut.
+MIN_DOMAIN_DELAY = 1
+# Highest delay in seconds between requests to a struggling host.
+MAX_DOMAIN_DELAY = 60
+# Seconds removed from the host's delay after each fast, successful response.
+DOMAIN_DELAY_DECREASE = 0.5
+# Host's delay is multiplied by this factor after an error or a slow response.
+DOMAIN_DELAY_BACKOFF = 2
+# Response is slow if it takes longer than this many seconds or this many times the host's average response time.
+SLOW_RESPONSE_TIME = 5
+SLOW_RESPONSE_FACTOR = 3
+# Weight of the latest response time in the host's average response time.
+RESPONSE_TIME_SMOOTHING = 0.3
+# Response statuses that mean the host is overloaded.
+backoff_status_codes = [429, 503]
+# Browser errors that mean the host might be overloaded.
+overload_errors = ['net::ERR_CONNECTION_RESET', 'net::ERR_EMPTY_RESPONSE', 'net::ERR_CONNECTION_REFUSED',
+                   'net::ERR_TIMED_OUT', 'net::ERR_CONNECTION_TIMED_OUT']
+# Browser errors that are probably temporary, so the page is crawled again later.
+transient_errors = overload_errors + ['net::ERR_CONNECTION_CLOSED', 'net::ERR_NETWORK_CHANGED',
+                                      'net::ERR_HTTP2_PROTOCOL_ERROR', 'Timeout']
+# Response statuses that are probably temporary.
+transient_status_codes = [408, 429, 500, 502, 503, 504]
+# Maximum number of known redirects followed from a url.
+REDIRECT_MAX_HOPS = 10
+# Number of times a page is crawled before it's marked as failed.
+RETRY_MAX_ATTEMPTS = 3
+# Delay in seconds before the first retry, it doubles with every next attempt up to RETRY_MAX_DELAY.
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+# Host's circuit opens after this many consecutive failed requests, so its pages aren't crawled for a while.
+CIRCUIT_FAILURE_THRESHOLD = 5
+# Seconds after which an open circuit lets a single probe request through. It doubles with every failed probe.
+CIRCUIT_COOLDOWN = 300
+CIRCUIT_MAX_COOLDOWN = 3600
 
 # Resource types that will be blocked.
 excluded_resource_types = ["image", "font", "media"]
@@ -41,3 +76,188 @@ image_extensions = ['.jpg', '.jpeg', '.jfif', '.pjpeg', '.pjp', '.png', '.apng',
 binary_file_extensions = ['.pdf', '.doc', '.docx', '.ppt', '.pptx', '.zip', '.rar', '.xlsx', '.xlsm']
 # Page timeout in milliseconds
 PAGE_WAIT_TIMEOUT = 20000
+# Links and images are collected by a script in the browser ('browser') or by parsing the page's html ('html').
+LINK_EXTRACTION_MODE = 'browser'
+# Script that returns page's base url, resolved link urls, onclick handlers and resolved image urls.
+# Links include image map areas. Hrefs of SVG anchors are objects, so they are resolved from their value.
+collect_links_script = """() => [
+    document.baseURI,
+    Array.from(document.links, a => {
+        try {
+            return typeof a.href === 'string' ? a.href : new URL(a.href.baseVal, document.baseURI).href;
+        } catch (e) {
+            return null;
+        }
+    }),
+    Array.from(document.querySelectorAll('[onclick]'), element => element.getAttribute('onclick')),
+    Array.from(document.querySelectorAll('img[src]'), img => img.src),
+]"""
+# Maximum time in seconds an idle thread waits for a frontier notification before polling the database again.
+FRONTIER_WAIT_TIMEOUT = 60
+# Chromium arguments used for all browser processes.
+BROWSER_ARGS = ["--ignore-certificate-errors",
+                "--ignore-urlfetcher-cert-requests",
+                "--allow-running-insecure-content",
+                "--ignore-certificate-errors-spki-list",
+                "--no-first-run",
+                "--no-default-browser-check",
+                "--disable-extensions",
+                "--disable-background-networking",
+                "--disable-dev-shm-usage",
+                "--mute-audio"]
+# Browser context is recycled after this many navigations.
+BROWSER_MAX_NAVIGATIONS = 100
+# Browser process is restarted once its memory usage (including child processes) exceeds this limit.
+BROWSER_MAX_RSS_MB = 1536
+# How often in seconds the browser processes are checked for crashes and memory usage.
+BROWSER_SUPERVISOR_INTERVAL = 5
+# Maximum time in seconds for a browser process to start.
+BROWSER_START_TIMEOUT = 30
+# How often in seconds a thread checks whether a browser restarted by another thread is available.
+BROWSER_RESTART_POLL_INTERVAL = 0.1
+# Page load wait strategy: 'adaptive' learns the cheapest strategy per site,
+# otherwise one of 'commit', 'domcontentloaded', 'load' or 'networkidle' is used for all sites.
+WAIT_STRATEGY = 'adaptive'
+# Wait strategies learned by the adaptive strategy, ordered from the cheapest to the most expensive one.
+# 'commit' isn't learned, because the html might not be parsed yet when the page is saved.
+wait_strategies = ['domcontentloaded', 'load', 'networkidle']
+# CSS selectors that have to appear before a site's page is usable (domain -> selector).
+SITE_WAIT_SELECTORS = {}
+# Maximum time in milliseconds to wait for the network to become idle.
+NETWORK_IDLE_TIMEOUT = 3000
+# Number of probed pages per site before choosing its wait strategy.
+WAIT_STRATEGY_SAMPLES = 5
+# A strategy is good enough if it finds at least this share of the links found by any other strategy.
+WAIT_STRATEGY_MIN_LINKS_RATIO = 0.95
+# Resource types that are served from the shared subresource cache.
+cached_resource_types = ["stylesheet", "script"]
+# Request interception rules, the first matching rule decides what happens with a request.
+# Rules match resource types, hosts (including their subdomains) or url patterns (* matches anything).
+# Actions are 'block', 'cache' (served from the shared subresource cache) and 'allow'.
+# Blocking is done by the browser, only requests that might have to be served from the cache and requests without
+# a file extension (whose resource type is only known to Python) reach Python.
+interception_rules = [
+    {'action': 'block', 'resource_types': excluded_resource_types},
+    # Third-party analytics and ads.
+    {'action': 'block', 'hosts': ['google-analytics.com', 'googletagmanager.com', 'googleadservices.com',
+                                  'doubleclick.net', 'googlesyndication.com', 'facebook.net', 'hotjar.com',
+                                  'gemius.pl', 'cookiebot.com', 'addthis.com', 'sharethis.com']},
+    {'action': 'block', 'url_patterns': ['*/piwik.js*', '*/matomo.js*', '*/gtag/js*']},
+    {'action': 'cache', 'resource_types': cached_resource_types},
+]
+# Rules of specific domains, they are checked before the general rules.
+# E.g. {'example.gov.si': [{'action': 'allow', 'resource_types': ['font']}]}
+site_interception_rules = {}
+# File extensions of resource types, used for blocking resource types by the browser.
+resource_type_extensions = {
+    'image': ['jpg', 'jpeg', 'jfif', 'pjpeg', 'pjp', 'png', 'apng', 'avif', 'gif', 'webp', 'svg', 'ico', 'cur', 'bmp',
+              'tif', 'tiff'],
+    'font': ['woff', 'woff2', 'ttf', 'otf', 'eot'],
+    'media': ['mp4', 'webm', 'ogg', 'ogv', 'mp3', 'wav', 'flac', 'aac', 'm4a', 'mov', 'avi'],
+    'stylesheet': ['css'],
+    'script': ['js', 'mjs'],
+}
+# Route all requests to Python, so resource types are also blocked for urls with an unknown file extension.
+INTERCEPTION_STRICT_RESOURCE_TYPES = False
+# Directory of the shared subresource cache.
+RESOURCE_CACHE_DIR = 'cache/resources'
+# Maximum size of the shared subresource cache in bytes.
+RESOURCE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Maximum size of a single cached subresource in bytes.
+RESOURCE_CACHE_MAX_ENTRY_SIZE = 5 * 1024 * 1024
+# Maximum time in seconds a subresource without explicit freshness headers is cached.
+RESOURCE_CACHE_MAX_HEURISTIC_TTL = 24 * 60 * 60
+# Frontier ordering policy: 'bfs' (breadth first), 'best-first' (url score) or 'fair' (round robin over hosts).
+FRONTIER_POLICY = 'best-first'
+# Path segments that usually lead to pagination, archives or other low value pages.
+low_value_segments_regex = re.compile(r"^(page|stran|p|arhiv|archive|iskanje|search|tag|oznaka|print|tisk)$|^\d+$")
+# Time in seconds resolved site ip addresses are cached.
+DNS_CACHE_TTL = 60 * 60
+# File with snapshots of the in-memory crawl state.
+CHECKPOINT_PATH = 'checkpoint.msgpack'
+# How often in seconds the in-memory crawl state is saved.
+CHECKPOINT_INTERVAL = 60
+# Checkpoints older than this (in seconds) are ignored on startup.
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+# Maximum size of a downloaded image in bytes.
+IMAGE_MAX_SIZE = 2 * 1024 * 1024
+# Maximum number of images downloaded from the same host at once.
+IMAGE_MAX_HOST_CONCURRENCY = 2
+# Number of concurrent image downloads per thread.
+IMAGE_FETCH_WORKERS = 4
+# Directory where downloaded documents are stored.
+DOCUMENT_STORAGE_DIR = 'storage/documents'
+# Maximum document size in bytes by data type, documents of types not listed here are not downloaded.
+DOCUMENT_MAX_SIZES = {'PDF': 200 * 1024 * 1024,
+                      'DOC': 50 * 1024 * 1024,
+                      'DOCX': 50 * 1024 * 1024,
+                      'PPT': 100 * 1024 * 1024,
+                      'PPTX': 100 * 1024 * 1024,
+                      'XLSX': 50 * 1024 * 1024,
+                      'XLSM': 50 * 1024 * 1024}
+# Maximum number of documents downloaded at once by all threads.
+DOCUMENT_DOWNLOAD_CONCURRENCY = 4
+# Number of document download tasks per thread.
+DOCUMENT_DOWNLOAD_WORKERS = 2
+# Number of attempts for downloading a document, interrupted downloads are resumed.
+DOCUMENT_DOWNLOAD_ATTEMPTS = 3
+# Size of chunks in which documents are streamed to files.
+DOCUMENT_CHUNK_SIZE = 256 * 1024
+# PageRank damping factor, convergence tolerance (sum of rank changes) and maximum number of iterations.
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-6
+PAGERANK_MAX_ITERATIONS = 100
+# Directory of exported crawl results.
+EXPORT_DIR = 'exports'
+# Number of threads exporting separate page id ranges.
+EXPORT_WORKERS = 4
+# Number of rows streamed from the database at once.
+EXPORT_BATCH_SIZE = 1000
+# Results are exported until this many seconds ago, because pages are saved a while after their accessed time
+# (once they are fetched and parsed). It has to be longer than crawling the slowest page.
+EXPORT_SETTLE_TIME = 10 * 60
+# A new WARC file is started once the current one is larger than this (in bytes).
+WARC_MAX_SIZE = 1024 * 1024 * 1024
+# Software written to WARC files.
+WARC_SOFTWARE = 'gov.si-crawler-playwright'
+# Fetch mode: 'live' (network only), 'record' (network, responses are saved to the fetch archive)
+# or 'replay' (responses are served from the fetch archive without touching the network).
+FETCH_MODE = 'live'
+# File of the fetch archive with recorded pages, downloads, robots.txt files, sitemaps and DNS lookups.
+FETCH_ARCHIVE_PATH = 'archives/fetch.sqlite'
+# Directory of CPU profiles, memory snapshots and slow page logs, each profiling run writes to its own directory.
+PROFILING_DIR = 'profiles'
+# Whether profiling is enabled at startup, it can be switched on and off at runtime with the SIGUSR1 signal.
+PROFILING_ENABLED = False
+# Time in seconds between samples of spider thread stacks.
+PROFILE_SAMPLE_INTERVAL = 0.01
+# How often in seconds collected stack samples are written to files.
+PROFILE_WRITE_INTERVAL = 60
+# A memory snapshot is taken every this many crawled pages.
+MEMORY_SNAPSHOT_PAGES = 500
+# Number of frames stored for each traced memory allocation.
+MEMORY_SNAPSHOT_FRAMES = 10
+# Pages that took longer than this (in seconds) to crawl are written to the slow page log.
+SLOW_PAGE_THRESHOLD = 20
+# How often in seconds changes of crawl statistics are saved to the database.
+STATS_FLUSH_INTERVAL = 10
+# Maximum number of pages crawled or waiting in the frontier per host.
+HOST_MAX_PAGES = 50000
+# Maximum depth of pages crawled per host.
+HOST_MAX_DEPTH = 25
+# Crawl budgets of specific hosts (without www.) that override the defaults above,
+# e.g. {'e-uprava.gov.si': {'max_pages': 200000, 'max_depth': 10}}.
+host_crawl_budgets = {}
+# Maximum number of frontier entries per host, further links of the host are spilled over and added back
+# to the frontier once most of the host's entries are crawled.
+HOST_MAX_FRONTIER = 5000
+# Urls with more path segments are considered crawler traps.
+MAX_PATH_SEGMENTS = 15
+# Urls with a path segment repeated more times are considered crawler traps (e.g. /a/b/a/b/a/b/).
+MAX_SEGMENT_REPEATS = 2
+# Maximum number of urls of a host that only differ in numbers or ids (e.g. calendar days or pages of results).
+MAX_URLS_PER_PATTERN = 1000
+# Path segments that are replaced with a placeholder in url patterns: numbers (optionally with an extension), dates,
+# hex ids and uuids. Slugs that only contain numbers (e.g. dated news titles) are kept.
+pattern_segment_regex = re.compile(r"^\d+(\.\w+)?$|^\d{1,4}([-_.]\d{1,4}){1,2}$|^[0-9a-f]{16,}$"
+                                   r"|^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
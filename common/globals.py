@@ -1,10 +1,62 @@
 import threading
 
+from common.constants import DOCUMENT_DOWNLOAD_CONCURRENCY
+
 # A set with domains next available times.
 domain_available_times = {}
 # A set with ip next available times.
 ip_available_times = {}
 # Lock for accessing  domain_available_times and ip_available_times by multiple threads.
 lock = threading.Lock()
+# Adapted delays between requests and average response times by domain.
+domain_crawl_rates = {}
+# Circuit breaker state by domain (consecutive failures, open until time, probing, number of openings).
+circuit_breakers = {}
+# Known redirects, final canonical url by source url.
+redirects = {}
 # Remember for each thread whether is sleeping (False) or running (True).
 threads_status = {}
+# Condition used for waking up sleeping threads when new links are added to the frontier.
+frontier_condition = threading.Condition()
+# Frontier version is incremented on every frontier insert, finished is set once the crawl has run out of work.
+frontier_state = {'version': 0, 'finished': False}
+# Saved sites by domain (id, domain, robots_content, sitemap_content), shared by all threads.
+site_cache = {}
+# Parsed robots.txt files by domain.
+robots_parsers = {}
+# Locks that allow only one thread to create a new site (and request its robots.txt).
+site_locks = {}
+# Fingerprints of urls that are already saved in the database.
+known_url_fingerprints = set()
+# Lock for creating entries in site_locks.
+cache_lock = threading.Lock()
+# Startup times used for reporting time to first page and time to full throughput.
+startup_times = {'started': None, 'first_page': None, 'full_throughput': None, 'threads': set()}
+# Link counts per wait strategy of probed pages by domain, used for learning site's wait strategy.
+wait_strategy_samples = {}
+# Learned wait strategies by domain that still have to be saved to the database.
+learned_wait_strategies = {}
+# Number of links added to the frontier by host, used by the fair frontier policy.
+host_frontier_counts = {}
+# Number of admitted frontier urls by host and url pattern (urls that only differ in numbers or ids).
+url_pattern_counts = {}
+# Resolved ip addresses and their expiration times by hostname.
+dns_cache = {}
+# Content hashes of downloaded images by url.
+image_url_hashes = {}
+# Content hashes, sizes and storage paths of downloaded documents by url.
+document_url_downloads = {}
+# Locks held while downloading a document by url, so the same document isn't downloaded twice at once.
+document_url_locks = {}
+# Semaphores limiting concurrent downloads by host.
+host_semaphores = {}
+# Limits the number of documents downloaded at once by all threads.
+document_download_semaphore = threading.BoundedSemaphore(DOCUMENT_DOWNLOAD_CONCURRENCY)
+# Profiling state, the directory of the current profiling run and the number of pages crawled during it.
+profiling_state = {'enabled': False, 'run_dir': None, 'crawled_pages': 0, 'sampler': None}
+# Crawl statistics by (group, key), e.g. ('page_type', 'HTML'), ('host', 'gov.si') or ('status', '200').
+crawl_stats = {}
+# Changes of crawl statistics that haven't been saved to the database yet.
+crawl_stat_changes = {}
+# Number of recorded or replayed fetch archive requests by (kind, url), so retries are archived as separate attempts.
+fetch_attempts = {}
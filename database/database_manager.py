@@ -1,14 +1,29 @@
 import threading
 from asyncio import current_task
 from datetime import datetime
+from urllib.parse import urlparse
 
-from sqlalchemy import select, Result, update, exc, delete
+from sqlalchemy import select, Result, update, exc, delete, literal, exists, Integer, or_, true, String, and_, \
+    BigInteger, values, column, case
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncEngine, AsyncSession, \
     async_scoped_session
+from sqlalchemy.orm import aliased
 from sqlalchemy.sql.functions import func
 
-from database.models import PageData, meta, Page, Site, Link, Image
+from database.models import PageData, meta, Page, Site, Link, Image, Frontier, ImageContent, PageMetrics, \
+    SiteMetrics, Redirect, CrawlStat, FrontierSpill
 from logger.logger import logger
+from services.crawl_stats import count_frontier_change, count_page_type_change
+from util.util import url_fingerprint
+
+
+def url_is(table, url: str):
+    """
+    Matches the row of the url by the url's hash, or by the url if the row was saved without a hash.
+    """
+    return or_(and_(table.url_hash == url_fingerprint(url), table.url == url),
+               and_(table.url_hash.is_(None), table.url == url))
 
 
 class DatabaseManager:
@@ -65,21 +80,96 @@ class DatabaseManager:
             await conn.run_sync(meta.drop_all)
         logger.debug('Finished deleting database tables.')
 
-    async def pop_frontier(self) -> tuple[int, str]:
+    async def pop_frontier(self, excluded_domains: set[str] = None,
+                           blocked_domains: set[str] = None) -> tuple[int, str, int, int]:
         """
-        Pops the first page off the frontier.
+        Pops the highest priority entry off the frontier and promotes it to a page.
+        Entries of excluded domains (e.g. domains that have to be waited for) are only popped
+        if there is nothing else in the frontier. Entries of blocked domains (e.g. domains with an open circuit)
+        and entries waiting for a retry are skipped.
+        Returns page's id, url, depth and the number of failed attempts.
         """
         logger.debug('Getting the top of the frontier.')
         async with self.async_session_factory()() as session:
-            page: Page = (await session.execute(
-                select(Page).where(Page.page_type_code == "FRONTIER").limit(1).with_for_update())).scalars().first()
-            logger.debug('Got the top of the frontier.')
-            if page is not None:
-                page_id, page_url = page.id, page.url
-                await session.execute(update(Page).where(Page.id == page.id).values(page_type_code='CRAWLING'))
+            while True:
+                query = select(Frontier) \
+                    .where(or_(Frontier.next_attempt_time.is_(None), Frontier.next_attempt_time <= datetime.now())) \
+                    .order_by(Frontier.priority.desc(), Frontier.id).limit(1)
+                if blocked_domains:
+                    query = query.where(Frontier.domain.notin_(blocked_domains))
+                entry: Frontier = None
+                if excluded_domains:
+                    entry = (await session.execute(
+                        query.where(Frontier.domain.notin_(excluded_domains))
+                        .with_for_update(skip_locked=True))).scalars().first()
+                if entry is None:
+                    entry = (await session.execute(query.with_for_update(skip_locked=True))).scalars().first()
+                logger.debug('Got the top of the frontier.')
+                if entry is None:
+                    logger.debug('Frontier is empty')
+                    return None
+
+                url, depth, from_page_id, attempts = entry.url, entry.depth, entry.from_page_id, entry.attempts
+                domain = entry.domain
+                discovered_time = entry.discovered_time
+                await session.execute(delete(Frontier).where(Frontier.id == entry.id))
+                page_id = await self.insert_by_url(
+                    session=session, table=Page, url=url,
+                    build_insert=lambda url_hash: insert(Page).values(url=url, url_hash=url_hash,
+                                                                      page_type_code='CRAWLING', depth=depth,
+                                                                      discovered_time=discovered_time))
+                if page_id is None:
+                    # The page was already created (e.g. as a redirect target), so the entry is just removed.
+                    logger.debug('Frontier entry is already a page, removing it.')
+                    await session.commit()
+                    count_frontier_change(domain=domain, change=-1)
+                    continue
+                if from_page_id is not None:
+                    session.add(Link(from_page=from_page_id, to_page=page_id))
                 await session.commit()
-                return page_id, page_url
-            logger.debug('Frontier is empty')
+                count_frontier_change(domain=domain, change=-1)
+                count_page_type_change(old_page_type=None, new_page_type='CRAWLING', url=url)
+                return page_id, url, depth, attempts
+
+    async def get_next_attempt_time(self) -> datetime:
+        """
+        Gets the earliest future time a frontier entry waiting for a retry can be crawled
+        or None if there are no such entries.
+        """
+        logger.debug('Getting the next frontier retry time.')
+        async with self.async_session_factory()() as session:
+            result: datetime = await session.scalar(
+                select(func.min(Frontier.next_attempt_time)).where(Frontier.next_attempt_time > datetime.now()))
+            logger.debug('Got the next frontier retry time.')
+
+            return result
+
+    async def requeue_page(self, page_id: int, priority: float, attempts: int, next_attempt_time: datetime):
+        """
+        Moves a page that failed to be crawled back to the frontier, so it can be retried later.
+        The link to the page is saved again once the entry is popped.
+        """
+        logger.debug('Moving a page back to the frontier.')
+        async with self.async_session_factory()() as session:
+            url, depth, discovered_time, page_type_code = (await session.execute(
+                select(Page.url, Page.depth, Page.discovered_time, Page.page_type_code)
+                .where(Page.id == page_id))).one()
+            from_page_id = await session.scalar(select(func.min(Link.from_page)).where(Link.to_page == page_id))
+            await session.execute(delete(Link).where(Link.to_page == page_id))
+            await session.execute(delete(Page).where(Page.id == page_id))
+            domain = urlparse(url).netloc.replace('www.', '')
+            frontier_id = await self.insert_by_url(
+                session=session, table=Frontier, url=url,
+                build_insert=lambda url_hash: insert(Frontier).values(
+                    url=url, url_hash=url_hash, domain=domain, depth=depth or 0, priority=priority,
+                    discovered_time=discovered_time or datetime.now(), from_page_id=from_page_id,
+                    attempts=attempts, next_attempt_time=next_attempt_time))
+            await session.commit()
+            count_page_type_change(old_page_type=page_type_code, new_page_type=None, url=url)
+            if frontier_id is not None:
+                count_frontier_change(domain=domain)
+
+            logger.debug('Page moved back to the frontier.')
 
     async def get_frontier_links(self) -> set[str]:
         """
@@ -87,7 +177,7 @@ class DatabaseManager:
         """
         logger.debug('Getting links from the frontier.')
         async with self.async_session_factory()() as session:
-            result: Result = await session.execute(select(Page.url).where(Page.page_type_code == "FRONTIER"))
+            result: Result = await session.execute(select(Frontier.url))
             logger.debug('Got links from the frontier.')
 
             return set([url for url in result.scalars()])
@@ -104,35 +194,225 @@ class DatabaseManager:
 
             return result
 
-    async def remove_from_frontier(self, page_id: int):
+    async def get_crawl_stats(self) -> dict[(str, str), int]:
+        """
+        Gets saved crawl statistics by (group, key).
+        """
+        logger.debug('Getting crawl statistics.')
+        async with self.async_session_factory()() as session:
+            result: Result = await session.execute(select(CrawlStat.group, CrawlStat.key, CrawlStat.count))
+            logger.debug('Got crawl statistics.')
+
+            return {(group, key): count for group, key, count in result}
+
+    async def add_crawl_stat_changes(self, changes: dict[(str, str), int]):
+        """
+        Adds changes to saved crawl statistics.
+        """
+        logger.debug('Saving crawl statistics.')
+        async with self.async_session_factory()() as session:
+            statement = insert(CrawlStat).values([{'group': group, 'key': key, 'count': change}
+                                                  for (group, key), change in sorted(changes.items())])
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=['group', 'key'],
+                set_={'count': CrawlStat.count + statement.excluded.count}))
+            await session.commit()
+            logger.debug('Crawl statistics saved.')
+
+    async def recount_crawl_stats(self):
+        """
+        Replaces saved crawl statistics with statistics counted from the crawled pages and the frontier.
+        """
+        logger.debug('Recounting crawl statistics.')
+        domain = func.regexp_replace(func.substring(Page.url, '://([^/:]+)'), '^www\\.', '')
+        async with self.async_session_factory()() as session:
+            await session.execute(delete(CrawlStat))
+            await session.execute(insert(CrawlStat).from_select(
+                ['group', 'key', 'count'],
+                select(literal('page_type'), Page.page_type_code, func.count()).group_by(Page.page_type_code)))
+            finished = Page.page_type_code.notin_(['CRAWLING'])
+            hosts = select(domain.label('domain')).where(finished).subquery()
+            await session.execute(insert(CrawlStat).from_select(
+                ['group', 'key', 'count'],
+                select(literal('host'), hosts.c.domain, func.count()).where(hosts.c.domain.isnot(None))
+                .group_by(hosts.c.domain)))
+            await session.execute(insert(CrawlStat).from_select(
+                ['group', 'key', 'count'],
+                select(literal('status'), func.cast(Page.http_status_code, String), func.count())
+                .where(finished, Page.http_status_code.isnot(None)).group_by(Page.http_status_code)))
+            await session.execute(insert(CrawlStat).from_select(
+                ['group', 'key', 'count'],
+                select(literal('frontier'), literal('size'), func.count()).select_from(Frontier)))
+            for group, table in [('host_frontier', Frontier), ('host_spill', FrontierSpill)]:
+                await session.execute(insert(CrawlStat).from_select(
+                    ['group', 'key', 'count'],
+                    select(literal(group), table.domain, func.count()).group_by(table.domain)))
+            await session.commit()
+            logger.debug('Crawl statistics recounted.')
+
+    async def backfill_url_hashes(self, table, batch_size: int = 10000) -> int:
+        """
+        Hashes urls of rows that were saved without a hash (e.g. before urls were hashed), in batches by id.
+        Rows whose hash collides with another url are left without it, so they are still found by the url.
+        Returns the number of hashed rows.
+        """
+        logger.debug(f'Backfilling url hashes of {table.__tablename__}.')
+        hashed, other = table.__table__, table.__table__.alias('other')
+        last_id, n_hashed = 0, 0
+        while True:
+            async with self.async_engine().begin() as conn:
+                rows = (await conn.execute(
+                    select(table.id, table.url).where(table.url_hash.is_(None), table.id > last_id)
+                    .order_by(table.id).limit(batch_size))).all()
+                if len(rows) == 0:
+                    break
+                last_id = rows[-1].id
+                hashes = values(column('id', Integer), column('url_hash', BigInteger), name='hashes') \
+                    .data([(row.id, url_fingerprint(row.url)) for row in rows])
+                # Only the first row of each hash gets it and only if no other row has it already.
+                first_hashes = select(hashes.c.id, hashes.c.url_hash).distinct(hashes.c.url_hash) \
+                    .order_by(hashes.c.url_hash, hashes.c.id).subquery()
+                result = await conn.execute(
+                    update(hashed)
+                    .where(hashed.c.id == first_hashes.c.id,
+                           ~exists().where(other.c.url_hash == first_hashes.c.url_hash))
+                    .values(url_hash=first_hashes.c.url_hash))
+                n_hashed += result.rowcount
+        logger.debug(f'Backfilled {n_hashed} url hashes of {table.__tablename__}.')
+        return n_hashed
+
+    async def remove_from_frontier(self, frontier_id: int):
         """
         Removes a link from frontier.
         """
         logger.debug('Removing a link from the frontier.')
         async with self.async_session_factory()() as session:
-            await session.execute(delete(Page).where(Page.id == page_id))
+            domain = await session.scalar(delete(Frontier).where(Frontier.id == frontier_id).returning(Frontier.domain))
             await session.commit()
+            if domain is not None:
+                count_frontier_change(domain=domain, change=-1)
 
             logger.debug('Link removed from the frontier.')
 
-    async def add_to_frontier(self, link: str):
+    async def add_to_frontier(self, link: str, depth: int, priority: float, from_page_id: int = None,
+                              spill: bool = False):
         """
-        Adds a new link to the frontier.
+        Adds a new link to the frontier, unless it's already in the frontier or saved as a page.
+        Links of hosts with too many frontier entries are spilled over to a separate table instead.
+        Returns frontier entry's id or None if the link wasn't added.
         """
         logger.debug('Adding a link to the frontier.')
+        domain = urlparse(link).netloc.replace('www.', '')
+        table = FrontierSpill if spill else Frontier
+        discovered_time = datetime.now()
+
+        def build_insert(url_hash: int):
+            query = select(literal(link), literal(url_hash, BigInteger), literal(domain), literal(depth),
+                           literal(priority), literal(discovered_time), literal(from_page_id, Integer)) \
+                .where(~exists().where(url_is(Page, link)))
+            if spill:
+                query = query.where(~exists().where(url_is(Frontier, link)))
+            return insert(table).from_select(
+                ['url', 'url_hash', 'domain', 'depth', 'priority', 'discovered_time', 'from_page_id'], query)
+
         async with self.async_session_factory()() as session:
-            try:
-                page: Page = Page(url=link, page_type_code='FRONTIER')
-                session.add(page)
-                await session.flush()
-                page_id = page.id
-                await session.commit()
-                logger.debug('Added link to the frontier.')
-                return page_id
-            except exc.IntegrityError:
-                await session.rollback()
+            frontier_id = await self.insert_by_url(session=session, table=table, url=link,
+                                                   build_insert=build_insert)
+            await session.commit()
+            if frontier_id is None:
                 logger.debug('Adding link failed because its already in the frontier.')
                 return None
+            count_frontier_change(domain=domain, spilled=spill)
+            logger.debug('Added link to the frontier.')
+            return frontier_id
+
+    async def is_frontier_empty(self) -> bool:
+        """
+        Checks whether the frontier has no entries, including entries waiting for a retry.
+        """
+        logger.debug('Checking whether the frontier is empty.')
+        async with self.async_session_factory()() as session:
+            frontier_id = await session.scalar(select(Frontier.id).limit(1))
+            logger.debug('Checked whether the frontier is empty.')
+            return frontier_id is None
+
+    async def unspill_frontier(self, limit: int, domain: str = None, excluded_domains: set[str] = None) -> int:
+        """
+        Moves the highest priority spilled links of the domain (or of any domain but the excluded ones)
+        back to the frontier.
+        Returns the number of links added to the frontier.
+        """
+        logger.debug('Moving spilled links back to the frontier.')
+        async with self.async_session_factory()() as session:
+            query = select(FrontierSpill.id).order_by(FrontierSpill.priority.desc()).limit(limit) \
+                .with_for_update(skip_locked=True)
+            if domain is not None:
+                query = query.where(FrontierSpill.domain == domain)
+            if excluded_domains:
+                query = query.where(FrontierSpill.domain.notin_(excluded_domains))
+            spilled = (await session.execute(
+                delete(FrontierSpill).where(FrontierSpill.id.in_(query.scalar_subquery()))
+                .returning(FrontierSpill.url, FrontierSpill.url_hash, FrontierSpill.domain, FrontierSpill.depth,
+                           FrontierSpill.priority, FrontierSpill.discovered_time, FrontierSpill.from_page_id))).all()
+            added_domains = []
+            if len(spilled) > 0:
+                added = (await session.execute(
+                    insert(Frontier)
+                    .values([dict(url=entry.url, url_hash=entry.url_hash, domain=entry.domain, depth=entry.depth,
+                                  priority=entry.priority, discovered_time=entry.discovered_time,
+                                  from_page_id=entry.from_page_id)
+                             for entry in spilled])
+                    .on_conflict_do_nothing()
+                    .returning(Frontier.url, Frontier.domain))).all()
+                added_urls = {row.url for row in added}
+                added_domains = [row.domain for row in added]
+                # Links that weren't added are usually already in the frontier, the rest collided with another url.
+                for entry in spilled:
+                    if entry.url in added_urls:
+                        continue
+                    frontier_id = await self.insert_by_url(
+                        session=session, table=Frontier, url=entry.url,
+                        build_insert=lambda url_hash, entry=entry: insert(Frontier).values(
+                            url=entry.url, url_hash=url_hash, domain=entry.domain, depth=entry.depth,
+                            priority=entry.priority, discovered_time=entry.discovered_time,
+                            from_page_id=entry.from_page_id))
+                    if frontier_id is not None:
+                        added_domains.append(entry.domain)
+            await session.commit()
+            for entry in spilled:
+                count_frontier_change(domain=entry.domain, change=-1, spilled=True)
+            for added_domain in added_domains:
+                count_frontier_change(domain=added_domain)
+
+            logger.debug(f'Moved {len(added_domains)} spilled links back to the frontier.')
+            return len(added_domains)
+
+    @staticmethod
+    async def insert_by_url(session: AsyncSession, table, url: str, build_insert) -> int:
+        """
+        Inserts a row keyed by the url's hash, build_insert builds the insert statement with the given hash.
+        If another url already has the same hash, the row is inserted without a hash, so it's found by its url.
+        Returns the row's id or None if the url is already saved (or the insert's conditions weren't met).
+        """
+        url_hash = url_fingerprint(url)
+        row_id = await session.scalar(build_insert(url_hash).on_conflict_do_nothing().returning(table.id))
+        if row_id is None and await session.scalar(select(table.url).where(table.url_hash == url_hash)) \
+                not in [None, url]:
+            logger.info(f'Hash of url {url} collides with another url, saving it without the hash.')
+            row_id = await session.scalar(build_insert(None).on_conflict_do_nothing().returning(table.id))
+        return row_id
+
+    @staticmethod
+    async def change_page(session: AsyncSession, page_id: int, values: dict) -> (str, str):
+        """
+        Updates a page and returns its previous page type and url (or None if the page doesn't exist),
+        so crawl statistics can be counted. The previous values are read in the same statement.
+        """
+        page = Page.__table__
+        old_page = select(page.c.id, page.c.page_type_code).where(page.c.id == page_id).with_for_update().subquery()
+        row = (await session.execute(update(page).where(page.c.id == old_page.c.id).values(**values)
+                                     .returning(old_page.c.page_type_code, page.c.url))).first()
+        return (row.page_type_code, row.url) if row is not None else (None, None)
 
     async def update_page(self, page_id: int, status: int, site_id: int, accessed_time: datetime, html: str = None,
                           html_hash: str = None,
@@ -142,14 +422,15 @@ class DatabaseManager:
         """
         logger.debug('Updating page in the database.')
         async with self.async_session_factory()() as session:
-            await session.execute(
-                update(Page).where(Page.id == page_id).values(page_type_code=page_type_code,
-                                                              html_content=html,
-                                                              http_status_code=status,
-                                                              site_id=site_id,
-                                                              html_content_hash=html_hash,
-                                                              accessed_time=accessed_time))
+            old_page_type, url = await self.change_page(session=session, page_id=page_id,
+                                                        values=dict(page_type_code=page_type_code,
+                                                                    html_content=html,
+                                                                    http_status_code=status,
+                                                                    site_id=site_id,
+                                                                    html_content_hash=html_hash,
+                                                                    accessed_time=accessed_time))
             await session.commit()
+            count_page_type_change(old_page_type=old_page_type, new_page_type=page_type_code, url=url, status=status)
 
             logger.debug('Page updated.')
 
@@ -165,39 +446,80 @@ class DatabaseManager:
         """
         logger.debug('Updating redirect page in the database.')
         async with self.async_session_factory()() as session:
-            await session.execute(
-                update(Page).where(Page.id == page_id).values(page_type_code=page_type_code,
-                                                              http_status_code=status,
-                                                              site_id=site_id,
-                                                              accessed_time=accessed_time))
+            old_page_type, url = await self.change_page(session=session, page_id=page_id,
+                                                        values=dict(page_type_code=page_type_code,
+                                                                    http_status_code=status,
+                                                                    site_id=site_id,
+                                                                    accessed_time=accessed_time))
             await session.commit()
+            count_page_type_change(old_page_type=old_page_type, new_page_type=page_type_code, url=url, status=status)
 
             logger.debug('Page updated.')
 
-    async def create_new_page(self, url: str, site_id: int, page_type_code: str = 'FRONTIER') -> int:
+    async def create_new_page(self, url: str, site_id: int, page_type_code: str = 'CRAWLING') -> int:
         """
         Creates an empty page with only the url and site_id, which is then filled in later.
-        This is used for on-the-fly page saves, usually they would and should be created when adding to frontier.
+        This is used for on-the-fly page saves, usually they would and should be created when popping the frontier.
+        The url is removed from the frontier, because it doesn't have to be crawled anymore.
         Return the page's id.
         """
         logger.debug('Saving new page to the database.')
         page_id: int
         async with self.async_session_factory()() as session:
-            try:
-                page: Page = Page(site_id=site_id, url=url, page_type_code=page_type_code)
-                session.add(page)
-                await session.flush()
-                page_id = page.id
-                await session.commit()
-                logger.debug(f'New page saved to the database.')
-            except exc.IntegrityError:
-                await session.rollback()
+            page_id = await self.insert_by_url(
+                session=session, table=Page, url=url,
+                build_insert=lambda url_hash: insert(Page).values(site_id=site_id, url=url, url_hash=url_hash,
+                                                                  page_type_code=page_type_code))
+            if page_id is None:
                 logger.debug('Adding page failed because it already exists in the database.')
-                page: Page = (await session.execute(
-                    select(Page).where(Page.url == url).limit(1))).scalars().first()
-                page_id = page.id
+                page_id = await session.scalar(select(Page.id).where(url_is(Page, url)))
+                await session.commit()
+                return page_id
+            result = await session.execute(delete(Frontier).where(url_is(Frontier, url)))
+            await session.commit()
+            count_frontier_change(domain=urlparse(url).netloc.replace('www.', ''), change=-result.rowcount)
+            count_page_type_change(old_page_type=None, new_page_type=page_type_code, url=url)
+            logger.debug(f'New page saved to the database.')
+            return page_id
+
+    async def get_page_id(self, url: str) -> int:
+        """
+        Gets the id of the page with the url or None if the page doesn't exist.
+        """
+        logger.debug('Getting page id from the database.')
+        async with self.async_session_factory()() as session:
+            page_id: int = await session.scalar(select(Page.id).where(url_is(Page, url)))
+            logger.debug('Got page id from the database.')
+
             return page_id
 
+    async def save_redirect(self, source_url: str, target_url: str):
+        """
+        Saves a redirect. Redirects to the source url are changed to point to the target url, so chains are collapsed.
+        """
+        logger.debug('Saving redirect to the database.')
+        async with self.async_session_factory()() as session:
+            await session.execute(
+                update(Redirect).where(Redirect.target_url == source_url).values(target_url=target_url))
+            await session.execute(
+                insert(Redirect)
+                .values(source_url=source_url, target_url=target_url, discovered_time=datetime.now())
+                .on_conflict_do_update(index_elements=['source_url'], set_={'target_url': target_url}))
+            await session.commit()
+
+            logger.debug('Redirect saved to the database.')
+
+    async def stream_redirects(self, batch_size: int = 10000):
+        """
+        Streams all saved redirects in batches using a server side cursor.
+        """
+        logger.debug('Streaming redirects from the database.')
+        async with self.async_session_factory()() as session:
+            result = await session.stream(select(Redirect.source_url, Redirect.target_url))
+            async for partition in result.partitions(batch_size):
+                yield partition
+            logger.debug('Streaming redirects finished.')
+
     async def save_site(self, domain: str, robots_content: str, sitemap_content) -> int:
         """
         Saves a visited site to the database.
@@ -224,7 +546,7 @@ class DatabaseManager:
                 site_id = site.id
             return site_id
 
-    async def get_site(self, domain: str) -> (int, str, str, str):
+    async def get_site(self, domain: str) -> (int, str, str, str, str):
         """
         Gets the site from the database.
         """
@@ -237,11 +559,159 @@ class DatabaseManager:
             if page is not None:
                 logger.debug('Got the site from the database.')
 
-                return page.id, page.domain, page.robots_content, page.sitemap_content
+                return page.id, page.domain, page.robots_content, page.sitemap_content, page.wait_strategy
             logger.debug('The site hasnt been found in the database.')
 
             return None
 
+    async def get_sites(self) -> list[(int, str, str, str, str)]:
+        """
+        Gets all sites from the database.
+        """
+        logger.debug('Getting all sites from the database.')
+        async with self.async_session_factory()() as session:
+            result: Result = await session.execute(
+                select(Site.id, Site.domain, Site.robots_content, Site.sitemap_content, Site.wait_strategy))
+            logger.debug('Got all sites from the database.')
+
+            return [tuple(row) for row in result]
+
+    async def stream_url_hashes(self, batch_size: int = 10000):
+        """
+        Streams url hashes of all pages and frontier entries in batches using a server side cursor.
+        Rows saved without a hash (because of a collision or before they were backfilled) are hashed here.
+        """
+        logger.debug('Streaming url hashes from the database.')
+        async with self.async_session_factory()() as session:
+            for table in [Page, Frontier]:
+                result = await session.stream(select(table.url_hash).where(table.url_hash.is_not(None)))
+                async for partition in result.scalars().partitions(batch_size):
+                    yield partition
+                result = await session.stream(select(table.url).where(table.url_hash.is_(None)))
+                async for partition in result.scalars().partitions(batch_size):
+                    yield [url_fingerprint(url) for url in partition]
+            logger.debug('Streaming url hashes finished.')
+
+    async def stream_page_sites(self, batch_size: int = 100000):
+        """
+        Streams ids of all pages and their sites (-1 if the page has no site) in batches using a server side cursor.
+        """
+        logger.debug('Streaming page sites from the database.')
+        async with self.async_session_factory()() as session:
+            result = await session.stream(select(Page.id, func.coalesce(Page.site_id, -1)))
+            async for partition in result.partitions(batch_size):
+                yield partition
+            logger.debug('Streaming page sites finished.')
+
+    async def stream_links(self, batch_size: int = 100000):
+        """
+        Streams all links between pages in batches using a server side cursor.
+        """
+        logger.debug('Streaming links from the database.')
+        async with self.async_session_factory()() as session:
+            result = await session.stream(select(Link.from_page, Link.to_page))
+            async for partition in result.partitions(batch_size):
+                yield partition
+            logger.debug('Streaming links finished.')
+
+    async def save_link_graph_metrics(self, page_metrics, site_metrics):
+        """
+        Replaces saved link graph metrics. Rows are copied in bulk, so millions of pages are saved in seconds.
+        :param page_metrics: iterable of (page_id, in_degree, out_degree, pagerank, component) tuples
+        :param site_metrics: iterable of (site_id, pages, internal_links, outgoing_links, incoming_links,
+        linked_sites, pagerank) tuples
+        """
+        logger.debug('Saving link graph metrics to the database.')
+        async with self.async_engine().begin() as conn:
+            await conn.execute(delete(PageMetrics))
+            await conn.execute(delete(SiteMetrics))
+            raw_connection = await conn.get_raw_connection()
+            for table, records in [(PageMetrics.__table__, page_metrics), (SiteMetrics.__table__, site_metrics)]:
+                await raw_connection.driver_connection.copy_records_to_table(
+                    table.name,
+                    records=records,
+                    columns=[column.name for column in table.columns],
+                    schema_name=table.schema)
+        logger.debug('Link graph metrics saved to the database.')
+
+    async def get_export_page_id_range(self, since: datetime, until: datetime) -> (int, int):
+        """
+        Gets the lowest and the highest id of pages that were crawled or whose images or documents were downloaded
+        after since (if set) and not after until.
+        Returns None if there is nothing to export.
+        """
+        logger.debug('Getting exported page id range.')
+        async with self.async_session_factory()() as session:
+            ranges = [(await session.execute(
+                select(func.min(page_id), func.max(page_id))
+                .where(accessed_time <= until, accessed_time > since if since is not None else true()))).one()
+                      for page_id, accessed_time in [(Page.id, Page.accessed_time),
+                                                     (Image.page_id, Image.accessed_time),
+                                                     (PageData.page_id, PageData.accessed_time)]]
+            logger.debug('Got exported page id range.')
+
+            first_ids = [first_id for first_id, _ in ranges if first_id is not None]
+            last_ids = [last_id for _, last_id in ranges if last_id is not None]
+            if len(first_ids) == 0:
+                return None
+            return min(first_ids), max(last_ids)
+
+    async def stream_export_rows(self, table: str, since: datetime, until: datetime, first_page_id: int,
+                                 last_page_id: int, batch_size: int = 1000):
+        """
+        Streams rows of crawl results that changed after since (if set) and not after until
+        for pages with ids between first_page_id and last_page_id using a server side cursor.
+        :param table: 'page', 'link', 'image' or 'page_data'
+        """
+        logger.debug(f'Streaming exported {table} rows from the database.')
+        match table:
+            case 'page':
+                query = select(Page.id, Page.site_id, Site.domain, Page.page_type_code, Page.url,
+                               Page.http_status_code, Page.accessed_time, Page.depth, Page.discovered_time,
+                               Page.html_content_hash, Page.html_content) \
+                    .outerjoin(Site, Site.id == Page.site_id)
+                page_id, accessed_time = Page.id, Page.accessed_time
+            case 'link':
+                # Links are saved when their target is popped from the frontier (after the source was crawled)
+                # or when a redirect or duplicate source is crawled, so they are exported with the page of the link
+                # that was crawled last.
+                from_page, to_page = aliased(Page), aliased(Page)
+                query = select(Link.from_page, Link.to_page) \
+                    .join(from_page, from_page.id == Link.from_page).join(to_page, to_page.id == Link.to_page)
+                page_id = case((or_(from_page.accessed_time.is_(None),
+                                    to_page.accessed_time >= from_page.accessed_time), Link.to_page),
+                               else_=Link.from_page)
+                accessed_time = func.greatest(from_page.accessed_time, to_page.accessed_time)
+            case 'image':
+                query = select(Image.id, Image.page_id, Image.url, Image.filename, Image.content_type,
+                               Image.content_hash, Image.accessed_time)
+                # Images are downloaded after their page is saved, so they are exported by their own accessed time.
+                page_id, accessed_time = Image.page_id, Image.accessed_time
+            case 'page_data':
+                query = select(PageData.id, PageData.page_id, PageData.data_type_code, PageData.url,
+                               PageData.content_hash, PageData.size, PageData.storage_path, PageData.accessed_time)
+                page_id, accessed_time = PageData.page_id, PageData.accessed_time
+            case _:
+                raise ValueError(f'Table {table} can not be exported.')
+        query = query.where(page_id.between(first_page_id, last_page_id), accessed_time <= until,
+                            accessed_time > since if since is not None else true()).order_by(page_id)
+        async with self.async_session_factory()() as session:
+            result = await session.stream(query)
+            async for partition in result.partitions(batch_size):
+                yield partition
+            logger.debug(f'Streaming exported {table} rows finished.')
+
+    async def update_site_wait_strategy(self, site_id: int, wait_strategy: str):
+        """
+        Saves the page load wait strategy learned for the site.
+        """
+        logger.debug('Updating site wait strategy in the database.')
+        async with self.async_session_factory()() as session:
+            await session.execute(update(Site).where(Site.id == site_id).values(wait_strategy=wait_strategy))
+            await session.commit()
+
+            logger.debug('Site wait strategy updated.')
+
     async def check_pages_hash_collision(self, html_hash: str) -> (int, int):
         """
         Check the database for duplicate pages and return the original page's id.
@@ -276,35 +746,94 @@ class DatabaseManager:
             except exc.IntegrityError:
                 logger.debug('Adding duplicate link failed because it already exists in the database.')
 
-    async def save_images(self, images: list[Image]):
+    async def save_images(self, images: list[Image]) -> list[(int, str)]:
         """
         Saves new images to the database.
+        Returns ids and urls of the saved images.
         """
         logger.debug('Saving images to the database.')
         async with self.async_session_factory()() as session:
             session.add_all(images)
+            await session.flush()
+            saved_images = [(image.id, image.url) for image in images]
             await session.commit()
 
             logger.debug('Images saved to the database.')
+            return saved_images
+
+    async def save_image_content(self, image_id: int, content_hash: str, content_type: str = None,
+                                 data: bytes = None, accessed_time: datetime = None):
+        """
+        Links the image to its content. The content is saved only if it isn't in the database yet.
+        """
+        logger.debug('Saving image content to the database.')
+        async with self.async_session_factory()() as session:
+            if data is not None:
+                await session.execute(
+                    insert(ImageContent)
+                    .values(content_hash=content_hash, content_type=content_type, size=len(data), data=data)
+                    .on_conflict_do_nothing(index_elements=['content_hash']))
+            await session.execute(
+                update(Image).where(Image.id == image_id).values(content_hash=content_hash,
+                                                                 accessed_time=accessed_time or datetime.now()))
+            await session.commit()
+
+            logger.debug('Image content saved to the database.')
 
-    async def save_page_data(self, page_data_entries: list[PageData]):
+    async def save_page_data(self, page_data_entries: list[PageData]) -> list[(int, str, str)]:
         """
         Saves new page data to the database.
+        Returns ids, urls and data types of the saved entries.
         """
         logger.debug('Saving page data entries to the database.')
+        saved_entries = []
         async with self.async_session_factory()() as session:
             for page_data in page_data_entries:
                 try:
                     session.add(page_data)
-                    await session.commit()
+                    await session.flush()
                 except exc.IntegrityError:
                     await session.rollback()
                     logger.debug('Adding some of the documents failed, probably because we dont support them.')
                     page_data.data_type_code = 'UNKNOWN'
                     session.add(page_data)
-                    await session.commit()
+                    await session.flush()
+                saved_entries.append((page_data.id, page_data.url, page_data.data_type_code))
+                await session.commit()
 
             logger.debug('Page data entries saved to the database.')
+            return saved_entries
+
+    async def get_pending_page_data(self) -> list[(int, str, str)]:
+        """
+        Gets page data entries whose documents haven't been downloaded yet.
+        Returns ids, urls and data types of the entries.
+        """
+        logger.debug('Getting pending page data entries from the database.')
+        async with self.async_session_factory()() as session:
+            result: Result = await session.execute(
+                select(PageData.id, PageData.url, PageData.data_type_code)
+                .where(PageData.url.is_not(None), PageData.accessed_time.is_(None)))
+            logger.debug('Got pending page data entries from the database.')
+
+            return [tuple(row) for row in result]
+
+    async def update_page_data_content(self, page_data_id: int, accessed_time: datetime, content_hash: str = None,
+                                       size: int = None, storage_path: str = None):
+        """
+        Saves the location of a downloaded document.
+        Entries with an accessed time but without a content hash were skipped or failed to download.
+        """
+        logger.debug('Updating page data entry in the database.')
+        async with self.async_session_factory()() as session:
+            await session.execute(
+                update(PageData).where(PageData.id == page_data_id).values(content_hash=content_hash,
+                                                                           size=size,
+                                                                           storage_path=storage_path,
+                                                                           accessed_time=accessed_time))
+            await session.commit()
+
+            logger.debug('Page data entry updated.')
 
     async def mark_page_as_failed(self, page_id: int, site_id: int = None):
         """
@@ -312,12 +841,10 @@ class DatabaseManager:
         """
         logger.debug('Marking page as failed in the database.')
         async with self.async_session_factory()() as session:
-            if site_id is not None:
-                await session.execute(
-                    update(Page).where(Page.id == page_id).values(page_type_code="FAILED", site_id=site_id))
-            else:
-                await session.execute(
-                    update(Page).where(Page.id == page_id).values(page_type_code="FAILED"))
+            values = dict(page_type_code='FAILED', site_id=site_id) if site_id is not None \
+                else dict(page_type_code='FAILED')
+            old_page_type, url = await self.change_page(session=session, page_id=page_id, values=values)
             await session.commit()
+            count_page_type_change(old_page_type=old_page_type, new_page_type='FAILED', url=url)
 
             logger.debug('Page marked as failed.')
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, \
-    LargeBinary, MetaData
+    LargeBinary, MetaData, Float, Index, DDL, event, BigInteger
 from sqlalchemy.orm import relationship, declarative_base, Mapped
 
 meta = MetaData(schema="crawldb")
@@ -32,6 +32,7 @@ class Site(Base):
     domain = Column(String(500), unique=True)
     robots_content = Column(Text)
     sitemap_content = Column(Text)
+    wait_strategy = Column(String(20))
 
 
 class Page(Base):
@@ -40,16 +41,96 @@ class Page(Base):
     id: Mapped[int] = Column(Integer, primary_key=True)
     site_id: Mapped[int] = Column(ForeignKey('site.id', ondelete='RESTRICT'), index=True)
     page_type_code: Mapped[String] = Column(ForeignKey('page_type.code', ondelete='RESTRICT'), index=True)
-    url: Mapped[String] = Column(String(3000), unique=True)
+    url: Mapped[String] = Column(String(3000))
+    # 64-bit hash of the url, pages are looked up by it instead of the long url. Urls whose hash collides with
+    # another url are saved without it and are looked up by the url.
+    url_hash: Mapped[int] = Column(BigInteger)
     html_content: Mapped[String] = Column(Text)
     html_content_hash: Mapped[String] = Column(Text, unique=True)
     http_status_code: Mapped[int] = Column(Integer)
     accessed_time = Column(DateTime)
+    depth: Mapped[int] = Column(Integer)
+    discovered_time = Column(DateTime)
 
     page_type = relationship('PageType')
     site = relationship('Site')
     relationship(back_populates="parent")
 
+    __table_args__ = (
+        Index('page_url_hash_idx', url_hash, unique=True),
+        Index('page_url_fallback_idx', url, unique=True, postgresql_where=url_hash.is_(None)),
+    )
+
+
+class Frontier(Base):
+    """
+    Links waiting to be crawled. Entries are promoted to pages once they are crawled.
+    The table is kept narrow and without foreign keys, because rows are constantly inserted and deleted.
+    """
+    __tablename__ = 'frontier'
+
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    url: Mapped[String] = Column(String(3000), nullable=False)
+    # Hash of the url, the same as the page's url hash.
+    url_hash: Mapped[int] = Column(BigInteger)
+    domain: Mapped[String] = Column(String(500), nullable=False)
+    depth: Mapped[int] = Column(Integer, nullable=False)
+    priority: Mapped[float] = Column(Float, nullable=False)
+    discovered_time = Column(DateTime, nullable=False)
+    # Page on which the link was found, the link between pages is saved once the entry is promoted.
+    from_page_id: Mapped[int] = Column(Integer)
+    # Number of failed crawl attempts and the time before which the entry isn't retried.
+    attempts: Mapped[int] = Column(Integer, nullable=False, server_default='0')
+    next_attempt_time = Column(DateTime)
+
+    __table_args__ = (
+        Index('frontier_priority_idx', priority.desc(), id),
+        Index('frontier_url_hash_idx', url_hash, unique=True),
+        Index('frontier_url_fallback_idx', url, unique=True, postgresql_where=url_hash.is_(None)),
+    )
+
+
+class FrontierSpill(Base):
+    """
+    Links of hosts with too many frontier entries. They are moved back to the frontier once most of the host's
+    frontier entries are crawled, so one host can't flood the frontier.
+    """
+    __tablename__ = 'frontier_spill'
+
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    url: Mapped[String] = Column(String(3000), nullable=False)
+    url_hash: Mapped[int] = Column(BigInteger)
+    domain: Mapped[String] = Column(String(500), nullable=False)
+    depth: Mapped[int] = Column(Integer, nullable=False)
+    priority: Mapped[float] = Column(Float, nullable=False)
+    discovered_time = Column(DateTime, nullable=False)
+    from_page_id: Mapped[int] = Column(Integer)
+
+    __table_args__ = (
+        Index('frontier_spill_domain_priority_idx', domain, priority.desc()),
+        Index('frontier_spill_url_hash_idx', url_hash, unique=True),
+        Index('frontier_spill_url_fallback_idx', url, unique=True, postgresql_where=url_hash.is_(None)),
+    )
+
+
+# Vacuum the frontier often, because most of its rows are deleted soon after they are inserted.
+event.listen(Frontier.__table__, 'after_create',
+             DDL('ALTER TABLE %(fullname)s SET (autovacuum_vacuum_scale_factor = 0.01, '
+                 'autovacuum_vacuum_threshold = 1000, '
+                 'autovacuum_analyze_scale_factor = 0.02)'))
+
+
+class ImageContent(Base):
+    """
+    Downloaded image data. Each unique image is saved only once and referenced by all of its images.
+    """
+    __tablename__ = 'image_content'
+
+    content_hash: Mapped[String] = Column(String(64), primary_key=True, autoincrement=False)
+    content_type: Mapped[String] = Column(String(50))
+    size: Mapped[int] = Column(Integer)
+    data = Column(LargeBinary)
+
 
 class Image(Base):
     __tablename__ = 'image'
@@ -60,8 +141,11 @@ class Image(Base):
     content_type: Mapped[String] = Column(String(50))
     data = Column(LargeBinary)
     accessed_time = Column(DateTime)
+    url: Mapped[String] = Column(String(3000))
+    content_hash: Mapped[String] = Column(ForeignKey('image_content.content_hash', ondelete='RESTRICT'), index=True)
 
     page = relationship('Page')
+    image_content = relationship('ImageContent')
 
 
 class Link(Base):
@@ -81,6 +165,64 @@ class PageData(Base):
     page_id: Mapped[int] = Column(ForeignKey('page.id', ondelete='RESTRICT'), index=True)
     data_type_code: Mapped[String] = Column(ForeignKey('data_type.code', ondelete='RESTRICT'), index=True)
     data = Column(LargeBinary)
+    # Documents are streamed to files instead of the data column.
+    url: Mapped[String] = Column(String(3000))
+    content_hash: Mapped[String] = Column(String(64), index=True)
+    size: Mapped[int] = Column(BigInteger)
+    storage_path: Mapped[String] = Column(String(500))
+    accessed_time = Column(DateTime)
 
     data_type = relationship('DataType')
     page = relationship('Page')
+
+
+class Redirect(Base):
+    """
+    Known redirects from a url to the final canonical url. Chains are collapsed, so targets don't redirect.
+    """
+    __tablename__ = 'redirect'
+
+    source_url: Mapped[String] = Column(String(3000), primary_key=True)
+    target_url: Mapped[String] = Column(String(3000), nullable=False, index=True)
+    discovered_time = Column(DateTime, nullable=False)
+
+
+class PageMetrics(Base):
+    """
+    Link graph metrics of pages, calculated by analyze.py.
+    Pages with the same component are in the same strongly connected component.
+    """
+    __tablename__ = 'page_metrics'
+
+    page_id: Mapped[int] = Column(ForeignKey('page.id', ondelete='CASCADE'), primary_key=True)
+    in_degree: Mapped[int] = Column(Integer, nullable=False)
+    out_degree: Mapped[int] = Column(Integer, nullable=False)
+    pagerank: Mapped[float] = Column(Float, nullable=False)
+    component: Mapped[int] = Column(Integer, nullable=False, index=True)
+
+
+class SiteMetrics(Base):
+    """
+    Link graph metrics of sites, aggregated from their pages by analyze.py.
+    """
+    __tablename__ = 'site_metrics'
+
+    site_id: Mapped[int] = Column(ForeignKey('site.id', ondelete='CASCADE'), primary_key=True)
+    pages: Mapped[int] = Column(Integer, nullable=False)
+    internal_links: Mapped[int] = Column(Integer, nullable=False)
+    outgoing_links: Mapped[int] = Column(Integer, nullable=False)
+    incoming_links: Mapped[int] = Column(Integer, nullable=False)
+    linked_sites: Mapped[int] = Column(Integer, nullable=False)
+    pagerank: Mapped[float] = Column(Float, nullable=False)
+
+
+class CrawlStat(Base):
+    """
+    Crawl statistics that are maintained incrementally, e.g. number of pages by page type, host or status.
+    Counters are kept in memory and their changes are periodically added to this table.
+    """
+    __tablename__ = 'crawl_stat'
+
+    group: Mapped[String] = Column(String(20), primary_key=True)
+    key: Mapped[String] = Column(String(255), primary_key=True)
+    count: Mapped[int] = Column(BigInteger, nullable=False)
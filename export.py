@@ -0,0 +1,29 @@
+import asyncio
+
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from migrate import load_env
+from services.exporter import export_results
+
+
+async def main():
+    logger.info('Export started.')
+
+    # Load env variables.
+    postgres_user, postgres_password, postgres_db = load_env()
+
+    # Setup database manager.
+    database_manager = DatabaseManager(url=f"postgresql+asyncpg://"
+                                           f"{postgres_user}:"
+                                           f"{postgres_password}@localhost:5432/"
+                                           f"{postgres_db}")
+
+    await export_results(database_manager=database_manager)
+
+    # Clean database manager.
+    await database_manager.cleanup()
+    logger.info('Export finished.')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
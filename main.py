@@ -7,24 +7,26 @@ from database.database_manager import DatabaseManager
 from logger.logger import logger
 
 
-def load_env() -> (str, str, str, int):
+def load_env() -> (str, str, str, int, int):
     """
     Load ENV variables.
-    :return: postgres_user, postgres_password, postgres_db
+    :return: postgres_user, postgres_password, postgres_db, n_threads, n_browsers
     """
     load_dotenv()
     postgres_user = os.getenv('POSTGRES_USER')
     postgres_password = os.getenv('POSTGRES_PASSWORD')
     postgres_db = os.getenv('POSTGRES_DB')
     n_threads = int(os.getenv('N_THREADS'))
-    return postgres_user, postgres_password, postgres_db, n_threads
+    # By default one browser process is shared by up to 8 threads.
+    n_browsers = int(os.getenv('N_BROWSERS') or (n_threads + 7) // 8)
+    return postgres_user, postgres_password, postgres_db, n_threads, n_browsers
 
 
 async def main():
     logger.info('Application started.')
 
     # Load env variables.
-    postgres_user, postgres_password, postgres_db, n_threads = load_env()
+    postgres_user, postgres_password, postgres_db, n_threads, n_browsers = load_env()
 
     # Setup database manager.
     database_manager = DatabaseManager(url=f"postgresql+asyncpg://"
@@ -33,7 +35,7 @@ async def main():
                                            f"{postgres_db}")
 
     # Run the spider.
-    await setup_threads(database_manager=database_manager, n_threads=n_threads)
+    await setup_threads(database_manager=database_manager, n_threads=n_threads, n_browsers=n_browsers)
 
     logger.info('Application finished.')
 
@@ -1,13 +1,20 @@
 import asyncio
 import logging
 import os
+import sys
+from datetime import datetime
+from urllib.parse import urlparse
 
 from dotenv import load_dotenv
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
+from common.constants import CHECKPOINT_PATH
 from database.database_manager import DatabaseManager
-from database.models import DataType, PageType, Page
+from database.models import DataType, PageType, Frontier, Page, FrontierSpill
 from logger.logger import logger
+from services.frontier_policy import get_priority
+from util.util import url_fingerprint
 
 
 def load_env() -> (str, str, str):
@@ -22,6 +29,10 @@ def load_env() -> (str, str, str):
     return postgres_user, postgres_password, postgres_db
 
 
+# Pages the crawl starts from.
+seed_urls = ['https://gov.si/', 'https://evem.gov.si/', 'https://e-uprava.gov.si/', 'https://e-prostor.gov.si/']
+
+
 async def seed_default(async_session_factory: async_sessionmaker[AsyncSession]):
     """
     Inserts required started data to the database.
@@ -47,16 +58,100 @@ async def seed_default(async_session_factory: async_sessionmaker[AsyncSession]):
                 PageType(code='FAILED'),
                 PageType(code='CRAWLING'),
                 PageType(code='REDIRECT'),
-                Page(url='https://gov.si/', page_type_code='FRONTIER'),
-                Page(url='https://evem.gov.si/', page_type_code='FRONTIER'),
-                Page(url='https://e-uprava.gov.si/', page_type_code='FRONTIER'),
-                Page(url='https://e-prostor.gov.si/', page_type_code='FRONTIER')
             ]
         )
         await session.commit()
+        session.add_all([Frontier(url=url, url_hash=url_fingerprint(url), domain=urlparse(url).netloc.replace('www.', ''), depth=0,
+                                  priority=get_priority(url=url, depth=0), discovered_time=datetime.now())
+                         for url in seed_urls])
+        await session.commit()
     logging.debug('Seeding the database finished.')
 
 
+# Statements that bring a database created by an older version up to date. They can be run multiple times.
+upgrade_statements = [
+    "ALTER TABLE crawldb.site ADD COLUMN IF NOT EXISTS wait_strategy VARCHAR(20)",
+    "ALTER TABLE crawldb.page ADD COLUMN IF NOT EXISTS depth INTEGER",
+    "ALTER TABLE crawldb.page ADD COLUMN IF NOT EXISTS discovered_time TIMESTAMP",
+    "ALTER TABLE crawldb.page DROP COLUMN IF EXISTS priority",
+    "ALTER TABLE crawldb.image ADD COLUMN IF NOT EXISTS url VARCHAR(3000)",
+    "ALTER TABLE crawldb.image ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) "
+    "REFERENCES crawldb.image_content (content_hash) ON DELETE RESTRICT",
+    "CREATE INDEX IF NOT EXISTS ix_crawldb_image_content_hash ON crawldb.image (content_hash)",
+    "ALTER TABLE crawldb.page_data ADD COLUMN IF NOT EXISTS url VARCHAR(3000)",
+    "ALTER TABLE crawldb.page_data ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE crawldb.page_data ADD COLUMN IF NOT EXISTS size BIGINT",
+    "ALTER TABLE crawldb.page_data ADD COLUMN IF NOT EXISTS storage_path VARCHAR(500)",
+    "ALTER TABLE crawldb.page_data ADD COLUMN IF NOT EXISTS accessed_time TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_crawldb_page_data_content_hash ON crawldb.page_data (content_hash)",
+    "ALTER TABLE crawldb.frontier ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE crawldb.frontier ADD COLUMN IF NOT EXISTS next_attempt_time TIMESTAMP",
+    # Move frontier pages to the frontier table, links to them are saved again when they are crawled.
+    """INSERT INTO crawldb.frontier (url, domain, depth, priority, discovered_time, from_page_id)
+       SELECT p.url,
+              regexp_replace(substring(p.url from '://([^/:]+)'), '^www\\.', ''),
+              COALESCE(p.depth, 0),
+              -COALESCE(p.depth, 0),
+              COALESCE(p.discovered_time, now()),
+              (SELECT min(l.from_page) FROM crawldb.link l WHERE l.to_page = p.id)
+       FROM crawldb.page p
+       WHERE p.page_type_code = 'FRONTIER'
+         AND NOT EXISTS (SELECT 1 FROM crawldb.frontier f WHERE f.url = p.url)
+       ON CONFLICT DO NOTHING""",
+    """DELETE FROM crawldb.link l
+       USING crawldb.page p
+       WHERE l.to_page = p.id AND p.page_type_code = 'FRONTIER'""",
+    "DELETE FROM crawldb.page WHERE page_type_code = 'FRONTIER'",
+    "ALTER TABLE crawldb.page ADD COLUMN IF NOT EXISTS url_hash BIGINT",
+    "ALTER TABLE crawldb.frontier ADD COLUMN IF NOT EXISTS url_hash BIGINT",
+    "ALTER TABLE crawldb.frontier_spill ADD COLUMN IF NOT EXISTS url_hash BIGINT",
+    "CREATE UNIQUE INDEX IF NOT EXISTS page_url_hash_idx ON crawldb.page (url_hash)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS frontier_url_hash_idx ON crawldb.frontier (url_hash)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS frontier_spill_url_hash_idx ON crawldb.frontier_spill (url_hash)",
+]
+
+# Statements that replace unique urls with unique url hashes once the hashes are backfilled. Only urls without
+# a hash (because of a collision) are kept unique by the url. They can be run multiple times.
+url_hash_statements = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS page_url_fallback_idx ON crawldb.page (url) WHERE url_hash IS NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS frontier_url_fallback_idx ON crawldb.frontier (url) WHERE url_hash IS NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS frontier_spill_url_fallback_idx ON crawldb.frontier_spill (url) "
+    "WHERE url_hash IS NULL",
+    "ALTER TABLE crawldb.page DROP CONSTRAINT IF EXISTS page_url_key",
+    "ALTER TABLE crawldb.frontier DROP CONSTRAINT IF EXISTS frontier_url_key",
+    "ALTER TABLE crawldb.frontier_spill DROP CONSTRAINT IF EXISTS frontier_spill_url_key",
+]
+
+
+async def upgrade(database_manager: DatabaseManager):
+    """
+    Creates missing tables and upgrades existing tables without deleting crawled data.
+    """
+    logging.debug('Upgrading the database started.')
+    await database_manager.create_models()
+    async with database_manager.async_engine().begin() as conn:
+        for statement in upgrade_statements:
+            await conn.execute(text(statement))
+    await backfill(database_manager)
+    # Backfill crawl statistics, they are maintained incrementally from now on.
+    await database_manager.recount_crawl_stats()
+    logging.debug('Upgrading the database finished.')
+
+
+async def backfill(database_manager: DatabaseManager):
+    """
+    Hashes urls of pages and frontier entries saved without a hash, then drops unique constraints of their urls.
+    """
+    logging.debug('Backfilling url hashes started.')
+    for table in [Page, Frontier, FrontierSpill]:
+        n_hashed = await database_manager.backfill_url_hashes(table)
+        logger.info(f'Backfilled {n_hashed} url hashes of {table.__tablename__}.')
+    async with database_manager.async_engine().begin() as conn:
+        for statement in url_hash_statements:
+            await conn.execute(text(statement))
+    logging.debug('Backfilling url hashes finished.')
+
+
 async def main():
     logger.info('Migration started.')
 
@@ -69,16 +164,28 @@ async def main():
                                            f"{postgres_password}@localhost:5432/"
                                            f"{postgres_db}")
 
-    # Drop existing tables
-    await database_manager.delete_tables()
+    if len(sys.argv) > 1 and sys.argv[1] == 'upgrade':
+        # Keep the crawled data.
+        await upgrade(database_manager)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        # Hash urls of an upgraded database again, e.g. if the upgrade was interrupted.
+        await backfill(database_manager)
+    else:
+        # Drop existing tables
+        await database_manager.delete_tables()
 
-    # Create database tables.
-    await database_manager.create_models()
+        # Create database tables.
+        await database_manager.create_models()
+
+        # Get database session maker
+        async_session_factory = database_manager.async_session_factory()
 
-    # Get database session maker
-    async_session_factory = database_manager.async_session_factory()
+        await seed_default(async_session_factory)
+        await database_manager.recount_crawl_stats()
 
-    await seed_default(async_session_factory)
+    # Crawl state saved for the old database is not valid anymore, upgrades move frontier entries and rekey pages.
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
 
     # Clean database manager.
     await database_manager.cleanup()
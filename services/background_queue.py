@@ -0,0 +1,53 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+from logger.logger import logger
+from services.fetch_archive import is_replaying
+
+
+class BackgroundQueue(ABC):
+    """
+    Processes queued items with a few tasks in the background of a thread's event loop.
+    """
+
+    def __init__(self, n_workers: int):
+        self.n_workers = n_workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: list[asyncio.Task] = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._work()) for _ in range(self.n_workers)]
+
+    def add(self, items: list):
+        """
+        Queues items for processing.
+        Background downloads would touch the network, so nothing is queued while replaying the fetch archive.
+        """
+        if is_replaying():
+            return
+        for item in items:
+            self.queue.put_nowait(item)
+
+    async def close(self):
+        """
+        Waits for the queued items to be processed and stops the workers.
+        """
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+
+    @abstractmethod
+    async def process(self, item):
+        """
+        Processes a single queued item.
+        """
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.process(item)
+            except Exception as e:
+                logger.debug(f'Processing {item} in the background failed with an error {e}.')
+            finally:
+                self.queue.task_done()
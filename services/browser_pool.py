@@ -0,0 +1,321 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Awaitable
+
+from playwright.async_api import Playwright, Browser, BrowserContext, Page
+
+from common.constants import USER_AGENT, BROWSER_ARGS, BROWSER_MAX_NAVIGATIONS, BROWSER_MAX_RSS_MB, \
+    BROWSER_SUPERVISOR_INTERVAL, BROWSER_START_TIMEOUT, BROWSER_RESTART_POLL_INTERVAL
+from logger.logger import logger
+
+devtools_regex = re.compile(r'DevTools listening on (ws://\S+)')
+
+
+class BrowserProcess:
+    """
+    A Chromium process that is shared by multiple threads through the Chrome DevTools Protocol.
+    """
+
+    def __init__(self, executable_path: str, index: int):
+        self.executable_path = executable_path
+        self.index = index
+        self.process: subprocess.Popen | None = None
+        self.user_data_dir: str | None = None
+        self.endpoint: str | None = None
+        # Incremented on every restart, so threads know their connection belongs to a dead process.
+        self.generation = 0
+        self.leases = 0
+        self.draining = False
+        # Set while the process is restarted without holding the pool's lock, so it isn't leased or restarted twice.
+        self.restarting = False
+
+    def start(self):
+        """
+        Starts the browser process and waits until its DevTools endpoint is available.
+        """
+        self.user_data_dir = tempfile.mkdtemp(prefix='crawler-browser-')
+        self.process = subprocess.Popen([self.executable_path,
+                                         *BROWSER_ARGS,
+                                         '--headless',
+                                         '--remote-debugging-port=0',
+                                         f'--user-data-dir={self.user_data_dir}',
+                                         'about:blank'],
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE,
+                                        text=True)
+        timer = threading.Timer(BROWSER_START_TIMEOUT, self.process.kill)
+        timer.start()
+        try:
+            for line in self.process.stderr:
+                match = devtools_regex.search(line)
+                if match:
+                    self.endpoint = match.group(1)
+                    break
+        finally:
+            timer.cancel()
+        if self.endpoint is None:
+            raise Exception(f'Browser {self.index} failed to start.')
+        # Keep reading the output, otherwise the browser blocks once the pipe is full.
+        threading.Thread(target=self._drain_output, daemon=True, name=f'Browser {self.index} output').start()
+        self.generation += 1
+        self.leases = 0
+        self.draining = False
+        logger.info(f'Browser {self.index} started with pid {self.process.pid}.')
+
+    def _drain_output(self):
+        process = self.process
+        for _ in process.stderr:
+            pass
+
+    def stop(self):
+        """
+        Kills the browser process and removes its profile.
+        """
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            logger.info(f'Browser {self.index} with pid {self.process.pid} stopped.')
+        self.endpoint = None
+        if self.user_data_dir is not None:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+            self.user_data_dir = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def rss(self) -> int | None:
+        """
+        Returns the resident memory in bytes used by the browser and all of its child processes.
+        Only supported on Linux.
+        """
+        if not self.is_alive() or not os.path.exists('/proc'):
+            return None
+        total = 0
+        pids = [self.process.pid]
+        while pids:
+            pid = pids.pop()
+            try:
+                with open(f'/proc/{pid}/status') as status:
+                    for line in status:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+                            break
+                for task in os.listdir(f'/proc/{pid}/task'):
+                    with open(f'/proc/{pid}/task/{task}/children') as children:
+                        pids.extend(int(child) for child in children.read().split())
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+        return total
+
+
+class BrowserPool:
+    """
+    A few browser processes shared by all threads.
+    Threads lease a process, browser processes that crash are replaced
+    and processes that use too much memory are restarted once no thread uses them.
+    """
+
+    def __init__(self, executable_path: str, n_browsers: int):
+        self.processes = [BrowserProcess(executable_path=executable_path, index=i) for i in range(n_browsers)]
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Starts all browser processes and the supervisor thread.
+        This is a blocking call.
+        """
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self._supervise, daemon=True, name='Browser supervisor').start()
+
+    def close(self):
+        """
+        Stops the supervisor thread and all browser processes.
+        """
+        self.stopped.set()
+        with self.lock:
+            for process in self.processes:
+                process.stop()
+
+    def acquire(self) -> (int, int, str):
+        """
+        Leases the least used healthy browser process.
+        Returns process index, process generation and its DevTools endpoint.
+        This is a blocking call, it waits for a browser to restart if every browser crashed.
+        """
+        while True:
+            with self.lock:
+                alive = [p for p in self.processes if p.is_alive() and not p.restarting]
+                candidates = [p for p in alive if not p.draining] or alive
+                if candidates:
+                    process = min(candidates, key=lambda p: p.leases)
+                    process.leases += 1
+                    logger.debug(f'Leased browser {process.index}, it has {process.leases} leases.')
+                    return process.index, process.generation, process.endpoint
+                # Every browser crashed, start one right away instead of waiting for the supervisor.
+                process = self.processes[0]
+                restart = not process.restarting
+                process.restarting = True
+            if restart:
+                self._restart(process)
+            else:
+                # Another thread or the supervisor is restarting the browser.
+                time.sleep(BROWSER_RESTART_POLL_INTERVAL)
+
+    def _restart(self, process: BrowserProcess):
+        """
+        Restarts a process that was marked as restarting. The lock isn't held while the browser starts,
+        so other threads can keep leasing and releasing the other processes.
+        """
+        try:
+            process.restart()
+            if self.stopped.is_set():
+                process.stop()
+        finally:
+            with self.lock:
+                process.restarting = False
+
+    def release(self, index: int, generation: int):
+        """
+        Returns the lease of a browser process.
+        """
+        with self.lock:
+            process = self.processes[index]
+            if process.generation == generation and process.leases > 0:
+                process.leases -= 1
+
+    def should_leave(self, index: int, generation: int) -> bool:
+        """
+        Checks whether the thread should move to another browser process,
+        because the process was restarted or is waiting for a restart.
+        """
+        process = self.processes[index]
+        return process.generation != generation or process.draining or not process.is_alive()
+
+    def _supervise(self):
+        while not self.stopped.wait(BROWSER_SUPERVISOR_INTERVAL):
+            restarted = []
+            with self.lock:
+                for process in self.processes:
+                    if process.restarting:
+                        continue
+                    try:
+                        if self._check_process(process):
+                            process.restarting = True
+                            restarted.append(process)
+                    except Exception as e:
+                        logger.warning(f'Supervising browser {process.index} failed with an error {e}.')
+            for process in restarted:
+                try:
+                    self._restart(process)
+                except Exception as e:
+                    logger.warning(f'Restarting browser {process.index} failed with an error {e}.')
+
+    @staticmethod
+    def _check_process(process: BrowserProcess) -> bool:
+        """
+        Checks the process and returns whether it has to be restarted.
+        """
+        if not process.is_alive():
+            logger.warning(f'Browser {process.index} crashed, restarting it.')
+            return True
+        if process.draining:
+            if process.leases == 0:
+                logger.info(f'Browser {process.index} is not used anymore, restarting it.')
+                return True
+            return False
+        rss = process.rss()
+        if rss is not None and rss > BROWSER_MAX_RSS_MB * 1024 * 1024:
+            logger.info(f'Browser {process.index} uses {rss // (1024 * 1024)} MB of memory, '
+                        f'it will be restarted once threads stop using it.')
+            process.draining = True
+        return False
+
+
+class BrowserSlot:
+    """
+    A browser page leased by a single thread.
+    The page's context is recycled after a number of navigations or when the page or the browser crashes.
+    """
+
+    def __init__(self, playwright: Playwright, browser_pool: BrowserPool,
+                 setup_page: Callable[[Page], Awaitable[None]]):
+        self.playwright = playwright
+        self.browser_pool = browser_pool
+        self.setup_page = setup_page
+        self.lease: (int, int) = None
+        self.browser: Browser | None = None
+        self.context: BrowserContext | None = None
+        self.page: Page | None = None
+        self.navigations = 0
+        self.crashed = False
+
+    async def get_page(self) -> Page:
+        """
+        Gets a usable browser page, recycling the context if required.
+        """
+        if self.page is None or self.crashed or self.navigations >= BROWSER_MAX_NAVIGATIONS \
+                or self.browser_pool.should_leave(*self.lease):
+            await self._recycle()
+        self.navigations += 1
+        return self.page
+
+    async def close(self):
+        await self._close_context()
+        await self._close_browser()
+
+    async def _recycle(self):
+        logger.debug(f'Recycling browser context after {self.navigations} navigations.')
+        await self._close_context()
+        if self.browser is None or not self.browser.is_connected() or self.browser_pool.should_leave(*self.lease):
+            await self._close_browser()
+            # Leasing might wait for a browser to restart, so it doesn't block the event loop.
+            index, generation, endpoint = await asyncio.to_thread(self.browser_pool.acquire)
+            self.lease = index, generation
+            self.browser = await self.playwright.chromium.connect_over_cdp(endpoint)
+            self.browser.on('disconnected', self._on_disconnected)
+        self.context = await self.browser.new_context(ignore_https_errors=True, user_agent=USER_AGENT)
+        self.page = await self.context.new_page()
+        self.page.on('crash', self._on_crash)
+        await self.setup_page(self.page)
+        self.navigations = 0
+        self.crashed = False
+
+    async def _close_context(self):
+        if self.context is not None:
+            try:
+                await self.context.close()
+            except Exception as e:
+                logger.debug(f'Closing browser context failed with an error {e}.')
+        self.context = None
+        self.page = None
+
+    async def _close_browser(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception as e:
+                logger.debug(f'Closing browser connection failed with an error {e}.')
+        if self.lease is not None:
+            self.browser_pool.release(*self.lease)
+        self.browser = None
+        self.lease = None
+
+    def _on_crash(self, *args):
+        logger.warning('Browser page crashed, it will be replaced.')
+        self.crashed = True
+
+    def _on_disconnected(self, *args):
+        logger.debug('Browser connection closed.')
+        self.crashed = True
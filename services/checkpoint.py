@@ -0,0 +1,92 @@
+import os
+import threading
+from array import array
+from time import time
+
+import msgpack
+
+from common.constants import CHECKPOINT_PATH, CHECKPOINT_INTERVAL, CHECKPOINT_MAX_AGE
+from common.globals import domain_available_times, ip_available_times, dns_cache, site_cache, \
+    known_url_fingerprints, host_frontier_counts, domain_crawl_rates, \
+    circuit_breakers, url_pattern_counts
+from logger.logger import logger
+
+# Shared dictionaries that are saved in checkpoints, by name.
+checkpointed_dicts = {
+    'domain_available_times': domain_available_times,
+    'ip_available_times': ip_available_times,
+    'dns_cache': dns_cache,
+    'site_cache': site_cache,
+    'host_frontier_counts': host_frontier_counts,
+    'domain_crawl_rates': domain_crawl_rates,
+    'circuit_breakers': circuit_breakers,
+    'url_pattern_counts': url_pattern_counts,
+}
+
+# Bumped when saved state isn't valid anymore, e.g. after upgrades that change how pages and the frontier are keyed.
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(path: str = CHECKPOINT_PATH):
+    """
+    Saves the in-memory crawl state to a file.
+    The file is replaced atomically, so a crash while saving keeps the previous checkpoint.
+    """
+    start_time = time()
+    # Copying dicts and sets is atomic, so threads don't have to be stopped.
+    state = {name: shared_dict.copy() for name, shared_dict in checkpointed_dicts.items()}
+    state['known_url_fingerprints'] = array('q', known_url_fingerprints.copy()).tobytes()
+    state['version'] = CHECKPOINT_VERSION
+    state['saved_time'] = time()
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        msgpack.pack(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    logger.debug(f'Checkpoint saved in {time() - start_time:.2f} seconds.')
+
+
+def load_checkpoint(path: str = CHECKPOINT_PATH) -> bool:
+    """
+    Loads the in-memory crawl state from a file.
+    Returns True if the checkpoint was loaded.
+    """
+    if not os.path.exists(path):
+        logger.info('There is no checkpoint to load.')
+        return False
+    try:
+        with open(path, 'rb') as file:
+            # Arrays are loaded as tuples, because cached values are tuples.
+            state = msgpack.unpack(file, use_list=False, strict_map_key=False)
+    except Exception as e:
+        logger.warning(f'Loading checkpoint failed with an error {e}.')
+        return False
+    if state.get('version') != CHECKPOINT_VERSION or state.get('saved_time', 0) < time() - CHECKPOINT_MAX_AGE:
+        logger.info('Checkpoint is outdated and will be ignored.')
+        return False
+
+    for name, shared_dict in checkpointed_dicts.items():
+        shared_dict.update(state.get(name, {}))
+    fingerprints = array('q')
+    fingerprints.frombytes(state.get('known_url_fingerprints', b''))
+    known_url_fingerprints.update(fingerprints)
+    logger.info(f'Checkpoint from {time() - state["saved_time"]:.0f} seconds ago loaded with '
+                f'{len(site_cache)} sites and {len(fingerprints)} known urls.')
+    return True
+
+
+def run_checkpoints(stopped: threading.Event, interval: float = CHECKPOINT_INTERVAL):
+    """
+    Periodically saves checkpoints until stopped. The last checkpoint is saved when stopping.
+    """
+    while not stopped.wait(interval):
+        try:
+            save_checkpoint()
+        except Exception as e:
+            logger.warning(f'Saving checkpoint failed with an error {e}.')
+    try:
+        save_checkpoint()
+    except Exception as e:
+        logger.warning(f'Saving the last checkpoint failed with an error {e}.')
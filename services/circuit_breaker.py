@@ -0,0 +1,104 @@
+from datetime import datetime
+from time import time
+
+from common.constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN
+from common.globals import circuit_breakers, lock
+from logger.logger import logger
+from services.crawl_stats import get_stat
+from services.frontier_notifier import notify_frontier_changed
+
+# Closed circuit of a domain without failures.
+closed_circuit = (0, None, False, 0)
+
+
+def allow_request(domain: str) -> bool:
+    """
+    Checks whether the domain can be crawled.
+    Domains with an open circuit can't be crawled until the cooldown passes,
+    then a single probe request is allowed (half-open circuit).
+    The circuit stays open while probing, so a probe that never finishes is repeated after another cooldown.
+    """
+    domain = domain.replace('www.', '')
+    with lock:
+        failures, open_until, probing, openings = circuit_breakers.get(domain, closed_circuit)
+        if open_until is None:
+            return True
+        if open_until > time():
+            return False
+        circuit_breakers[domain] = (failures, time() + CIRCUIT_COOLDOWN, True, openings)
+    logger.info(f'Probing domain {domain} with an open circuit.')
+    return True
+
+
+def record_success(domain: str):
+    """
+    Closes the domain's circuit after a successful request.
+    """
+    domain = domain.replace('www.', '')
+    with lock:
+        circuit = circuit_breakers.pop(domain, closed_circuit)
+    if circuit[1] is not None:
+        logger.info(f'Circuit of the domain {domain} closed.')
+        # Domain's pages can be crawled again.
+        notify_frontier_changed()
+
+
+def record_failure(domain: str):
+    """
+    Counts a failed request and opens the domain's circuit after too many consecutive failures.
+    A failed probe opens the circuit again with a longer cooldown.
+    """
+    domain = domain.replace('www.', '')
+    with lock:
+        failures, open_until, probing, openings = circuit_breakers.get(domain, closed_circuit)
+        failures += 1
+        if probing or (open_until is None and failures >= CIRCUIT_FAILURE_THRESHOLD):
+            cooldown = min(CIRCUIT_COOLDOWN * 2 ** openings, CIRCUIT_MAX_COOLDOWN)
+            circuit_breakers[domain] = (failures, time() + cooldown, False, openings + 1)
+            logger.info(f'Circuit of the domain {domain} opened for {cooldown} seconds after {failures} failures.')
+        else:
+            circuit_breakers[domain] = (failures, open_until, probing, openings)
+
+
+def get_open_domains() -> set[str]:
+    """
+    Gets domains that can't be crawled right now because their circuit is open.
+    """
+    current_time = time()
+    return {domain for domain, (_, open_until, _, _) in list(circuit_breakers.items())
+            if open_until is not None and open_until > current_time}
+
+
+def drop_expired_circuits():
+    """
+    Drops circuits past their cooldown whose domain has no frontier entries left to probe them with,
+    e.g. circuits restored from a checkpoint or circuits whose probe failed with a non-transient error.
+    """
+    current_time = time()
+    with lock:
+        expired_domains = [domain for domain, (_, open_until, _, _) in circuit_breakers.items()
+                           if open_until is not None and open_until <= current_time
+                           and get_stat('host_frontier', domain) == 0 and get_stat('host_spill', domain) == 0]
+        for domain in expired_domains:
+            del circuit_breakers[domain]
+    for domain in expired_domains:
+        logger.info(f'Circuit of the domain {domain} dropped, because it expired without pages to probe.')
+
+
+def get_reopen_time(domain: str = None) -> datetime:
+    """
+    Gets the time when the domain's circuit (or the first of all open circuits) allows a probe request.
+    Returns None if there are no open circuits. Circuits past their cooldown aren't waited for,
+    their domains can already be probed.
+    """
+    if domain is not None:
+        circuits = [circuit_breakers.get(domain.replace('www.', ''), closed_circuit)]
+    else:
+        drop_expired_circuits()
+        circuits = list(circuit_breakers.values())
+    current_time = time()
+    open_until_times = [open_until for _, open_until, _, _ in circuits
+                        if open_until is not None and open_until > current_time]
+    if len(open_until_times) == 0:
+        return None
+    return datetime.fromtimestamp(min(open_until_times))
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from common.constants import STATS_FLUSH_INTERVAL
+from common.globals import lock, crawl_stats, crawl_stat_changes
+from logger.logger import logger
+
+if TYPE_CHECKING:
+    # The database manager counts statistics, so it can't be imported here at runtime.
+    from database.database_manager import DatabaseManager
+
+
+def count_stat(group: str, key: str, change: int = 1):
+    """
+    Changes a crawl statistic, the change is saved to the database with the next flush.
+    """
+    if change == 0:
+        return
+    stat = (group, key)
+    with lock:
+        crawl_stats[stat] = crawl_stats.get(stat, 0) + change
+        crawl_stat_changes[stat] = crawl_stat_changes.get(stat, 0) + change
+
+
+def count_frontier_change(domain: str, change: int = 1, spilled: bool = False):
+    """
+    Counts entries added to (or removed from) the frontier or the frontier spill-over, in total and by host.
+    """
+    if spilled:
+        count_stat(group='host_spill', key=domain, change=change)
+    else:
+        count_stat(group='frontier', key='size', change=change)
+        count_stat(group='host_frontier', key=domain, change=change)
+
+
+def count_page_type_change(old_page_type: str, new_page_type: str, url: str, status: int = None):
+    """
+    Counts a page that changed its type. Pages that finished crawling are also counted by host and status.
+    """
+    if old_page_type == new_page_type:
+        return
+    if old_page_type is not None:
+        count_stat(group='page_type', key=old_page_type, change=-1)
+    if new_page_type is not None:
+        count_stat(group='page_type', key=new_page_type)
+    if old_page_type == 'CRAWLING' and new_page_type is not None:
+        count_stat(group='host', key=urlparse(url).netloc.replace('www.', ''))
+        if status is not None:
+            count_stat(group='status', key=str(status))
+
+
+def get_stat(group: str, key: str) -> int:
+    return crawl_stats.get((group, key), 0)
+
+
+def get_stat_group(group: str) -> dict[str, int]:
+    """
+    Gets all statistics of a group by key.
+    """
+    return {key: count for (stat_group, key), count in crawl_stats.copy().items() if stat_group == group}
+
+
+def take_stat_changes() -> dict[(str, str), int]:
+    with lock:
+        changes = {stat: change for stat, change in crawl_stat_changes.items() if change != 0}
+        crawl_stat_changes.clear()
+    return changes
+
+
+def restore_stat_changes(changes: dict[(str, str), int]):
+    """
+    Returns changes that failed to be saved, so they are saved with the next flush.
+    """
+    with lock:
+        for stat, change in changes.items():
+            crawl_stat_changes[stat] = crawl_stat_changes.get(stat, 0) + change
+
+
+async def flush_stats(database_manager: 'DatabaseManager'):
+    changes = take_stat_changes()
+    if len(changes) == 0:
+        return
+    try:
+        await database_manager.add_crawl_stat_changes(changes=changes)
+    except Exception as e:
+        logger.warning(f'Saving crawl statistics failed with an error {e}.')
+        restore_stat_changes(changes)
+
+
+async def maintain_stats(database_manager: 'DatabaseManager', stopped: threading.Event):
+    """
+    Loads saved statistics and periodically saves their changes until stopped.
+    Statistics counted before they were loaded are kept, because they are changes of the saved values.
+    """
+    try:
+        saved_stats = await database_manager.get_crawl_stats()
+        with lock:
+            for stat, count in saved_stats.items():
+                crawl_stats[stat] = crawl_stats.get(stat, 0) + count
+        logger.info(f'Loaded {len(saved_stats)} crawl statistics.')
+        while not await asyncio.to_thread(stopped.wait, STATS_FLUSH_INTERVAL):
+            await flush_stats(database_manager=database_manager)
+        await flush_stats(database_manager=database_manager)
+    finally:
+        await database_manager.cleanup()
+
+
+def stats_entrypoint(database_manager: 'DatabaseManager', stopped: threading.Event):
+    try:
+        asyncio.run(maintain_stats(database_manager=database_manager, stopped=stopped))
+    except Exception as e:
+        logger.critical(f'Maintaining crawl statistics failed with an error {e}.')
+
+
+def format_progress() -> str:
+    return f'Visited {get_stat("page_type", "HTML")} unique HTML pages, ' \
+           f'frontier contains {get_stat("frontier", "size")} unique links.'
@@ -1,8 +1,10 @@
 import asyncio
+import threading
 from time import time
 
-from common.constants import DEFAULT_DOMAIN_DELAY
-from common.globals import domain_available_times, ip_available_times, lock
+from common.constants import DEFAULT_DOMAIN_DELAY, MIN_DOMAIN_DELAY, MAX_DOMAIN_DELAY, DOMAIN_DELAY_DECREASE, \
+    DOMAIN_DELAY_BACKOFF, SLOW_RESPONSE_TIME, SLOW_RESPONSE_FACTOR, RESPONSE_TIME_SMOOTHING, backoff_status_codes
+from common.globals import domain_available_times, ip_available_times, lock, host_semaphores, domain_crawl_rates
 from logger.logger import logger
 
 
@@ -13,6 +15,7 @@ def save_site_available_time(
     """
     Save the time in seconds when the domain and ip will be available for crawling again.
     """
+    domain = domain.replace('www.', '')
     logger.debug(f'Saving delay {delay} seconds for the domain {domain} and ip {ip}.')
     # read or write the shared variable
     domain_available_times[domain] = time() + delay
@@ -24,6 +27,7 @@ def get_site_wait_time(domain: str, ip: str):
     """
     Get the wait time in seconds for the domain and ip to be available for crawling again.
     """
+    domain = domain.replace('www.', '')
     current_time = time()
     # read or write the shared variable
     domain_delay = (domain_available_times.get(domain) or current_time) - current_time
@@ -45,9 +49,9 @@ async def refresh_site_available_time(
     the wait time in seconds for the domain and ip to be available for crawling again.
     """
     logger.debug(f'Robots.txt delay is {robot_delay}.')
-    required_delay = int(robot_delay) if robot_delay is not None else DEFAULT_DOMAIN_DELAY
     # acquire the lock
     with lock:
+        required_delay = get_domain_delay(domain=domain, robot_delay=robot_delay)
         wait_time = get_site_wait_time(domain=domain, ip=ip)
         wait_time = wait_time if wait_time > 0 else 0
         save_site_available_time(domain=domain, ip=ip, delay=required_delay + wait_time)
@@ -56,3 +60,75 @@ async def refresh_site_available_time(
         await asyncio.sleep(wait_time)
     else:
         logger.debug(f'Waiting for accessing the domain {domain} and ip {ip} is not required.')
+
+
+def get_unavailable_domains() -> set[str]:
+    """
+    Gets domains that can't be crawled right now because of the required delay.
+    """
+    current_time = time()
+    return {domain.replace('www.', '') for domain, available_time in list(domain_available_times.items())
+            if available_time > current_time}
+
+
+def get_host_semaphore(host: str, limit: int) -> threading.BoundedSemaphore:
+    """
+    Gets the semaphore that limits the number of concurrent downloads from the host across all threads.
+    """
+    host = host.replace('www.', '')
+    with lock:
+        semaphore = host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(limit)
+            host_semaphores[host] = semaphore
+        return semaphore
+
+
+def get_minimum_delay(robot_delay: str = None) -> float:
+    """
+    Gets the lowest allowed delay, which is the robots.txt crawl delay or MIN_DOMAIN_DELAY.
+    """
+    return max(float(robot_delay), MIN_DOMAIN_DELAY) if robot_delay is not None else MIN_DOMAIN_DELAY
+
+
+def get_maximum_delay(robot_delay: str = None) -> float:
+    """
+    Gets the highest delay, which is MAX_DOMAIN_DELAY or a longer robots.txt crawl delay.
+    """
+    return max(float(robot_delay), MAX_DOMAIN_DELAY) if robot_delay is not None else MAX_DOMAIN_DELAY
+
+
+def get_domain_delay(domain: str, robot_delay: str = None) -> float:
+    """
+    Gets the adapted delay in seconds between requests to the domain.
+    Domains without any responses yet use the robots.txt crawl delay or DEFAULT_DOMAIN_DELAY.
+    """
+    crawl_rate = domain_crawl_rates.get(domain.replace('www.', ''))
+    if crawl_rate is None:
+        return float(robot_delay) if robot_delay is not None else DEFAULT_DOMAIN_DELAY
+    delay, _ = crawl_rate
+    return min(max(delay, get_minimum_delay(robot_delay=robot_delay)), get_maximum_delay(robot_delay=robot_delay))
+
+
+def record_domain_response(domain: str, response_time: float, status: int = None, robot_delay: str = None):
+    """
+    Adapts the domain's delay to the observed response (AIMD).
+    Fast, successful responses decrease the delay by a constant step,
+    errors (status is None), overload statuses and slow responses multiply it.
+    """
+    domain = domain.replace('www.', '')
+    with lock:
+        delay = get_domain_delay(domain=domain, robot_delay=robot_delay)
+        crawl_rate = domain_crawl_rates.get(domain)
+        average_response_time = crawl_rate[1] if crawl_rate is not None else response_time
+        slow = response_time > SLOW_RESPONSE_TIME or response_time > SLOW_RESPONSE_FACTOR * average_response_time
+        if status is None or status in backoff_status_codes or slow:
+            delay = min(delay * DOMAIN_DELAY_BACKOFF, get_maximum_delay(robot_delay=robot_delay))
+        else:
+            delay = max(delay - DOMAIN_DELAY_DECREASE, get_minimum_delay(robot_delay=robot_delay))
+        # Error responses don't say anything about the response time.
+        if status is not None:
+            average_response_time += RESPONSE_TIME_SMOOTHING * (response_time - average_response_time)
+        domain_crawl_rates[domain] = (delay, average_response_time)
+    logger.debug(f'Delay for the domain {domain} is {delay:.1f} seconds after a response with status {status} '
+                 f'in {response_time:.2f} seconds.')
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import os
+import threading
+from datetime import datetime
+from mimetypes import guess_extension
+from urllib.parse import urlparse
+
+import requests
+
+from common.constants import USER_AGENT, PAGE_WAIT_TIMEOUT, DOCUMENT_STORAGE_DIR, DOCUMENT_MAX_SIZES, \
+    DOCUMENT_DOWNLOAD_WORKERS, DOCUMENT_DOWNLOAD_ATTEMPTS, DOCUMENT_CHUNK_SIZE
+from common.globals import robots_parsers, document_download_semaphore, document_url_downloads, \
+    document_url_locks, lock
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.background_queue import BackgroundQueue
+from services.delay_manager import refresh_site_available_time
+from util.util import is_domain_allowed, is_url_allowed, get_site_ip
+
+
+class DocumentTooLarge(Exception):
+    pass
+
+
+def get_partial_path(url: str) -> str:
+    """
+    Returns the path of a partially downloaded document. The path is the same for every attempt, so it can be resumed.
+    """
+    return os.path.join(DOCUMENT_STORAGE_DIR, 'partial', hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+
+
+def get_document_lock(url: str) -> threading.Lock:
+    """
+    Gets the lock that has to be held while downloading the document, because downloads share the partial file.
+    """
+    with lock:
+        document_lock = document_url_locks.get(url)
+        if document_lock is None:
+            document_lock = threading.Lock()
+            document_url_locks[url] = document_lock
+        return document_lock
+
+
+def hash_file(path: str) -> (hashlib.sha256, int):
+    """
+    Hashes an already downloaded part of a document.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        while chunk := file.read(DOCUMENT_CHUNK_SIZE):
+            sha256.update(chunk)
+            size += len(chunk)
+    return sha256, size
+
+
+def stream_document(url: str, max_size: int, data_type: str) -> (str, int, str):
+    """
+    Streams a document in chunks to a file while hashing it. Interrupted downloads are resumed with a Range request.
+    Documents are stored by their content hash, so identical documents are stored only once.
+    Returns content hash, size and storage path.
+    """
+    partial_path = get_partial_path(url)
+    os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+    headers = {'User-Agent': USER_AGENT}
+    if os.path.exists(partial_path):
+        sha256, size = hash_file(partial_path)
+        headers['Range'] = f'bytes={size}-'
+    else:
+        sha256, size = hashlib.sha256(), 0
+
+    with requests.get(url, verify=False, timeout=PAGE_WAIT_TIMEOUT / 1000, stream=True,
+                      headers=headers) as response:
+        if response.status_code == 200 and size > 0:
+            # The server doesn't support resuming, so start from the beginning.
+            logger.debug(f'Resuming download of {url} is not supported.')
+            sha256, size = hashlib.sha256(), 0
+        elif response.status_code == 416 and size > 0:
+            # The file was already fully downloaded.
+            pass
+        elif response.status_code not in [200, 206]:
+            raise Exception(f'Status code is {response.status_code}.')
+        if size + int(response.headers.get('content-length') or 0) > max_size:
+            raise DocumentTooLarge()
+
+        if response.status_code != 416:
+            with open(partial_path, 'ab' if size > 0 else 'wb') as file:
+                for chunk in response.iter_content(chunk_size=DOCUMENT_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise DocumentTooLarge()
+                    sha256.update(chunk)
+                    file.write(chunk)
+        # The response of an already downloaded file doesn't have the document's content type.
+        extension = (guess_extension(response.headers.get('content-type', '').split(';')[0])
+                     if response.status_code != 416 else None) \
+            or os.path.splitext(urlparse(url).path)[1] or f'.{data_type.lower()}'
+
+    content_hash = sha256.hexdigest()
+    storage_path = os.path.join(DOCUMENT_STORAGE_DIR, content_hash[:2], content_hash + extension)
+    os.makedirs(os.path.dirname(storage_path), exist_ok=True)
+    if os.path.exists(storage_path):
+        logger.debug(f'Document {url} is already stored.')
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, storage_path)
+    return content_hash, size, storage_path
+
+
+class DocumentDownloader(BackgroundQueue):
+    """
+    Downloads binary documents in the background of a thread's event loop.
+    Queued items are saved page data entries' ids, urls and data types.
+    """
+
+    def __init__(self, database_manager: DatabaseManager):
+        super().__init__(n_workers=DOCUMENT_DOWNLOAD_WORKERS)
+        self.database_manager = database_manager
+
+    async def process(self, item: (int, str, str)):
+        page_data_id, url, data_type = item
+        await self.download_document(page_data_id=page_data_id, url=url, data_type=data_type)
+
+    async def download_document(self, page_data_id: int, url: str, data_type: str):
+        """
+        Downloads the document if its type and size are allowed and saves its location.
+        Documents linked from many pages are downloaded only once, the other entries reuse the download.
+        """
+        document_lock = get_document_lock(url)
+        await asyncio.to_thread(document_lock.acquire)
+        try:
+            download = document_url_downloads.get(url)
+            if download is None:
+                download = await self.fetch_document(url=url, data_type=data_type)
+            else:
+                logger.debug(f'Document {url} was already downloaded.')
+        finally:
+            document_lock.release()
+        if download is None:
+            await self.database_manager.update_page_data_content(page_data_id=page_data_id,
+                                                                 accessed_time=datetime.now())
+            return
+        content_hash, size, storage_path = download
+        await self.database_manager.update_page_data_content(page_data_id=page_data_id,
+                                                             accessed_time=datetime.now(),
+                                                             content_hash=content_hash,
+                                                             size=size,
+                                                             storage_path=storage_path)
+
+    async def fetch_document(self, url: str, data_type: str) -> (str, int, str):
+        """
+        Downloads the document if its type and size are allowed.
+        Returns content hash, size and storage path or None if the document wasn't downloaded.
+        """
+        max_size = DOCUMENT_MAX_SIZES.get(data_type)
+        host = urlparse(url).netloc
+        robot_file_parser = robots_parsers.get(host.replace('www.', ''))
+        if max_size is None or robot_file_parser is None or not is_domain_allowed(url=url) \
+                or not is_url_allowed(url, robot_file_parser=robot_file_parser):
+            logger.debug(f'Document {url} is not allowed to be downloaded.')
+            return None
+
+        for attempt in range(1, DOCUMENT_DOWNLOAD_ATTEMPTS + 1):
+            await asyncio.to_thread(document_download_semaphore.acquire)
+            try:
+                await refresh_site_available_time(domain=host,
+                                                  ip=get_site_ip(hostname=host),
+                                                  robot_delay=robot_file_parser.crawl_delay(useragent=USER_AGENT))
+                download = await asyncio.to_thread(stream_document, url, max_size, data_type)
+                document_url_downloads[url] = download
+                logger.debug(f'Document {url} downloaded to {download[2]}.')
+                return download
+            except DocumentTooLarge:
+                logger.debug(f'Document {url} is too large.')
+                partial_path = get_partial_path(url)
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                break
+            except Exception as e:
+                logger.debug(f'Downloading document {url} failed in attempt {attempt} with an error {e}.')
+            finally:
+                document_download_semaphore.release()
+        return None
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from mimetypes import guess_type
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common.constants import EXPORT_DIR, EXPORT_WORKERS, EXPORT_BATCH_SIZE, WARC_MAX_SIZE, DOCUMENT_CHUNK_SIZE, \
+    EXPORT_SETTLE_TIME
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.warc_writer import WarcWriter
+
+# Parquet schemas of exported tables. Columns are in the same order as the streamed rows.
+export_schemas = {
+    'page': pa.schema([('id', pa.int32()), ('site_id', pa.int32()), ('domain', pa.string()),
+                       ('page_type_code', pa.string()), ('url', pa.string()), ('http_status_code', pa.int32()),
+                       ('accessed_time', pa.timestamp('us')), ('depth', pa.int32()),
+                       ('discovered_time', pa.timestamp('us')), ('html_content_hash', pa.string())]),
+    'link': pa.schema([('from_page', pa.int32()), ('to_page', pa.int32())]),
+    'image': pa.schema([('id', pa.int32()), ('page_id', pa.int32()), ('url', pa.string()), ('filename', pa.string()),
+                        ('content_type', pa.string()), ('content_hash', pa.string()),
+                        ('accessed_time', pa.timestamp('us'))]),
+    'page_data': pa.schema([('id', pa.int32()), ('page_id', pa.int32()), ('data_type_code', pa.string()),
+                            ('url', pa.string()), ('content_hash', pa.string()), ('size', pa.int64()),
+                            ('storage_path', pa.string()), ('accessed_time', pa.timestamp('us'))]),
+}
+
+EXPORT_STATE_FILE = 'export_state.json'
+
+
+def load_exported_until(export_dir: str) -> datetime:
+    """
+    Gets the accessed time up to which results were already exported or None if nothing was exported yet.
+    """
+    path = os.path.join(export_dir, EXPORT_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return datetime.fromisoformat(json.load(file)['exported_until'])
+
+
+def save_exported_until(export_dir: str, exported_until: datetime):
+    path = os.path.join(export_dir, EXPORT_STATE_FILE)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump({'exported_until': exported_until.isoformat()}, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def split_range(first_id: int, last_id: int, n_parts: int) -> list[(int, int)]:
+    """
+    Splits an id range into at most n_parts inclusive ranges of similar size.
+    """
+    part_size = max((last_id - first_id + 1 + n_parts - 1) // n_parts, 1)
+    return [(start, min(start + part_size - 1, last_id)) for start in range(first_id, last_id + 1, part_size)]
+
+
+def read_file_chunks(path: str):
+    with open(path, 'rb') as file:
+        while chunk := file.read(DOCUMENT_CHUNK_SIZE):
+            yield chunk
+
+
+class WarcRotator:
+    """
+    Writes records to numbered WARC files of a worker, a new file is started once the current one is too large.
+    """
+
+    def __init__(self, run_dir: str, worker: int):
+        self.run_dir = run_dir
+        self.worker = worker
+        self.n_files = 0
+        self.writer: WarcWriter = None
+
+    def get_writer(self) -> WarcWriter:
+        if self.writer is not None and self.writer.size() > WARC_MAX_SIZE:
+            self.writer.close()
+            self.writer = None
+        if self.writer is None:
+            self.writer = WarcWriter(os.path.join(self.run_dir, f'crawl-{self.worker}-{self.n_files}.warc.gz'))
+            self.n_files += 1
+        return self.writer
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def export_table(database_manager: DatabaseManager, table: str, run_dir: str, worker: int, since: datetime,
+                       until: datetime, first_page_id: int, last_page_id: int, warc: WarcRotator) -> int:
+    """
+    Streams the table's rows of the page id range to a Parquet file and page contents and documents to WARC files.
+    Returns the number of exported rows.
+    """
+    schema = export_schemas[table]
+    n_rows = 0
+    with pq.ParquetWriter(os.path.join(run_dir, f'{table}-{worker}.parquet'), schema) as parquet_writer:
+        async for rows in database_manager.stream_export_rows(table=table, since=since, until=until,
+                                                              first_page_id=first_page_id,
+                                                              last_page_id=last_page_id,
+                                                              batch_size=EXPORT_BATCH_SIZE):
+            columns = list(zip(*rows))
+            parquet_writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field
+                                                        in zip(columns[:len(schema)], schema)], schema=schema))
+            n_rows += len(rows)
+            for row in rows:
+                match table:
+                    case 'page' if row.html_content is not None:
+                        warc.get_writer().write_html(url=row.url, accessed_time=row.accessed_time,
+                                                     html=row.html_content, html_hash=row.html_content_hash)
+                    case 'page_data' if row.storage_path is not None and os.path.exists(row.storage_path):
+                        warc.get_writer().write_resource(
+                            url=row.url,
+                            accessed_time=row.accessed_time,
+                            content_type=guess_type(row.storage_path)[0] or 'application/octet-stream',
+                            block=read_file_chunks(row.storage_path),
+                            length=row.size,
+                            sha256_hex=row.content_hash)
+    return n_rows
+
+
+async def export_range(database_manager: DatabaseManager, run_dir: str, worker: int, since: datetime,
+                       until: datetime, first_page_id: int, last_page_id: int):
+    """
+    Exports all tables for a range of page ids.
+    """
+    logger.info(f'Exporting pages {first_page_id} to {last_page_id} started.')
+    warc = WarcRotator(run_dir=run_dir, worker=worker)
+    try:
+        for table in export_schemas:
+            n_rows = await export_table(database_manager=database_manager, table=table, run_dir=run_dir,
+                                        worker=worker, since=since, until=until, first_page_id=first_page_id,
+                                        last_page_id=last_page_id, warc=warc)
+            logger.debug(f'Exported {n_rows} {table} rows of pages {first_page_id} to {last_page_id}.')
+    finally:
+        warc.close()
+        await database_manager.cleanup()
+    logger.info(f'Exporting pages {first_page_id} to {last_page_id} finished.')
+
+
+def export_entrypoint(database_manager: DatabaseManager, run_dir: str, worker: int, since: datetime,
+                      until: datetime, first_page_id: int, last_page_id: int, failed_workers: list[int]):
+    try:
+        asyncio.run(export_range(database_manager=database_manager, run_dir=run_dir, worker=worker, since=since,
+                                 until=until, first_page_id=first_page_id, last_page_id=last_page_id))
+    except Exception as e:
+        logger.critical(f'Exporting pages {first_page_id} to {last_page_id} failed with an error {e}.')
+        failed_workers.append(worker)
+
+
+async def export_results(database_manager: DatabaseManager, export_dir: str = EXPORT_DIR,
+                         n_workers: int = EXPORT_WORKERS):
+    """
+    Exports results crawled since the last export. Page id ranges are exported in parallel by separate threads,
+    each writing its own Parquet and WARC files to a new directory of the run.
+    """
+    since = load_exported_until(export_dir=export_dir)
+    # Pages that are still being crawled aren't saved yet, so they are left for the next export.
+    until = datetime.now() - timedelta(seconds=EXPORT_SETTLE_TIME)
+    page_id_range = await database_manager.get_export_page_id_range(since=since, until=until)
+    if page_id_range is None:
+        logger.info('There are no new results to export.')
+        return
+
+    run_dir = os.path.join(export_dir, until.strftime('%Y%m%dT%H%M%S'))
+    os.makedirs(run_dir, exist_ok=True)
+    failed_workers = []
+    threads = [threading.Thread(target=export_entrypoint,
+                                args=(database_manager, run_dir, worker, since, until, first_page_id,
+                                      last_page_id, failed_workers))
+               for worker, (first_page_id, last_page_id) in enumerate(split_range(*page_id_range, n_workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if len(failed_workers) > 0:
+        # The next export starts from the same time again.
+        logger.warning(f'Export to {run_dir} is incomplete.')
+        return
+    save_exported_until(export_dir=export_dir, exported_until=until)
+    logger.info(f'Results crawled until {until} exported to {run_dir}.')
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+import msgpack
+
+from common.constants import FETCH_MODE, FETCH_ARCHIVE_PATH
+from common.globals import fetch_attempts, lock
+from logger.logger import logger
+
+# msgpack extension type of datetimes.
+DATETIME_EXT_TYPE = 1
+
+# SQLite connections to the fetch archive, one per thread.
+connections = threading.local()
+
+
+class ArchiveMiss(Exception):
+    """
+    Raised when a replayed request wasn't recorded.
+    """
+
+
+def is_recording() -> bool:
+    return FETCH_MODE == 'record'
+
+
+def is_replaying() -> bool:
+    return FETCH_MODE == 'replay'
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Gets the thread's connection to the fetch archive.
+    Replays open the archive read only, so recordings can't be changed by accident.
+    """
+    if not hasattr(connections, 'connection'):
+        if is_replaying():
+            connection = sqlite3.connect(f'file:{FETCH_ARCHIVE_PATH}?mode=ro', uri=True, isolation_level=None)
+        else:
+            os.makedirs(os.path.dirname(FETCH_ARCHIVE_PATH) or '.', exist_ok=True)
+            connection = sqlite3.connect(FETCH_ARCHIVE_PATH, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS attempt ('
+                               'kind TEXT NOT NULL, '
+                               'url TEXT NOT NULL, '
+                               'attempt INTEGER NOT NULL, '
+                               'error TEXT, '
+                               'data BLOB, '
+                               'PRIMARY KEY (kind, url, attempt)) WITHOUT ROWID')
+        connections.connection = connection
+    return connections.connection
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(DATETIME_EXT_TYPE, value.isoformat().encode('ascii'))
+    raise TypeError(f'Value of type {type(value)} can not be archived.')
+
+
+def decode_value(code: int, data: bytes):
+    if code == DATETIME_EXT_TYPE:
+        return datetime.fromisoformat(data.decode('ascii'))
+    return msgpack.ExtType(code, data)
+
+
+def next_attempt(kind: str, url: str) -> int:
+    """
+    Counts a request and returns its attempt number, starting with 0 for the first request of the url.
+    """
+    with lock:
+        attempt = fetch_attempts.get((kind, url), 0)
+        fetch_attempts[(kind, url)] = attempt + 1
+    return attempt
+
+
+def save_record(kind: str, url: str, attempt: int, result: Any = None, error: str = None):
+    """
+    Saves a fetch attempt's result or error to the archive, replacing an earlier recording of the same attempt.
+    """
+    data = None if error is not None else zlib.compress(msgpack.packb(result, default=encode_value))
+    get_connection().execute('INSERT OR REPLACE INTO attempt (kind, url, attempt, error, data) VALUES (?, ?, ?, ?, ?)',
+                             (kind, url, attempt, error, data))
+
+
+def load_record(kind: str, url: str, attempt: int) -> Any:
+    """
+    Loads a recorded fetch attempt's result. Recorded errors are raised again, so replays fail the same way.
+    Attempts beyond the recorded ones replay the last recorded attempt.
+    """
+    row = get_connection().execute('SELECT error, data FROM attempt WHERE kind = ? AND url = ? AND attempt <= ? '
+                                   'ORDER BY attempt DESC LIMIT 1', (kind, url, attempt)).fetchone()
+    if row is None:
+        raise ArchiveMiss(f'Request of {kind} {url} is not in the fetch archive.')
+    error, data = row
+    if error is not None:
+        raise Exception(error)
+    return msgpack.unpackb(zlib.decompress(data), ext_hook=decode_value)
+
+
+def call_archived(kind: str, url: str, fetch: Callable[[], Any]) -> Any:
+    """
+    Calls the fetch function or replays its archived result, depending on the fetch mode.
+    Results and errors of each attempt are archived while recording. Tuples are replayed as lists.
+    """
+    if is_replaying():
+        return load_record(kind=kind, url=url, attempt=next_attempt(kind=kind, url=url))
+    attempt = next_attempt(kind=kind, url=url) if is_recording() else None
+    try:
+        result = fetch()
+    except Exception as e:
+        if is_recording():
+            save_record(kind=kind, url=url, attempt=attempt, error=str(e))
+        raise
+    if is_recording():
+        save_record(kind=kind, url=url, attempt=attempt, result=result)
+    return result
+
+
+async def fetch_archived(kind: str, url: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Awaits the fetch function or replays its archived result, depending on the fetch mode.
+    Results and errors of each attempt are archived while recording. Tuples are replayed as lists.
+    """
+    if is_replaying():
+        logger.debug(f'Replaying {kind} {url} from the fetch archive.')
+        return load_record(kind=kind, url=url, attempt=next_attempt(kind=kind, url=url))
+    attempt = next_attempt(kind=kind, url=url) if is_recording() else None
+    try:
+        result = await fetch()
+    except Exception as e:
+        if is_recording():
+            save_record(kind=kind, url=url, attempt=attempt, error=str(e))
+        raise
+    if is_recording():
+        save_record(kind=kind, url=url, attempt=attempt, result=result)
+    return result
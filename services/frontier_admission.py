@@ -0,0 +1,100 @@
+from collections import Counter
+from urllib.parse import urlparse
+
+from common.constants import HOST_MAX_PAGES, HOST_MAX_DEPTH, host_crawl_budgets, HOST_MAX_FRONTIER, \
+    MAX_PATH_SEGMENTS, MAX_SEGMENT_REPEATS, MAX_URLS_PER_PATTERN, pattern_segment_regex
+from common.globals import url_pattern_counts, lock
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.crawl_stats import get_stat, count_stat, get_stat_group
+from services.frontier_notifier import notify_frontier_changed
+
+
+def get_host(url: str) -> str:
+    return urlparse(url).netloc.replace('www.', '')
+
+
+def get_budget(host: str) -> (int, int):
+    """
+    Returns the maximum number of pages and the maximum depth of the host.
+    """
+    budget = host_crawl_budgets.get(host, {})
+    return budget.get('max_pages', HOST_MAX_PAGES), budget.get('max_depth', HOST_MAX_DEPTH)
+
+
+def get_url_pattern(host: str, segments: list[str]) -> str:
+    """
+    Returns the url's pattern with numbers and ids replaced by a placeholder
+    or None if the path doesn't have any such segments.
+    """
+    pattern = [segment if not pattern_segment_regex.search(segment) else '*' for segment in segments]
+    if '*' not in pattern:
+        return None
+    return host + '/' + '/'.join(pattern)
+
+
+def check_admission(url: str, depth: int) -> str:
+    """
+    Checks whether the url may be added to the frontier.
+    Returns the reason the url was rejected or None if it's admitted.
+    """
+    host = get_host(url)
+    max_pages, max_depth = get_budget(host)
+    if depth > max_depth:
+        return 'depth'
+    segments = [segment for segment in urlparse(url).path.split('/') if segment]
+    if len(segments) > MAX_PATH_SEGMENTS:
+        return 'path_length'
+    if len(segments) > MAX_SEGMENT_REPEATS and Counter(segments).most_common(1)[0][1] > MAX_SEGMENT_REPEATS:
+        return 'repeated_segments'
+    # Pages that are being crawled aren't counted, there are only a few of them.
+    if get_stat('host', host) + get_stat('host_frontier', host) + get_stat('host_spill', host) >= max_pages:
+        return 'host_pages'
+    pattern = get_url_pattern(host=host, segments=segments)
+    if pattern is not None and url_pattern_counts.get(pattern, 0) >= MAX_URLS_PER_PATTERN:
+        return 'url_pattern'
+    return None
+
+
+def record_admission(url: str):
+    """
+    Counts an url that was added to the frontier by its pattern.
+    """
+    host = get_host(url)
+    pattern = get_url_pattern(host=host, segments=[segment for segment in urlparse(url).path.split('/') if segment])
+    if pattern is not None:
+        with lock:
+            url_pattern_counts[pattern] = url_pattern_counts.get(pattern, 0) + 1
+
+
+def count_rejection(url: str, reason: str):
+    logger.debug(f'Url {url} was not added to the frontier because of its {reason}.')
+    count_stat(group='rejected', key=reason)
+
+
+def is_host_frontier_full(url: str) -> bool:
+    return get_stat('host_frontier', get_host(url)) >= HOST_MAX_FRONTIER
+
+
+async def refill_host_frontier(database_manager: DatabaseManager, url: str):
+    """
+    Moves spilled links of the url's host back to the frontier once most of the host's frontier entries are crawled.
+    """
+    host = get_host(url)
+    if get_stat('host_spill', host) > 0 and get_stat('host_frontier', host) < HOST_MAX_FRONTIER // 2:
+        if await database_manager.unspill_frontier(limit=HOST_MAX_FRONTIER // 2, domain=host) > 0:
+            notify_frontier_changed()
+
+
+async def refill_empty_frontier(database_manager: DatabaseManager, blocked_domains: set[str] = None):
+    """
+    Moves spilled links back to the frontier once it's empty, in case spill-over counts weren't up to date.
+    Links of blocked hosts (e.g. with an open circuit) and of hosts with a full frontier aren't moved.
+    Sleeping threads are woken up if any links were moved.
+    """
+    if get_stat('frontier', 'size') > 0 or not await database_manager.is_frontier_empty():
+        return
+    excluded_domains = {host for host, count in get_stat_group('host_frontier').items() if count >= HOST_MAX_FRONTIER}
+    if await database_manager.unspill_frontier(limit=HOST_MAX_FRONTIER // 2,
+                                               excluded_domains=excluded_domains | (blocked_domains or set())) > 0:
+        notify_frontier_changed()
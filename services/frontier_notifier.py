@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from common.constants import FRONTIER_WAIT_TIMEOUT
+from common.globals import frontier_condition, frontier_state, threads_status
+from logger.logger import logger
+
+
+def get_frontier_version() -> int:
+    """
+    Gets the current frontier version.
+    It has to be read before popping the frontier, so inserts that happen in between are not missed.
+    """
+    with frontier_condition:
+        return frontier_state['version']
+
+
+def notify_frontier_changed():
+    """
+    Wakes up all sleeping threads because new links were added to the frontier.
+    """
+    with frontier_condition:
+        frontier_state['version'] += 1
+        frontier_condition.notify_all()
+    logger.debug('Sleeping threads notified about new frontier links.')
+
+
+def wait_for_frontier(thread_number: int, seen_version: int, timeout: float = FRONTIER_WAIT_TIMEOUT,
+                      next_attempt_time: datetime = None) -> bool:
+    """
+    Blocks the thread until new links are added to the frontier or the crawl is finished.
+    The crawl is finished when every thread is waiting, because then nobody can add new links anymore,
+    unless some frontier entries are waiting for a retry. Then the thread waits until the first retry is due.
+    Returns False if the crawl is finished and the thread should stop.
+    This is a blocking call, so it should be run in a separate thread with asyncio.to_thread.
+    """
+    with frontier_condition:
+        if frontier_state['finished']:
+            return False
+        if frontier_state['version'] != seen_version:
+            # Links were added after the pop, so try again immediately.
+            return True
+        threads_status[thread_number] = False
+        if next_attempt_time is not None:
+            timeout = max(min(timeout, (next_attempt_time - datetime.now()).total_seconds()), 0)
+        elif not any(threads_status.values()):
+            logger.info('All threads are waiting and the frontier is empty, finishing the crawl.')
+            frontier_state['finished'] = True
+            frontier_condition.notify_all()
+            return False
+        logger.debug(f'Thread {thread_number} is waiting for new frontier links.')
+        frontier_condition.wait_for(
+            lambda: frontier_state['finished'] or frontier_state['version'] != seen_version,
+            timeout=timeout)
+        if frontier_state['finished']:
+            return False
+        threads_status[thread_number] = True
+        return True
+
+
+def mark_thread_finished(thread_number: int):
+    """
+    Marks the thread as not running anymore, so it doesn't block finishing the crawl.
+    """
+    with frontier_condition:
+        threads_status[thread_number] = False
+        if not any(threads_status.values()):
+            frontier_state['finished'] = True
+        frontier_condition.notify_all()
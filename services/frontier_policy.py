@@ -0,0 +1,61 @@
+from urllib.parse import urlparse
+
+from common.constants import FRONTIER_POLICY, low_value_segments_regex
+from common.globals import host_frontier_counts, lock
+from logger.logger import logger
+
+
+def bfs_priority(url: str, depth: int) -> float:
+    """
+    Pages closer to the seeds are crawled first.
+    """
+    return -depth
+
+
+def best_first_priority(url: str, depth: int) -> float:
+    """
+    Scores the url, so hub pages (shallow, short paths) are crawled before deep pagination links.
+    """
+    segments = [segment for segment in urlparse(url).path.split('/') if segment]
+    score = -2.0 * depth - 0.5 * len(segments)
+    # Penalize pagination, archives, search results and similar.
+    score -= 3.0 * sum(1 for segment in segments if low_value_segments_regex.match(segment.lower()))
+    # Section index pages usually link to a lot of new content.
+    if url.endswith('/'):
+        score += 1.0
+    return score
+
+
+def fair_priority(url: str, depth: int) -> float:
+    """
+    Each host's n-th link gets the same priority, so hosts are crawled in a round robin fashion.
+    Only links that were added to the frontier are counted (see count_frontier_link),
+    so requeued pages and duplicate links don't push back the host's next links.
+    """
+    count = host_frontier_counts.get(urlparse(url).netloc.replace('www.', ''), 0)
+    return -count - depth / 1000
+
+
+def count_frontier_link(url: str):
+    """
+    Counts a link added to the frontier for the fair frontier policy.
+    """
+    host = urlparse(url).netloc.replace('www.', '')
+    with lock:
+        host_frontier_counts[host] = host_frontier_counts.get(host, 0) + 1
+
+
+frontier_policies = {
+    'bfs': bfs_priority,
+    'best-first': best_first_priority,
+    'fair': fair_priority,
+}
+
+
+def get_priority(url: str, depth: int, policy: str = FRONTIER_POLICY) -> float:
+    """
+    Calculates the frontier priority of the url using the selected policy. Higher priority is crawled first.
+    """
+    priority = frontier_policies[policy](url, depth)
+    logger.debug(f'Url {url} at depth {depth} has priority {priority}.')
+    return priority
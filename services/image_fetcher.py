@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+from common.constants import USER_AGENT, PAGE_WAIT_TIMEOUT, IMAGE_MAX_SIZE, IMAGE_MAX_HOST_CONCURRENCY, \
+    IMAGE_FETCH_WORKERS
+from common.globals import image_url_hashes, robots_parsers
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.background_queue import BackgroundQueue
+from services.delay_manager import refresh_site_available_time, get_host_semaphore
+from util.util import is_domain_allowed, is_url_allowed, get_site_ip
+
+
+def download_image(url: str) -> (str, bytes):
+    """
+    Downloads an image, but stops as soon as it's larger than IMAGE_MAX_SIZE.
+    Returns content type and data or None if the download failed.
+    """
+    with requests.get(url, verify=False, timeout=PAGE_WAIT_TIMEOUT / 1000, stream=True,
+                      headers={'User-Agent': USER_AGENT}) as response:
+        if response.status_code != 200:
+            logger.debug(f'Downloading image {url} failed with the status {response.status_code}.')
+            return None
+        if int(response.headers.get('content-length') or 0) > IMAGE_MAX_SIZE:
+            logger.debug(f'Image {url} is too large.')
+            return None
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            data.extend(chunk)
+            if len(data) > IMAGE_MAX_SIZE:
+                logger.debug(f'Image {url} is too large.')
+                return None
+        content_type = response.headers.get('content-type', '').split(';')[0].strip()
+        return content_type, bytes(data)
+
+
+class ImageFetcher(BackgroundQueue):
+    """
+    Downloads images of crawled pages in the background of a thread's event loop.
+    Each unique image (by content hash) is saved only once.
+    Queued items are saved images' ids and urls.
+    """
+
+    def __init__(self, database_manager: DatabaseManager):
+        super().__init__(n_workers=IMAGE_FETCH_WORKERS)
+        self.database_manager = database_manager
+
+    async def process(self, item: (int, str)):
+        image_id, url = item
+        await self.fetch_image(image_id=image_id, url=url)
+
+    async def fetch_image(self, image_id: int, url: str):
+        """
+        Downloads the image and saves it, unless an image with the same url or content was already saved.
+        """
+        content_hash = image_url_hashes.get(url)
+        if content_hash is not None:
+            logger.debug(f'Image {url} was already downloaded.')
+            await self.database_manager.save_image_content(image_id=image_id, content_hash=content_hash)
+            return
+
+        host = urlparse(url).netloc
+        robot_file_parser = robots_parsers.get(host.replace('www.', ''))
+        # Images are only downloaded from allowed sites whose robots.txt is known.
+        if robot_file_parser is None or not is_domain_allowed(url=url) \
+                or not is_url_allowed(url, robot_file_parser=robot_file_parser):
+            logger.debug(f'Image {url} is not allowed to be downloaded.')
+            return
+
+        semaphore = get_host_semaphore(host=host, limit=IMAGE_MAX_HOST_CONCURRENCY)
+        await asyncio.to_thread(semaphore.acquire)
+        try:
+            await refresh_site_available_time(domain=host,
+                                              ip=get_site_ip(hostname=host),
+                                              robot_delay=robot_file_parser.crawl_delay(useragent=USER_AGENT))
+            image = await asyncio.to_thread(download_image, url)
+        finally:
+            semaphore.release()
+        if image is None:
+            return
+
+        content_type, data = image
+        content_hash = hashlib.sha256(data).hexdigest()
+        await self.database_manager.save_image_content(image_id=image_id,
+                                                       content_hash=content_hash,
+                                                       content_type=content_type,
+                                                       data=data,
+                                                       accessed_time=datetime.now())
+        image_url_hashes[url] = content_hash
+        logger.debug(f'Image {url} downloaded.')
@@ -0,0 +1,147 @@
+import re
+import weakref
+from functools import lru_cache
+
+from playwright.async_api import Page, Route, CDPSession
+
+from common.constants import interception_rules, site_interception_rules, resource_type_extensions, \
+    INTERCEPTION_STRICT_RESOURCE_TYPES
+from logger.logger import logger
+from services.resource_cache import serve_cached_resource
+
+
+class CompiledRules:
+    """
+    Interception rules of a site split into url patterns blocked by the browser
+    and resource types handled by the Python route.
+    """
+
+    def __init__(self, blocked_url_patterns: tuple[str], blocked_types: frozenset[str], cached_types: frozenset[str]):
+        self.blocked_url_patterns = blocked_url_patterns
+        self.blocked_types = blocked_types
+        self.cached_types = cached_types
+
+
+def get_extension_patterns(resource_type: str) -> list[str]:
+    """
+    Gets browser url patterns of the resource type's file extensions (with or without a query).
+    """
+    return [pattern for extension in resource_type_extensions.get(resource_type, [])
+            for pattern in [f'*.{extension}', f'*.{extension}?*']]
+
+
+def get_host_patterns(host: str) -> list[str]:
+    """
+    Gets browser url patterns of the host and its subdomains.
+    """
+    return [f'*://{host}/*', f'*://*.{host}/*']
+
+
+@lru_cache(maxsize=None)
+def compile_rules(domain: str) -> CompiledRules:
+    """
+    Compiles the site's and the general interception rules.
+    The first matching rule wins, so resource types and hosts allowed by an earlier rule aren't blocked later.
+    """
+    allowed_types, allowed_hosts = set(), set()
+    blocked_url_patterns, blocked_types, cached_types = [], set(), set()
+    for rule in site_interception_rules.get(domain.replace('www.', ''), []) + interception_rules:
+        resource_types = set(rule.get('resource_types', [])) - allowed_types - blocked_types - cached_types
+        hosts = set(rule.get('hosts', [])) - allowed_hosts
+        match rule['action']:
+            case 'allow':
+                allowed_types.update(resource_types)
+                allowed_hosts.update(hosts)
+            case 'block':
+                blocked_types.update(resource_types)
+                for resource_type in sorted(resource_types):
+                    blocked_url_patterns.extend(get_extension_patterns(resource_type))
+                for host in sorted(hosts):
+                    blocked_url_patterns.extend(get_host_patterns(host))
+                blocked_url_patterns.extend(rule.get('url_patterns', []))
+            case 'cache':
+                cached_types.update(resource_types)
+            case action:
+                raise ValueError(f'Unknown interception rule action {action}.')
+    return CompiledRules(blocked_url_patterns=tuple(blocked_url_patterns),
+                         blocked_types=frozenset(blocked_types),
+                         cached_types=frozenset(cached_types))
+
+
+def get_routed_urls():
+    """
+    Gets the pattern of urls that are routed to Python.
+    Only urls of cacheable resource types and urls without a file extension (e.g. images served by a CDN),
+    whose resource type can't be blocked by the browser's url patterns, have to be handled there,
+    unless resource types are checked strictly.
+    """
+    if INTERCEPTION_STRICT_RESOURCE_TYPES:
+        return '**/*'
+    rule_sets = list(site_interception_rules.values()) + [interception_rules]
+    extensions = sorted({extension for rules in rule_sets for rule in rules if rule['action'] == 'cache'
+                         for resource_type in rule.get('resource_types', [])
+                         for extension in resource_type_extensions.get(resource_type, [])})
+    return re.compile(rf'^([^?#]*\.({"|".join(map(re.escape, extensions))})|[^?#]*/[^/?#.]*)([?#].*)?$',
+                      re.IGNORECASE)
+
+
+class RequestInterceptor:
+    """
+    Applies compiled interception rules of the currently crawled site to a browser page.
+    The page isn't referenced, so interceptors of closed pages are garbage collected.
+    """
+
+    def __init__(self):
+        self.cdp_session: CDPSession = None
+        self.rules: CompiledRules = compile_rules('')
+
+    async def start(self, page: Page):
+        try:
+            self.cdp_session = await page.context.new_cdp_session(page)
+            await self.cdp_session.send('Network.enable')
+        except Exception as e:
+            # All requests are checked by the route instead.
+            logger.warning(f'Browser request blocking is not available because of an error {e}.')
+            self.cdp_session = None
+        await self.set_rules(self.rules, force=True)
+        await page.route(get_routed_urls() if self.cdp_session is not None else '**/*', self.handle)
+
+    async def set_rules(self, rules: CompiledRules, force: bool = False):
+        if rules is self.rules and not force:
+            return
+        self.rules = rules
+        if self.cdp_session is not None:
+            await self.cdp_session.send('Network.setBlockedURLs', {'urls': list(rules.blocked_url_patterns)})
+
+    async def handle(self, route: Route):
+        resource_type = route.request.resource_type
+        if resource_type in self.rules.blocked_types:
+            await route.abort()
+        elif resource_type in self.rules.cached_types:
+            await serve_cached_resource(route)
+        else:
+            await route.continue_()
+
+
+# Interceptors of open browser pages.
+interceptors: weakref.WeakKeyDictionary[Page, RequestInterceptor] = weakref.WeakKeyDictionary()
+
+
+async def install_interceptor(page: Page):
+    """
+    Starts intercepting the page's requests with the general interception rules.
+    """
+    interceptor = RequestInterceptor()
+    await interceptor.start(page=page)
+    interceptors[page] = interceptor
+
+
+async def apply_site_rules(page: Page, domain: str):
+    """
+    Switches the page's interception rules to the rules of the site that is going to be crawled.
+    """
+    interceptor = interceptors.get(page)
+    if interceptor is not None:
+        domain = domain.replace('www.', '')
+        # Sites without their own rules share the compiled general rules.
+        await interceptor.set_rules(compile_rules(domain if domain in site_interception_rules else ''))
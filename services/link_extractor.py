@@ -1,12 +1,13 @@
 import re
-from urllib.parse import ParseResult
+from urllib.parse import ParseResult, urljoin, urlparse
 from urllib.robotparser import RobotFileParser
 
 from bs4 import BeautifulSoup
 
 from common.constants import navigation_assign_regex, navigation_func_regex
 from logger.logger import logger
-from util.util import is_url, fill_url, is_url_allowed, is_domain_allowed, canonicalize
+from services.robots_matcher import filter_allowed_urls
+from util.util import is_url, fill_url, is_domain_allowed, canonicalize
 
 
 def find_links(beautiful_soup: BeautifulSoup, current_url: ParseResult, robot_file_parser: RobotFileParser) \
@@ -31,12 +32,7 @@ def find_links(beautiful_soup: BeautifulSoup, current_url: ParseResult, robot_fi
         if href is not None and is_url(href):
             url = href
         elif onclick is not None:
-            # check for format when directly assigning
-            if navigation_assign_regex.match(onclick):
-                url = re.search(navigation_assign_regex, onclick).group(3)
-            # check for format when using function to assign
-            elif navigation_func_regex.match(onclick):
-                url = re.search(navigation_func_regex, onclick).group(4)
+            url = get_onclick_url(onclick)
         else:
             continue
 
@@ -47,12 +43,52 @@ def find_links(beautiful_soup: BeautifulSoup, current_url: ParseResult, robot_fi
         # handle relative path URLs and fix them
         url = fill_url(url, current_url)
 
-        # check if the url is allowed to visit
-        if is_url_allowed(url, robot_file_parser=robot_file_parser) \
-                and is_domain_allowed(url=url):
+        if is_domain_allowed(url=url):
             new_urls.add(url)
 
+    # check if the urls are allowed to visit
+    new_urls = filter_allowed_urls(new_urls, robot_file_parser=robot_file_parser)
+
     # translate URLs to canonical form
-    new_urls = canonicalize(new_urls)
+    new_urls = canonicalize(set(new_urls))
 
     return new_urls
+
+
+def get_onclick_url(onclick: str) -> str:
+    """
+    Gets the url that an onclick handler navigates to or None.
+    """
+    # check for format when directly assigning
+    if navigation_assign_regex.match(onclick):
+        return re.search(navigation_assign_regex, onclick).group(3)
+    # check for format when using function to assign
+    elif navigation_func_regex.match(onclick):
+        return re.search(navigation_func_regex, onclick).group(4)
+    return None
+
+
+def find_browser_links(base_url: str, hrefs: list[str], onclicks: list[str], robot_file_parser: RobotFileParser) \
+        -> set[str]:
+    """
+    Filters links collected by the browser and returns them in canonical form.
+    :param base_url: page's base url, used for resolving onclick urls
+    :param hrefs: anchor urls, already resolved by the browser
+    :param onclicks: onclick handlers
+    :param robot_file_parser: parser for robots.txt
+    """
+    logger.debug(f'Filtering links collected in the browser.')
+    # Links that aren't strings (e.g. of SVG anchors) can't be used.
+    urls = {href for href in hrefs if isinstance(href, str)}
+    for onclick in onclicks:
+        url = get_onclick_url(onclick)
+        if url is not None:
+            urls.add(urljoin(base_url, url))
+
+    # check if the url is valid and allowed to visit
+    new_urls = [url for url in urls if is_url(url) and urlparse(url).scheme in ['http', 'https']
+                and is_domain_allowed(url=url)]
+    new_urls = filter_allowed_urls(new_urls, robot_file_parser=robot_file_parser)
+
+    # translate URLs to canonical form
+    return canonicalize(set(new_urls))
@@ -0,0 +1,124 @@
+from time import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from common.constants import PAGERANK_DAMPING, PAGERANK_TOLERANCE, PAGERANK_MAX_ITERATIONS
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+
+
+async def load_page_sites(database_manager: DatabaseManager) -> (np.ndarray, np.ndarray):
+    """
+    Loads ids of all pages and their sites into arrays sorted by page id.
+    """
+    batches = [np.array(partition, dtype=np.int32).reshape(-1, 2)
+               async for partition in database_manager.stream_page_sites()]
+    pages = np.concatenate(batches) if len(batches) > 0 else np.empty((0, 2), dtype=np.int32)
+    pages = pages[np.argsort(pages[:, 0])]
+    return pages[:, 0], pages[:, 1]
+
+
+async def load_graph(database_manager: DatabaseManager, page_ids: np.ndarray) -> csr_matrix:
+    """
+    Loads links into a sparse adjacency matrix. Rows and columns are indexes of pages in page_ids.
+    Links are converted to indexes batch by batch, so only the compact arrays are kept in memory.
+    """
+    rows, columns = [], []
+    async for partition in database_manager.stream_links():
+        links = np.array(partition, dtype=np.int32).reshape(-1, 2)
+        from_indexes = np.searchsorted(page_ids, links[:, 0])
+        to_indexes = np.searchsorted(page_ids, links[:, 1])
+        # Skip links of pages that were added after the pages were loaded.
+        known = (from_indexes < len(page_ids)) & (to_indexes < len(page_ids))
+        known[known] &= (page_ids[from_indexes[known]] == links[known, 0]) & \
+                        (page_ids[to_indexes[known]] == links[known, 1])
+        rows.append(from_indexes[known].astype(np.int32))
+        columns.append(to_indexes[known].astype(np.int32))
+    rows = np.concatenate(rows) if len(rows) > 0 else np.empty(0, dtype=np.int32)
+    columns = np.concatenate(columns) if len(columns) > 0 else np.empty(0, dtype=np.int32)
+    return csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(page_ids), len(page_ids)))
+
+
+def compute_pagerank(graph: csr_matrix, damping: float = PAGERANK_DAMPING, tolerance: float = PAGERANK_TOLERANCE,
+                     max_iterations: int = PAGERANK_MAX_ITERATIONS) -> np.ndarray:
+    """
+    Computes PageRank with power iteration. Rank of pages without links is spread evenly over all pages.
+    """
+    n_pages = graph.shape[0]
+    if n_pages == 0:
+        return np.empty(0)
+    out_degree = np.asarray(graph.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inverse_out_degree = np.divide(1.0, out_degree, out=np.zeros(n_pages), where=~dangling)
+    transposed = graph.T.tocsr()
+    rank = np.full(n_pages, 1.0 / n_pages)
+    for iteration in range(max_iterations):
+        new_rank = damping * (transposed @ (rank * inverse_out_degree))
+        new_rank += (damping * rank[dangling].sum() + 1 - damping) / n_pages
+        error = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if error < tolerance:
+            logger.debug(f'PageRank converged after {iteration + 1} iterations.')
+            break
+    return rank
+
+
+def compute_site_metrics(graph: csr_matrix, page_sites: np.ndarray, pagerank: np.ndarray) -> \
+        (np.ndarray, np.ndarray):
+    """
+    Aggregates the page graph by site.
+    Returns site ids and an array with pages, internal links, outgoing links, incoming links and linked sites counts
+    and the sum of pages' PageRank for each site.
+    """
+    site_ids, site_indexes = np.unique(page_sites, return_inverse=True)
+    # Pages without a site (-1) are not aggregated.
+    site_indexes = np.where(page_sites >= 0, site_indexes, -1)
+    n_sites = len(site_ids)
+    edges = graph.tocoo()
+    from_sites, to_sites = site_indexes[edges.row], site_indexes[edges.col]
+    internal = (from_sites == to_sites) & (from_sites >= 0)
+    external = (from_sites != to_sites) & (from_sites >= 0) & (to_sites >= 0)
+    site_graph = csr_matrix((np.ones(external.sum(), dtype=np.int32), (from_sites[external], to_sites[external])),
+                            shape=(n_sites, n_sites))
+    site_graph.sum_duplicates()
+    has_site = site_indexes >= 0
+    metrics = np.column_stack([
+        np.bincount(site_indexes[has_site], minlength=n_sites),
+        np.bincount(from_sites[internal], minlength=n_sites),
+        np.bincount(from_sites[external], minlength=n_sites),
+        np.bincount(to_sites[external], minlength=n_sites),
+        site_graph.getnnz(axis=1),
+        np.bincount(site_indexes[has_site], weights=pagerank[has_site], minlength=n_sites),
+    ])
+    keep = site_ids >= 0
+    return site_ids[keep], metrics[keep]
+
+
+async def analyze_link_graph(database_manager: DatabaseManager):
+    """
+    Calculates in-degree, out-degree, PageRank and strongly connected components of pages
+    and aggregated metrics of sites and saves them to the database.
+    """
+    start_time = time()
+    page_ids, page_sites = await load_page_sites(database_manager=database_manager)
+    graph = await load_graph(database_manager=database_manager, page_ids=page_ids)
+    logger.info(f'Loaded {len(page_ids)} pages and {graph.nnz} links in {time() - start_time:.2f} seconds.')
+
+    analysis_start_time = time()
+    in_degree = graph.getnnz(axis=0)
+    out_degree = graph.getnnz(axis=1)
+    pagerank = compute_pagerank(graph=graph)
+    n_components, components = connected_components(graph, directed=True, connection='strong')
+    site_ids, site_metrics = compute_site_metrics(graph=graph, page_sites=page_sites, pagerank=pagerank)
+    largest_component = np.bincount(components).max() if len(components) > 0 else 0
+    logger.info(f'Found {n_components} strongly connected components (the largest has {largest_component} pages) '
+                f'in {time() - analysis_start_time:.2f} seconds.')
+
+    await database_manager.save_link_graph_metrics(
+        page_metrics=zip(page_ids.tolist(), in_degree.tolist(), out_degree.tolist(), pagerank.tolist(),
+                         components.tolist()),
+        site_metrics=((site_id, *[int(value) for value in metrics[:-1]], float(metrics[-1]))
+                      for site_id, metrics in zip(site_ids.tolist(), site_metrics)))
+    logger.info(f'Link graph analysis finished in {time() - start_time:.2f} seconds.')
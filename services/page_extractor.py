@@ -1,69 +1,110 @@
 import os
 from datetime import datetime
+from time import time
 from mimetypes import guess_extension
 from urllib.parse import ParseResult
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
 from urllib.robotparser import RobotFileParser
 
 import requests
 from bs4 import BeautifulSoup
-from playwright.async_api import Page
+from playwright.async_api import Page, Response
 
-from common.constants import PAGE_WAIT_TIMEOUT, image_extensions, USER_AGENT
+from common.constants import PAGE_WAIT_TIMEOUT, image_extensions, USER_AGENT, overload_errors, \
+    LINK_EXTRACTION_MODE, collect_links_script
 from database.models import Image, DataType, PageData
 from logger.logger import logger
-from services.delay_manager import refresh_site_available_time
+from services.delay_manager import refresh_site_available_time, record_domain_response
 from services.docoument_extractor import extension_to_datatype
-from util.util import canonicalize, is_url_allowed, is_domain_allowed, check_if_binary
+from services.fetch_archive import fetch_archived
+from services.interception_rules import apply_site_rules
+from services.robots_matcher import filter_allowed_urls
+from services.wait_strategy import navigate
+from util.util import canonicalize, is_domain_allowed, check_if_binary
 
 
-async def get_page(url: str, page: Page, domain: str, ip: str, robot_delay: str) -> (str, str, DataType, int):
+async def get_page(url: str, page: Page, domain: str, ip: str, robot_delay: str) \
+        -> (str, str, DataType, int, datetime, list):
     """
-    Requests and downloads a specific webpage.
+    Requests and downloads a specific webpage or replays it from the fetch archive.
     :param url: Webpage url to be crawled.
     :param page: Browser page.
-    :return: html, status
+    :return: url, html, data type, status, accessed time and links collected by the browser
+    (base url, hrefs, onclick handlers and image urls) or None
+    """
+    return await fetch_archived(kind='page', url=url,
+                                fetch=lambda: fetch_page(url=url, page=page, domain=domain, ip=ip,
+                                                         robot_delay=robot_delay))
+
+
+def get_response_time(response: Response, elapsed_time: float) -> float:
+    """
+    Gets the time to the first byte of the response in seconds, so waiting for the page to load doesn't count
+    as a slow server. Falls back to the elapsed time if the browser didn't report the response's timing.
+    """
+    response_start = response.request.timing.get('responseStart', -1)
+    return response_start / 1000 if response_start >= 0 else elapsed_time
+
+
+async def fetch_page(url: str, page: Page, domain: str, ip: str, robot_delay: str) \
+        -> (str, str, DataType, int, datetime, list):
+    """
+    Opens a specific webpage in the browser or downloads the headers of a binary document.
     """
     # Wait required delay time
     await refresh_site_available_time(domain=domain,
                                       ip=ip,
                                       robot_delay=robot_delay)
+    # Use the site's request interception rules.
+    await apply_site_rules(page=page, domain=domain)
     accessed_time = datetime.now()
     logger.debug(f'Opening page {url}.')
+    start_time = time()
     try:
-        response = await page.goto(url=url, timeout=PAGE_WAIT_TIMEOUT)
+        response = await navigate(page=page, url=url, domain=domain)
         status = response.status
+        record_domain_response(domain=domain, response_time=get_response_time(response, time() - start_time),
+                               status=status, robot_delay=robot_delay)
+        # Links are collected from the live DOM, so links inserted by scripts are found too.
+        page_links = await page.evaluate(collect_links_script) if LINK_EXTRACTION_MODE == 'browser' else None
         html = await page.content()
         logger.debug(f'Response status is {status}.')
-        return page.url, html, None, status, accessed_time
+        return page.url, html, None, status, accessed_time, page_links
     except Exception as e:
-        match str(e).split(' at ')[0]:
+        error = str(e).split(' at ')[0]
+        if error in overload_errors or error.startswith('Timeout'):
+            # The server might be overloaded.
+            record_domain_response(domain=domain, response_time=time() - start_time, robot_delay=robot_delay)
+        match error:
             case 'net::ERR_ABORTED':
                 # Maybe the file is of a binary type, try 2 download it.
                 logger.debug(f'Going to the page failed, initiating download mode.')
                 try:
                     # Wait required delay time
                     await refresh_site_available_time(domain=domain, ip=ip, robot_delay=robot_delay)
-                    document = requests.get(url, verify=False, timeout=PAGE_WAIT_TIMEOUT)
-                    accessed_time = datetime.now()
-                    status = document.status_code
-                    if status != 200:
-                        raise Exception(f'Status code is {status}.')
-                    logger.debug(f'Download successful.')
-                    extension = guess_extension(document.headers.get('content-type', '').split(';')[0])
-                    data_type: str = extension_to_datatype(extension)
-                    if data_type != 'HTML':
-                        return page.url, None, data_type, status, accessed_time
+                    # Only headers are read here, the document itself is streamed by the document downloader.
+                    with requests.get(url, verify=False, timeout=PAGE_WAIT_TIMEOUT / 1000, stream=True,
+                                      headers={'User-Agent': USER_AGENT}) as document:
+                        accessed_time = datetime.now()
+                        status = document.status_code
+                        if status != 200:
+                            raise Exception(f'Status code is {status}.')
+                        logger.debug(f'Download successful.')
+                        extension = guess_extension(document.headers.get('content-type', '').split(';')[0])
+                        data_type: str = extension_to_datatype(extension)
+                        if data_type != 'HTML':
+                            return document.url, None, data_type, status, accessed_time, None
                 except Exception as e2:
                     logger.debug(f'Failed to get document type with an error {e2}.')
             case _:
                 raise e
 
 
-def find_images(beautiful_soup: BeautifulSoup) -> set[Image]:
+def find_images(beautiful_soup: BeautifulSoup, current_url: str) -> set[Image]:
     """
     Gets verified HTML document and finds all images and returns them.
     :param beautiful_soup:  output of BeautifulSoup4 (i.e. validated and parsed HTML)
+    :param current_url: url of the page, used for resolving relative image urls
     """
     logger.debug(f'Finding images on the page.')
     accessed_time = datetime.now()
@@ -71,24 +112,57 @@ def find_images(beautiful_soup: BeautifulSoup) -> set[Image]:
     # find img tags in DOM
     imgs = beautiful_soup.select('img')
     images = set()
+    image_urls = set()
     for img in imgs:
         src = img.attrs.get('src')
-
-        # Extract the path component of the URL
-        path = urlparse(src).path
-        # Split the path into filename and extension
-        filename, extension = os.path.splitext(os.path.basename(path))
-
-        # Parse the URL and check if it has a valid file extension
-        if extension is None or extension.lower() not in image_extensions:
+        if not src:
+            continue
+        url = urljoin(current_url, src)
+        # Save each image only once per page.
+        if url in image_urls:
             continue
 
-        content_type = extension[1:].upper()
-        image: Image = Image(filename=filename, content_type=content_type, accessed_time=accessed_time)
-        images.add(image)
+        image = create_image(url=url, accessed_time=accessed_time)
+        if image is not None:
+            images.add(image)
+            image_urls.add(url)
     return images
 
 
+def create_image(url: str, accessed_time: datetime) -> Image:
+    """
+    Creates an image of the url or returns None if the url doesn't have a supported image extension.
+    """
+    # Extract the path component of the URL
+    path = urlparse(url).path
+    # Split the path into filename and extension
+    filename, extension = os.path.splitext(os.path.basename(path))
+
+    # Parse the URL and check if it has a valid file extension
+    if extension is None or extension.lower() not in image_extensions:
+        return None
+
+    content_type = extension[1:].upper()
+    return Image(filename=filename, content_type=content_type, accessed_time=accessed_time, url=url)
+
+
+def find_browser_images(image_urls: list[str]) -> set[Image]:
+    """
+    Creates images from image urls collected by the browser (already resolved).
+    """
+    logger.debug(f'Creating images collected in the browser.')
+    accessed_time = datetime.now()
+    images = {}
+    for url in image_urls:
+        # Save each image only once per page.
+        if url in images or not url.startswith('http'):
+            continue
+        image = create_image(url=url, accessed_time=accessed_time)
+        if image is not None:
+            images[url] = image
+    return set(images.values())
+
+
 async def find_sitemap_links(current_url: ParseResult, robot_file_parser: RobotFileParser,
                              domain: str,
                              ip: str, ) -> set[str]:
@@ -124,9 +198,8 @@ async def find_sitemap_links(current_url: ParseResult, robot_file_parser: RobotF
     new_urls_sitemap = canonicalize(new_urls_sitemap)
 
     # check if the url is allowed to visit
-    new_urls_sitemap = {url for url in new_urls_sitemap if
-                        is_url_allowed(url, robot_file_parser=robot_file_parser) and
-                        is_domain_allowed(url=url)}
+    new_urls_sitemap = set(filter_allowed_urls([url for url in new_urls_sitemap if is_domain_allowed(url=url)],
+                                               robot_file_parser=robot_file_parser))
 
     return new_urls_sitemap
 
@@ -137,13 +210,18 @@ async def get_sitemap_urls(sitemap_url, domain: str, ip: str, robot_delay: str,
     This is a recursive function.
     """
     logger.debug(f'Looking at sitemap {sitemap_url} for new urls.')
-    # Wait required delay time
-    await refresh_site_available_time(domain=domain, ip=ip, robot_delay=robot_delay)
-    try:
+
+    async def fetch_sitemap() -> (int, bytes):
+        # Wait required delay time
+        await refresh_site_available_time(domain=domain, ip=ip, robot_delay=robot_delay)
         sitemap = requests.get(sitemap_url, verify=False, timeout=PAGE_WAIT_TIMEOUT)
-        if sitemap.status_code != 200:
+        return sitemap.status_code, sitemap.content
+
+    try:
+        status, content = await fetch_archived(kind='sitemap', url=sitemap_url, fetch=fetch_sitemap)
+        if status != 200:
             return new_urls if new_urls is not None else set()
-        xml = BeautifulSoup(sitemap.content, features="xml")
+        xml = BeautifulSoup(content, features="xml")
     except Exception as e:
         logger.debug(f'Failed to parse sitemap with an error {e}.')
         return new_urls if new_urls is not None else set()
@@ -177,7 +255,7 @@ def extract_binary_links(urls: set) -> (set[str], set[PageData]):
         (binary, data_type) = check_if_binary(url)
         if binary:
             urls_to_remove.add(url)
-            page_data: PageData = PageData(data_type_code=data_type)
+            page_data: PageData = PageData(data_type_code=data_type, url=url)
             page_data_entries.add(page_data)
 
     urls.difference_update(urls_to_remove)
@@ -0,0 +1,193 @@
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from time import perf_counter, time
+from types import CodeType
+
+from common.constants import PROFILING_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_WRITE_INTERVAL, MEMORY_SNAPSHOT_PAGES, \
+    MEMORY_SNAPSHOT_FRAMES, SLOW_PAGE_THRESHOLD
+from common.globals import lock, profiling_state
+from logger.logger import logger
+
+SLOW_PAGE_LOG = 'slow_pages.jsonl'
+
+
+class PageTimer:
+    """
+    Measures time spent in stages of crawling a page. Each stage lasts from the previous mark.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.start_time = perf_counter()
+        self.last_time = self.start_time
+        self.stages: dict[str, float] = {}
+        self.page_size = None
+
+    def mark(self, stage: str):
+        now = perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last_time
+        self.last_time = now
+
+    def set_page_size(self, page_size: int):
+        self.page_size = page_size
+
+    def finish(self):
+        """
+        Writes the page to the slow page log if crawling it took too long.
+        """
+        total = perf_counter() - self.start_time
+        if total < SLOW_PAGE_THRESHOLD:
+            return
+        logger.info(f'Crawling url {self.url} was slow ({total:.2f} seconds).')
+        write_slow_page(entry={'url': self.url,
+                               'time': datetime.now().isoformat(),
+                               'total': round(total, 3),
+                               'stages': {stage: round(duration, 3) for stage, duration in self.stages.items()},
+                               'page_size': self.page_size})
+
+
+class DisabledPageTimer(PageTimer):
+    """
+    Page timer used while profiling is off, it doesn't measure anything.
+    """
+
+    def __init__(self):
+        super().__init__(url='')
+
+    def mark(self, stage: str):
+        pass
+
+    def set_page_size(self, page_size: int):
+        pass
+
+    def finish(self):
+        pass
+
+
+disabled_page_timer = DisabledPageTimer()
+
+
+def start_page_timer(url: str) -> PageTimer:
+    """
+    Starts timing a crawled page, the timer doesn't measure anything if profiling is off.
+    """
+    return PageTimer(url=url) if profiling_state['enabled'] else disabled_page_timer
+
+
+def write_slow_page(entry: dict):
+    with lock:
+        run_dir = profiling_state['run_dir']
+        if run_dir is None:
+            return
+        with open(os.path.join(run_dir, SLOW_PAGE_LOG), 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+
+def format_frame(code: CodeType) -> str:
+    # Semicolons separate frames in collapsed stacks.
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def write_samples(run_dir: str, samples: dict[str, Counter]):
+    """
+    Writes stack samples of each thread in the collapsed format used by flamegraph.pl and speedscope.
+    """
+    for thread_name, stacks in samples.items():
+        path = os.path.join(run_dir, f'{thread_name.replace(" ", "-").lower()}.folded')
+        with open(f'{path}.tmp', 'w') as file:
+            for stack, count in stacks.items():
+                file.write(f'{";".join(format_frame(code) for code in reversed(stack))} {count}\n')
+        os.replace(f'{path}.tmp', path)
+
+
+def run_sampler(stopped: threading.Event, run_dir: str):
+    """
+    Samples stacks of spider threads until stopped. Samples include time spent waiting (e.g. for the browser or
+    the database), which is shown as the event loop's selector.
+    """
+    samples: dict[str, Counter] = {}
+    last_write_time = time()
+    while not stopped.wait(PROFILE_SAMPLE_INTERVAL):
+        spider_names = {thread.ident: thread.name for thread in threading.enumerate()
+                        if thread.name.startswith('Spider')}
+        for ident, frame in sys._current_frames().items():
+            thread_name = spider_names.get(ident)
+            if thread_name is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            samples.setdefault(thread_name, Counter())[tuple(stack)] += 1
+        if time() - last_write_time > PROFILE_WRITE_INTERVAL:
+            write_samples(run_dir=run_dir, samples=samples)
+            last_write_time = time()
+    write_samples(run_dir=run_dir, samples=samples)
+
+
+def take_memory_snapshot():
+    run_dir = profiling_state['run_dir']
+    if run_dir is not None and tracemalloc.is_tracing():
+        tracemalloc.take_snapshot().dump(os.path.join(run_dir, f'memory-{profiling_state["crawled_pages"]}.snapshot'))
+
+
+def record_crawled_page():
+    """
+    Counts pages crawled while profiling and takes a memory snapshot every MEMORY_SNAPSHOT_PAGES pages.
+    """
+    if not profiling_state['enabled']:
+        return
+    with lock:
+        profiling_state['crawled_pages'] += 1
+        if profiling_state['crawled_pages'] % MEMORY_SNAPSHOT_PAGES != 0:
+            return
+    take_memory_snapshot()
+
+
+def start_profiling():
+    """
+    Starts sampling spider threads, tracing memory allocations and logging slow pages to a new run directory.
+    """
+    with lock:
+        if profiling_state['enabled']:
+            return
+        run_dir = os.path.join(PROFILING_DIR, datetime.now().strftime('%Y%m%dT%H%M%S'))
+        os.makedirs(run_dir, exist_ok=True)
+        tracemalloc.start(MEMORY_SNAPSHOT_FRAMES)
+        stopped = threading.Event()
+        sampler = threading.Thread(target=run_sampler, args=(stopped, run_dir), daemon=True, name='Profiler')
+        sampler.start()
+        profiling_state.update({'enabled': True, 'run_dir': run_dir, 'crawled_pages': 0,
+                                'sampler': (sampler, stopped)})
+    logger.info(f'Profiling started, results are written to {run_dir}.')
+
+
+def stop_profiling():
+    """
+    Stops profiling and writes the collected samples and the last memory snapshot.
+    """
+    with lock:
+        if not profiling_state['enabled']:
+            return
+        profiling_state['enabled'] = False
+        sampler, stopped = profiling_state['sampler']
+    stopped.set()
+    sampler.join()
+    take_memory_snapshot()
+    tracemalloc.stop()
+    with lock:
+        run_dir = profiling_state['run_dir']
+        profiling_state.update({'run_dir': None, 'sampler': None})
+    logger.info(f'Profiling stopped, results were written to {run_dir}.')
+
+
+def toggle_profiling():
+    if profiling_state['enabled']:
+        stop_profiling()
+    else:
+        start_profiling()
@@ -0,0 +1,40 @@
+from common.constants import REDIRECT_MAX_HOPS
+from common.globals import redirects
+from logger.logger import logger
+
+
+def resolve_redirect(url: str) -> str:
+    """
+    Follows known redirects from the url and returns the final url.
+    Followed chains are collapsed, so the next lookup takes a single step.
+    """
+    target_url = redirects.get(url)
+    if target_url is None:
+        return url
+    visited = {url}
+    while target_url in redirects and target_url not in visited and len(visited) < REDIRECT_MAX_HOPS:
+        visited.add(target_url)
+        target_url = redirects[target_url]
+    if len(visited) > 1:
+        redirects[url] = target_url
+    return target_url
+
+
+def remember_redirect(source_url: str, target_url: str) -> str:
+    """
+    Remembers that the source url redirects to the target url.
+    Returns the final url or None if the redirect wasn't remembered because it would create a loop.
+    """
+    target_url = resolve_redirect(target_url)
+    if target_url == source_url:
+        logger.debug(f'Redirect from {source_url} would create a loop.')
+        return None
+    redirects[source_url] = target_url
+    return target_url
+
+
+def rewrite_redirects(urls: set[str]) -> set[str]:
+    """
+    Replaces urls that are known to redirect with their final urls.
+    """
+    return {resolve_redirect(url) for url in urls}
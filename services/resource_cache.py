@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+from time import time
+
+from playwright.async_api import Route
+
+from common.constants import RESOURCE_CACHE_DIR, RESOURCE_CACHE_MAX_SIZE, RESOURCE_CACHE_MAX_ENTRY_SIZE, \
+    RESOURCE_CACHE_MAX_HEURISTIC_TTL
+from logger.logger import logger
+
+# Headers that describe the transfer instead of the resource, so they are not cached.
+excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive',
+                    'set-cookie', 'date', 'age']
+
+# SQLite connections to the cache index, one per thread.
+connections = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Gets the thread's connection to the cache index.
+    The index is a SQLite database, so the cache can be shared by all threads and processes.
+    """
+    if not hasattr(connections, 'connection'):
+        os.makedirs(RESOURCE_CACHE_DIR, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(RESOURCE_CACHE_DIR, 'index.sqlite'), timeout=30,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS resource ('
+                           'key TEXT PRIMARY KEY, '
+                           'url TEXT NOT NULL, '
+                           'status INTEGER NOT NULL, '
+                           'headers TEXT NOT NULL, '
+                           'size INTEGER NOT NULL, '
+                           'expires REAL NOT NULL, '
+                           'last_access REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS resource_last_access ON resource (last_access)')
+        connections.connection = connection
+    return connections.connection
+
+
+def get_resource_path(key: str) -> str:
+    return os.path.join(RESOURCE_CACHE_DIR, key[:2], key)
+
+
+def get_cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def get_freshness_lifetime(headers: dict[str, str]) -> float:
+    """
+    Returns for how many seconds the response can be cached, based on its caching headers.
+    Returns 0 if the response must not be cached.
+    """
+    cache_control = [directive.strip().lower() for directive in headers.get('cache-control', '').split(',')]
+    if any(directive in ['no-store', 'no-cache', 'private'] for directive in cache_control):
+        return 0
+    vary = [header.strip().lower() for header in headers.get('vary', '').split(',') if header.strip()]
+    if any(header != 'accept-encoding' for header in vary):
+        return 0
+    for directive in cache_control:
+        for name in ['s-maxage=', 'max-age=']:
+            if directive.startswith(name):
+                try:
+                    return max(int(directive[len(name):].strip('"')) - int(headers.get('age', 0)), 0)
+                except ValueError:
+                    return 0
+    try:
+        date = parsedate_to_datetime(headers['date']).timestamp() if 'date' in headers else time()
+        if 'expires' in headers:
+            return max(parsedate_to_datetime(headers['expires']).timestamp() - date, 0)
+        if 'last-modified' in headers:
+            # Heuristic freshness, 10% of the time since the last modification.
+            last_modified = parsedate_to_datetime(headers['last-modified']).timestamp()
+            return min(max((date - last_modified) / 10, 0), RESOURCE_CACHE_MAX_HEURISTIC_TTL)
+    except (TypeError, ValueError):
+        return 0
+    return 0
+
+
+def get_cached_resource(url: str) -> (int, dict[str, str], bytes):
+    """
+    Gets a fresh cached resource.
+    Returns status, headers and body or None if the resource is not cached.
+    """
+    key = get_cache_key(url)
+    connection = get_connection()
+    row = connection.execute('SELECT status, headers, expires FROM resource WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        return None
+    status, headers, expires = row
+    current_time = time()
+    if expires < current_time:
+        logger.debug(f'Cached resource {url} expired.')
+        remove_resources(connection=connection, keys=[key])
+        return None
+    try:
+        with open(get_resource_path(key), 'rb') as file:
+            body = file.read()
+    except FileNotFoundError:
+        remove_resources(connection=connection, keys=[key])
+        return None
+    connection.execute('UPDATE resource SET last_access = ? WHERE key = ?', (current_time, key))
+    return status, json.loads(headers), body
+
+
+def cache_resource(url: str, status: int, headers: dict[str, str], body: bytes):
+    """
+    Saves the resource to the cache if its caching headers allow it.
+    """
+    if status != 200 or len(body) > RESOURCE_CACHE_MAX_ENTRY_SIZE:
+        return
+    headers = {name.lower(): value for name, value in headers.items()}
+    if 'set-cookie' in headers:
+        return
+    lifetime = get_freshness_lifetime(headers)
+    if lifetime <= 0:
+        return
+
+    key = get_cache_key(url)
+    path = get_resource_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(body)
+    os.replace(temporary_path, path)
+
+    current_time = time()
+    headers = {name: value for name, value in headers.items() if name not in excluded_headers}
+    connection = get_connection()
+    connection.execute('INSERT OR REPLACE INTO resource (key, url, status, headers, size, expires, last_access) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (key, url, status, json.dumps(headers), len(body), current_time + lifetime, current_time))
+    logger.debug(f'Resource {url} cached for {lifetime} seconds.')
+    evict_resources(connection=connection)
+
+
+def evict_resources(connection: sqlite3.Connection):
+    """
+    Removes the least recently used resources once the cache is larger than RESOURCE_CACHE_MAX_SIZE.
+    """
+    total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM resource').fetchone()[0]
+    if total_size <= RESOURCE_CACHE_MAX_SIZE:
+        return
+    keys = []
+    # Free some additional space, so eviction doesn't run on every insert.
+    target_size = RESOURCE_CACHE_MAX_SIZE * 0.9
+    for key, size in connection.execute('SELECT key, size FROM resource ORDER BY last_access'):
+        if total_size <= target_size:
+            break
+        keys.append(key)
+        total_size -= size
+    logger.debug(f'Evicting {len(keys)} resources from the cache.')
+    remove_resources(connection=connection, keys=keys)
+
+
+def remove_resources(connection: sqlite3.Connection, keys: list[str]):
+    connection.executemany('DELETE FROM resource WHERE key = ?', [(key,) for key in keys])
+    for key in keys:
+        try:
+            os.remove(get_resource_path(key))
+        except FileNotFoundError:
+            pass
+
+
+async def serve_cached_resource(route: Route):
+    """
+    Fulfills the request from the shared cache or fetches the resource and caches it.
+    """
+    request = route.request
+    if request.method != 'GET':
+        await route.continue_()
+        return
+    url = request.url
+    cached_resource = await asyncio.to_thread(get_cached_resource, url)
+    if cached_resource is not None:
+        status, headers, body = cached_resource
+        logger.debug(f'Serving resource {url} from the cache.')
+        await route.fulfill(status=status, headers=headers, body=body)
+        return
+    try:
+        response = await route.fetch()
+        body = await response.body()
+    except Exception as e:
+        logger.debug(f'Fetching resource {url} failed with an error {e}.')
+        await route.abort()
+        return
+    headers = {name: value for name, value in response.headers.items() if name.lower() not in excluded_headers}
+    await route.fulfill(status=response.status, headers=headers, body=body)
+    await asyncio.to_thread(cache_resource, url, response.status, response.headers, body)
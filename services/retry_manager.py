@@ -0,0 +1,68 @@
+import random
+from datetime import datetime, timedelta
+
+from common.constants import transient_errors, transient_status_codes, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, \
+    RETRY_MAX_DELAY
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.frontier_policy import get_priority
+
+
+class TransientStatusError(Exception):
+    """
+    Raised when a page responds with a status that is probably temporary and the page can still be retried.
+    """
+
+    def __init__(self, status: int):
+        super().__init__(f'Status code is {status}.')
+        self.status = status
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Checks whether the crawl error is probably temporary.
+    """
+    if isinstance(error, TransientStatusError):
+        return True
+    message = str(error).split(' at ')[0]
+    return any(message.startswith(transient_error) for transient_error in transient_errors)
+
+
+def can_retry(attempts: int) -> bool:
+    """
+    Checks whether a page that already failed the given number of times can be crawled again.
+    """
+    return attempts + 1 < RETRY_MAX_ATTEMPTS
+
+
+def check_transient_status(status: int, attempts: int):
+    """
+    Raises TransientStatusError if the status is probably temporary and the page can still be retried.
+    """
+    if status in transient_status_codes and can_retry(attempts=attempts):
+        raise TransientStatusError(status=status)
+
+
+def get_retry_delay(attempts: int) -> float:
+    """
+    Gets the exponential backoff delay in seconds with a random jitter, so retries of a host are spread out.
+    """
+    delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def retry_page(database_manager: DatabaseManager, page_id: int, url: str, depth: int, attempts: int,
+                     error: Exception) -> bool:
+    """
+    Moves the page back to the frontier if the error is temporary and the page hasn't failed too many times.
+    Returns True if the page will be retried.
+    """
+    if not is_transient_error(error) or not can_retry(attempts=attempts):
+        return False
+    delay = get_retry_delay(attempts=attempts)
+    await database_manager.requeue_page(page_id=page_id,
+                                        priority=get_priority(url=url, depth=depth),
+                                        attempts=attempts + 1,
+                                        next_attempt_time=datetime.now() + timedelta(seconds=delay))
+    logger.info(f'Url {url} will be retried in {delay:.0f} seconds after {attempts + 1} failed attempts.')
+    return True
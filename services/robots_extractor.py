@@ -1,8 +1,36 @@
+from urllib.error import HTTPError
 from urllib.parse import ParseResult
+from urllib.request import urlopen
 from urllib.robotparser import RobotFileParser
 
 from logger.logger import logger
 from services.delay_manager import refresh_site_available_time
+from services.fetch_archive import fetch_archived
+
+
+def fetch_robots(robots_url: str) -> (int, bytes):
+    """
+    Requests a robots.txt file the same way RobotFileParser.read does.
+    Returns response status and content.
+    """
+    try:
+        with urlopen(robots_url) as response:
+            return response.status, response.read()
+    except HTTPError as e:
+        e.close()
+        return e.code, b''
+
+
+def parse_robots(robot_file_parser: RobotFileParser, status: int, content: bytes) -> None:
+    """
+    Parses a robots.txt response the same way RobotFileParser.read does.
+    """
+    if status in (401, 403):
+        robot_file_parser.disallow_all = True
+    elif 400 <= status < 500:
+        robot_file_parser.allow_all = True
+    elif status < 400:
+        robot_file_parser.parse(content.decode('utf-8').splitlines())
 
 
 async def load_robots_file_url(parsed_url: ParseResult, robot_file_parser: RobotFileParser, domain: str,
@@ -12,11 +40,16 @@ async def load_robots_file_url(parsed_url: ParseResult, robot_file_parser: Robot
     """
     robots_url = parsed_url.scheme + '://' + parsed_url.netloc + '/robots.txt'
     logger.debug(f'Getting robots.txt with url {robots_url}.')
-    try:
-        robot_file_parser.set_url(robots_url)
+
+    async def fetch() -> (int, bytes):
         # Wait required delay time
         await refresh_site_available_time(domain=domain, ip=ip)
-        robot_file_parser.read()
+        return fetch_robots(robots_url=robots_url)
+
+    try:
+        robot_file_parser.set_url(robots_url)
+        status, content = await fetch_archived(kind='robots', url=robots_url, fetch=fetch)
+        parse_robots(robot_file_parser=robot_file_parser, status=status, content=content)
     except:
         logger.debug(f'Getting robots.txt with url {robots_url} failed.')
         return None
@@ -27,7 +60,7 @@ def load_saved_robots(robots_content: str, robot_file_parser: RobotFileParser) -
     """
     logger.debug('Loading saved robots.txt.')
     try:
-        robot_file_parser.parse(robots_content)
+        robot_file_parser.parse(robots_content.splitlines())
     except:
         logger.warning(f'Loading saved robots.txt failed.')
         return None
\ No newline at end of file
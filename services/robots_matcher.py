@@ -0,0 +1,145 @@
+import re
+import weakref
+from urllib.parse import urlsplit, quote, unquote
+from urllib.robotparser import RobotFileParser
+
+from common.constants import USER_AGENT
+from common.globals import robots_parsers
+from logger.logger import logger
+
+# Characters that are kept as they are when normalizing paths, other characters are percent-encoded.
+path_safe_characters = "/?:@!$&'()*+,;=-._~"
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalizes percent-encoding of a path, so paths and rules can be compared.
+    RobotFileParser quotes rule paths again every time saved robots.txt files are parsed, so all levels of
+    percent-encoding are removed first.
+    """
+    for _ in range(3):
+        unquoted = unquote(path)
+        if unquoted == path:
+            break
+        path = unquoted
+    return quote(path, safe=path_safe_characters)
+
+
+class RobotsMatcher:
+    """
+    Rules of a robots.txt group compiled for matching. The longest matching rule wins and Allow wins ties.
+    Rules without wildcards are kept in sets by their length, so the longest one is found with a lookup
+    per distinct length. Rules with * and $ wildcards are compiled to regexes.
+    """
+
+    def __init__(self, rules: list[(str, bool)], default: bool = True):
+        self.default = default
+        # Allowance of plain rules by length and rule path.
+        self.plain_rules: dict[int, dict[str, bool]] = {}
+        # Wildcard rules (length, allowance, regex), the longest first.
+        self.wildcard_rules: list[(int, bool, re.Pattern)] = []
+        for path, allowance in rules:
+            if path == '':
+                continue
+            if '*' in path or path.endswith('$'):
+                anchored = path.endswith('$')
+                pattern = ''.join('.*' if part == '*' else re.escape(part)
+                                  for part in re.split(r'(\*)', path[:-1] if anchored else path))
+                self.wildcard_rules.append((len(path), allowance, re.compile(pattern + ('$' if anchored else ''))))
+            else:
+                rules_of_length = self.plain_rules.setdefault(len(path), {})
+                # Allow wins between the same rules.
+                rules_of_length[path] = rules_of_length.get(path, False) or allowance
+        self.plain_lengths = sorted(self.plain_rules, reverse=True)
+        self.wildcard_rules.sort(key=lambda rule: (-rule[0], not rule[1]))
+
+    def is_allowed(self, path: str) -> bool:
+        """
+        Checks a normalized path (with the query).
+        """
+        if path == '/robots.txt':
+            return True
+        best_length, allowed = -1, self.default
+        for length in self.plain_lengths:
+            if length > len(path):
+                continue
+            allowance = self.plain_rules[length].get(path[:length])
+            if allowance is not None:
+                best_length, allowed = length, allowance
+                break
+        for length, allowance, regex in self.wildcard_rules:
+            if length < best_length or (length == best_length and (allowed or not allowance)):
+                break
+            if regex.match(path):
+                best_length, allowed = length, allowance
+                break
+        return allowed
+
+
+def compile_robots(robot_file_parser: RobotFileParser, user_agent: str = USER_AGENT) -> RobotsMatcher:
+    """
+    Compiles rules of all robots.txt groups that apply to the user agent, or of the * groups if none do.
+    """
+    if robot_file_parser.disallow_all:
+        return RobotsMatcher(rules=[], default=False)
+    if robot_file_parser.allow_all:
+        return RobotsMatcher(rules=[])
+    # Nothing can be fetched until robots.txt is read or found not to exist, the same as in RobotFileParser.
+    if not robot_file_parser.last_checked:
+        return RobotsMatcher(rules=[], default=False)
+    token = user_agent.split('/')[0].lower()
+    entries = robot_file_parser.entries + ([robot_file_parser.default_entry]
+                                           if robot_file_parser.default_entry is not None else [])
+    groups = [entry for entry in entries
+              if any(agent != '*' and agent.lower() in token for agent in entry.useragents)]
+    if len(groups) == 0:
+        groups = [entry for entry in entries if '*' in entry.useragents]
+    return RobotsMatcher(rules=[(normalize_path(rule.path), rule.allowance)
+                                for entry in groups for rule in entry.rulelines])
+
+
+# Compiled matchers of robots.txt parsers and the time the parser was last changed.
+compiled_matchers: weakref.WeakKeyDictionary[RobotFileParser, (float, RobotsMatcher)] = weakref.WeakKeyDictionary()
+
+
+def get_robots_matcher(robot_file_parser: RobotFileParser) -> RobotsMatcher:
+    """
+    Gets the parser's compiled matcher, the parser is compiled again if it was changed.
+    """
+    compiled = compiled_matchers.get(robot_file_parser)
+    if compiled is None or compiled[0] != robot_file_parser.last_checked:
+        compiled = (robot_file_parser.last_checked, compile_robots(robot_file_parser))
+        compiled_matchers[robot_file_parser] = compiled
+    return compiled[1]
+
+
+def get_url_path(url: str) -> (str, str):
+    """
+    Returns the url's host without www. and its normalized path with the query.
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts.netloc.replace('www.', ''), normalize_path(path)
+
+
+def filter_allowed_urls(urls, robot_file_parser: RobotFileParser) -> list[str]:
+    """
+    Returns urls that are allowed by robots.txt. Urls are checked with rules of their own site if they are known,
+    otherwise with the given robots.txt (usually of the page the urls were found on).
+    """
+    matchers = {}
+    default_matcher = get_robots_matcher(robot_file_parser) if robot_file_parser is not None else None
+    allowed_urls = []
+    for url in urls:
+        host, path = get_url_path(url)
+        matcher = matchers.get(host)
+        if matcher is None:
+            host_parser = robots_parsers.get(host)
+            matcher = get_robots_matcher(host_parser) if host_parser is not None else default_matcher
+            matchers[host] = matcher
+        if matcher is None or matcher.is_allowed(path):
+            allowed_urls.append(url)
+    logger.debug(f'{len(allowed_urls)} of checked urls are allowed in robots.txt.')
+    return allowed_urls
@@ -0,0 +1,79 @@
+import threading
+from urllib.robotparser import RobotFileParser
+
+from common.globals import site_cache, robots_parsers, site_locks, known_url_fingerprints, cache_lock
+from logger.logger import logger
+from services.robots_extractor import load_saved_robots
+from util.util import url_fingerprint
+
+
+def get_cached_site(domain: str) -> (int, str, str, str, str):
+    """
+    Gets the site from the cache.
+    """
+    return site_cache.get(domain.replace('www.', ''))
+
+
+def cache_site(site_id: int, domain: str, robots_content: str, sitemap_content: str, wait_strategy: str = None):
+    """
+    Saves the site to the cache.
+    """
+    domain = domain.replace('www.', '')
+    site_cache[domain] = (site_id, domain, robots_content, sitemap_content, wait_strategy)
+
+
+def get_robots_parser(domain: str, robots_content: str) -> RobotFileParser:
+    """
+    Gets a parsed site's robots.txt. The file is parsed only once and then shared by all threads.
+    """
+    domain = domain.replace('www.', '')
+    robot_file_parser = robots_parsers.get(domain)
+    if robot_file_parser is None:
+        robot_file_parser = RobotFileParser()
+        load_saved_robots(robots_content=robots_content, robot_file_parser=robot_file_parser)
+        robots_parsers[domain] = robot_file_parser
+    return robot_file_parser
+
+
+def cache_robots_parser(domain: str, robot_file_parser: RobotFileParser):
+    """
+    Saves a parsed site's robots.txt to the cache.
+    """
+    robots_parsers[domain.replace('www.', '')] = robot_file_parser
+
+
+def get_site_lock(domain: str) -> threading.Lock:
+    """
+    Gets the lock that has to be held while creating a new site.
+    """
+    domain = domain.replace('www.', '')
+    with cache_lock:
+        site_lock = site_locks.get(domain)
+        if site_lock is None:
+            site_lock = threading.Lock()
+            site_locks[domain] = site_lock
+        return site_lock
+
+
+def is_known_url(url: str) -> bool:
+    """
+    Checks whether the url is already saved in the database.
+    False positives are not possible (apart from fingerprint collisions),
+    false negatives only mean that the database has to be asked.
+    """
+    return url_fingerprint(url) in known_url_fingerprints
+
+
+def remember_urls(urls: list[str]):
+    """
+    Remembers that the urls are already saved in the database.
+    """
+    logger.debug(f'Remembering {len(urls)} known urls.')
+    known_url_fingerprints.update(url_fingerprint(url) for url in urls)
+
+
+def remember_url_hashes(url_hashes: list[int]):
+    """
+    Remembers urls saved in the database by their hashes, which are the same as their fingerprints.
+    """
+    known_url_fingerprints.update(url_hashes)
@@ -0,0 +1,123 @@
+from playwright.async_api import Page, Response
+
+from common.constants import WAIT_STRATEGY, SITE_WAIT_SELECTORS, PAGE_WAIT_TIMEOUT, NETWORK_IDLE_TIMEOUT, \
+    WAIT_STRATEGY_SAMPLES, WAIT_STRATEGY_MIN_LINKS_RATIO, wait_strategies
+from common.globals import site_cache, wait_strategy_samples, learned_wait_strategies, lock
+from logger.logger import logger
+
+# Counts elements that can hold links.
+links_count_script = "document.querySelectorAll('a[href], [onclick]').length"
+
+
+def get_wait_strategy(domain: str) -> str:
+    """
+    Gets the page load wait strategy for the domain.
+    Returns None if the strategy hasn't been learned yet.
+    """
+    domain = domain.replace('www.', '')
+    if domain in SITE_WAIT_SELECTORS:
+        return 'selector'
+    if WAIT_STRATEGY != 'adaptive':
+        return WAIT_STRATEGY
+    site = site_cache.get(domain)
+    return site[4] if site is not None else None
+
+
+def take_learned_wait_strategy(domain: str) -> str:
+    """
+    Returns the newly learned wait strategy for the domain, which has to be saved to the database.
+    """
+    return learned_wait_strategies.pop(domain.replace('www.', ''), None)
+
+
+async def navigate(page: Page, url: str, domain: str) -> Response:
+    """
+    Opens the url using site's wait strategy.
+    Pages of sites without a learned strategy are probed with all strategies.
+    """
+    wait_strategy = get_wait_strategy(domain=domain)
+    logger.debug(f'Opening page {url} with the wait strategy {wait_strategy}.')
+    match wait_strategy:
+        case None:
+            return await probe_navigation(page=page, url=url, domain=domain)
+        case 'selector':
+            response = await page.goto(url=url, timeout=PAGE_WAIT_TIMEOUT, wait_until='commit')
+            try:
+                await page.wait_for_selector(SITE_WAIT_SELECTORS[domain.replace('www.', '')],
+                                             timeout=PAGE_WAIT_TIMEOUT)
+            except Exception as e:
+                logger.debug(f'Waiting for the selector failed with an error {e}.')
+            return response
+        case 'networkidle':
+            response = await page.goto(url=url, timeout=PAGE_WAIT_TIMEOUT, wait_until='domcontentloaded')
+            await wait_for_network_idle(page=page)
+            return response
+        case _:
+            return await page.goto(url=url, timeout=PAGE_WAIT_TIMEOUT, wait_until=wait_strategy)
+
+
+async def probe_navigation(page: Page, url: str, domain: str) -> Response:
+    """
+    Opens the url and counts the links available after each load state.
+    """
+    response = await page.goto(url=url, timeout=PAGE_WAIT_TIMEOUT, wait_until='commit')
+    links_counts = {'commit': await count_links(page=page)}
+    for load_state in ['domcontentloaded', 'load']:
+        await page.wait_for_load_state(load_state, timeout=PAGE_WAIT_TIMEOUT)
+        links_counts[load_state] = await count_links(page=page)
+    await wait_for_network_idle(page=page)
+    links_counts['networkidle'] = await count_links(page=page)
+    logger.debug(f'Links found with each wait strategy: {links_counts}.')
+    record_wait_strategy_sample(domain=domain, links_counts=links_counts)
+    return response
+
+
+async def wait_for_network_idle(page: Page):
+    """
+    Waits for the network to become idle, but at most NETWORK_IDLE_TIMEOUT.
+    """
+    try:
+        await page.wait_for_load_state('networkidle', timeout=NETWORK_IDLE_TIMEOUT)
+    except Exception:
+        logger.debug('Network did not become idle in time.')
+
+
+async def count_links(page: Page) -> int:
+    try:
+        return await page.evaluate(links_count_script)
+    except Exception:
+        # The document might not be available yet.
+        return 0
+
+
+def record_wait_strategy_sample(domain: str, links_counts: dict[str, int]):
+    """
+    Remembers the links counts of a probed page and chooses site's strategy once there are enough samples.
+    """
+    domain = domain.replace('www.', '')
+    with lock:
+        samples = wait_strategy_samples.setdefault(domain, [])
+        samples.append(links_counts)
+        if len(samples) < WAIT_STRATEGY_SAMPLES:
+            return
+        wait_strategy = choose_wait_strategy(samples=samples)
+        del wait_strategy_samples[domain]
+        site = site_cache.get(domain)
+        if site is not None:
+            site_cache[domain] = (*site[:4], wait_strategy)
+        learned_wait_strategies[domain] = wait_strategy
+    logger.info(f'Learned the wait strategy {wait_strategy} for the domain {domain}.')
+
+
+def choose_wait_strategy(samples: list[dict[str, int]]) -> str:
+    """
+    Chooses the cheapest strategy that finds (almost) all links on every sampled page.
+    Pages without any links don't tell strategies apart, so 'load' is used if no sampled page has links.
+    """
+    samples = [sample for sample in samples if max(sample.values()) > 0]
+    if len(samples) == 0:
+        return 'load'
+    for wait_strategy in wait_strategies:
+        if all(sample[wait_strategy] >= WAIT_STRATEGY_MIN_LINKS_RATIO * max(sample.values()) for sample in samples):
+            return wait_strategy
+    return 'load'
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable
+
+from common.constants import WARC_SOFTWARE
+
+
+def format_digest(sha256_hex: str) -> str:
+    """
+    Formats a sha256 hex digest the way WARC digests are usually written (base32).
+    """
+    return 'sha256:' + base64.b32encode(bytes.fromhex(sha256_hex)).decode('ascii')
+
+
+def format_date(date: datetime) -> str:
+    # Naive times in the database are local, WARC dates are in UTC.
+    return (date or datetime.now()).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class WarcWriter:
+    """
+    Writes WARC 1.1 files. Each record is a separate gzip member, so files can be read from any record
+    and record blocks are streamed without keeping them in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.write_warcinfo()
+
+    def size(self) -> int:
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def write_record(self, headers: dict, block: Iterable[bytes], length: int):
+        """
+        Writes a record with the given headers and block chunks.
+        """
+        compressor = zlib.compressobj(wbits=31)
+        header = 'WARC/1.1\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers.items()) + \
+                 f'Content-Length: {length}\r\n\r\n'
+        self.file.write(compressor.compress(header.encode('utf-8')))
+        for chunk in block:
+            self.file.write(compressor.compress(chunk))
+        self.file.write(compressor.compress(b'\r\n\r\n'))
+        self.file.write(compressor.flush())
+
+    def write_warcinfo(self):
+        info = f'software: {WARC_SOFTWARE}\r\nformat: WARC File Format 1.1\r\n'.encode('utf-8')
+        self.write_record(headers={'WARC-Type': 'warcinfo',
+                                   'WARC-Record-ID': f'<urn:uuid:{uuid.uuid4()}>',
+                                   'WARC-Date': format_date(datetime.now()),
+                                   'WARC-Filename': self.path.split('/')[-1],
+                                   'Content-Type': 'application/warc-fields'},
+                          block=[info],
+                          length=len(info))
+
+    def write_resource(self, url: str, accessed_time: datetime, content_type: str, block: Iterable[bytes],
+                       length: int, sha256_hex: str):
+        """
+        Writes a resource record, which holds a crawled page or document without HTTP headers.
+        """
+        self.write_record(headers={'WARC-Type': 'resource',
+                                   'WARC-Record-ID': f'<urn:uuid:{uuid.uuid4()}>',
+                                   'WARC-Date': format_date(accessed_time),
+                                   'WARC-Target-URI': url,
+                                   'WARC-Block-Digest': format_digest(sha256_hex),
+                                   'WARC-Payload-Digest': format_digest(sha256_hex),
+                                   'Content-Type': content_type},
+                          block=block,
+                          length=length)
+
+    def write_html(self, url: str, accessed_time: datetime, html: str, html_hash: str = None):
+        data = html.encode('utf-8')
+        self.write_resource(url=url,
+                            accessed_time=accessed_time,
+                            content_type='text/html; charset=utf-8',
+                            block=[data],
+                            length=len(data),
+                            sha256_hex=html_hash or hashlib.sha256(data).hexdigest())
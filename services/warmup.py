@@ -0,0 +1,74 @@
+import asyncio
+from time import time
+
+from common.globals import startup_times, lock
+from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.redirect_cache import remember_redirect
+from services.site_cache import cache_site, get_robots_parser, remember_url_hashes
+
+
+async def warm_caches(database_manager: DatabaseManager):
+    """
+    Preloads saved sites, their robots.txt files, known urls and redirects,
+    so threads don't have to request them one by one.
+    """
+    logger.info('Warming caches started.')
+    start_time = time()
+    sites = await database_manager.get_sites()
+    for site_id, domain, robots_content, sitemap_content, wait_strategy in sites:
+        cache_site(site_id=site_id, domain=domain, robots_content=robots_content, sitemap_content=sitemap_content,
+                   wait_strategy=wait_strategy)
+        get_robots_parser(domain=domain, robots_content=robots_content)
+    logger.info(f'Cached {len(sites)} sites.')
+
+    urls_count = 0
+    async for url_hashes in database_manager.stream_url_hashes():
+        remember_url_hashes(url_hashes)
+        urls_count += len(url_hashes)
+    logger.info(f'Cached {urls_count} known urls.')
+
+    redirects_count = 0
+    async for saved_redirects in database_manager.stream_redirects():
+        for source_url, target_url in saved_redirects:
+            remember_redirect(source_url=source_url, target_url=target_url)
+        redirects_count += len(saved_redirects)
+    logger.info(f'Cached {redirects_count} redirects.')
+
+    await database_manager.cleanup()
+    logger.info(f'Warming caches finished in {time() - start_time:.2f} seconds.')
+
+
+def warmup_entrypoint(database_manager: DatabaseManager):
+    try:
+        asyncio.run(warm_caches(database_manager))
+    except Exception as e:
+        # The caches are only an optimization, so the crawler works without them.
+        logger.warning(f'Warming caches failed with an error {e}.')
+
+
+def mark_startup_started():
+    """
+    Remembers when the threads have been started.
+    """
+    startup_times['started'] = time()
+
+
+def mark_page_crawled(thread_number: int, n_threads: int):
+    """
+    Reports the time to the first crawled page and the time when all threads are crawling.
+    """
+    if startup_times['full_throughput'] is not None:
+        return
+    with lock:
+        started = startup_times['started']
+        if started is None or thread_number in startup_times['threads']:
+            return
+        startup_times['threads'].add(thread_number)
+        if startup_times['first_page'] is None:
+            startup_times['first_page'] = time() - started
+            logger.info(f'Time to first page is {startup_times["first_page"]:.2f} seconds.')
+        if len(startup_times['threads']) == n_threads:
+            startup_times['full_throughput'] = time() - started
+            logger.info(f'Time to full throughput ({n_threads} crawling threads) is '
+                        f'{startup_times["full_throughput"]:.2f} seconds.')
@@ -1,24 +1,80 @@
 import asyncio
-from threading import Thread
+import signal
+from threading import Thread, Event
 
+from playwright.async_api import async_playwright
+
+from common.constants import PROFILING_ENABLED
 from common.globals import threads_status
 from database.database_manager import DatabaseManager
+from logger.logger import logger
+from services.browser_pool import BrowserPool
+from services.checkpoint import load_checkpoint, run_checkpoints
+from services.crawl_stats import stats_entrypoint
+from services.frontier_notifier import mark_thread_finished
+from services.profiler import start_profiling, stop_profiling, toggle_profiling
+from services.warmup import warmup_entrypoint, mark_startup_started
 from spider.spider import start_spiders
 
 
-def entrypoint(*params):
-    asyncio.run(start_spiders(*params))
+def entrypoint(database_manager: DatabaseManager, browser_pool: BrowserPool, thread_number: int, n_threads: int):
+    try:
+        asyncio.run(start_spiders(database_manager, browser_pool, thread_number, n_threads))
+    finally:
+        # A crashed thread must not keep the other threads waiting forever.
+        mark_thread_finished(thread_number)
+
+
+async def setup_threads(database_manager: DatabaseManager, n_threads: int = 5, n_browsers: int = 1):
+    # Restore politeness delays, DNS results, sites and known urls saved before the last stop.
+    load_checkpoint()
+    checkpoints_stopped = Event()
+    checkpoints = Thread(target=run_checkpoints, args=(checkpoints_stopped,), daemon=True, name='Checkpoints')
+    checkpoints.start()
+
+    # Profiling can be switched on and off while crawling with SIGUSR1.
+    if PROFILING_ENABLED:
+        start_profiling()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
+
+    # Changes of crawl statistics that weren't saved before a crash are lost, so they are recounted from the crawled
+    # data before any thread changes them.
+    logger.info('Recounting crawl statistics.')
+    await database_manager.recount_crawl_stats()
+    await database_manager.cleanup()
 
+    # Load crawl statistics and periodically save their changes.
+    stats_stopped = Event()
+    stats = Thread(target=stats_entrypoint, args=(database_manager, stats_stopped), daemon=True, name='Stats')
+    stats.start()
+
+    # Preload hot state in the background, threads fall back to the database until it's loaded.
+    Thread(target=warmup_entrypoint, args=(database_manager,), daemon=True, name='Warmup').start()
+
+    # Start browser processes shared by all threads.
+    async with async_playwright() as playwright:
+        executable_path = playwright.chromium.executable_path
+    browser_pool = BrowserPool(executable_path=executable_path, n_browsers=n_browsers)
+    await asyncio.to_thread(browser_pool.start)
 
-async def setup_threads(database_manager: DatabaseManager, n_threads: int = 5):
     threads: [Thread] = []
     for i in range(0, n_threads):
         threads_status[i] = True
-        t = Thread(target=entrypoint, args=(database_manager, i), daemon=True, name=f'Spider {i}')
+    mark_startup_started()
+    # All threads are started at once, site creation is synchronized per domain.
+    for i in range(0, n_threads):
+        t = Thread(target=entrypoint, args=(database_manager, browser_pool, i, n_threads), daemon=True,
+                   name=f'Spider {i}')
         t.start()
         threads.append(t)
-        # Don't start all threads at once so the site table get filled first.
-        await asyncio.sleep(10)
 
     for t in threads:
-        t.join()
+        await asyncio.to_thread(t.join)
+
+    browser_pool.close()
+    stop_profiling()
+
+    stats_stopped.set()
+    await asyncio.to_thread(stats.join)
+    checkpoints_stopped.set()
+    await asyncio.to_thread(checkpoints.join)
@@ -1,39 +1,150 @@
 import asyncio
 import hashlib
-import urllib
 from datetime import datetime
 from urllib.parse import ParseResult, urlparse
 from urllib.robotparser import RobotFileParser
 
 from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, Page
 
-from common.constants import USER_AGENT
-from common.globals import threads_status
+from common.constants import USER_AGENT, transient_status_codes
 from database.database_manager import DatabaseManager
-from database.models import Page, PageData
+from database.models import PageData
 from logger.logger import logger
-from services.link_extractor import find_links
-from services.page_extractor import find_sitemap_links, get_page, find_images, extract_binary_links
-from services.robots_extractor import load_saved_robots, load_robots_file_url
-from util.util import fix_shortened_url, get_site_ip, canonicalize, block_aggressively
-
-
-async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: RobotFileParser,
-                    database_manager: DatabaseManager, page_id: int):
+from services.browser_pool import BrowserPool, BrowserSlot
+from services.circuit_breaker import allow_request, record_success, record_failure, get_open_domains, \
+    get_reopen_time
+from services.crawl_stats import format_progress
+from services.delay_manager import get_unavailable_domains
+from services.document_downloader import DocumentDownloader
+from services.frontier_admission import check_admission, count_rejection, is_host_frontier_full, \
+    record_admission, refill_host_frontier, refill_empty_frontier
+from services.frontier_notifier import get_frontier_version, notify_frontier_changed, wait_for_frontier
+from services.frontier_policy import get_priority, count_frontier_link
+from services.image_fetcher import ImageFetcher
+from services.interception_rules import install_interceptor
+from services.link_extractor import find_links, find_browser_links
+from services.page_extractor import find_sitemap_links, get_page, find_images, extract_binary_links, \
+    find_browser_images
+from services.profiler import PageTimer, disabled_page_timer, start_page_timer, record_crawled_page
+from services.redirect_cache import resolve_redirect, remember_redirect, rewrite_redirects
+from services.retry_manager import check_transient_status, retry_page, is_transient_error, TransientStatusError
+from services.robots_extractor import load_robots_file_url
+from services.robots_matcher import filter_allowed_urls
+from services.site_cache import get_cached_site, get_site_lock, cache_site, cache_robots_parser, get_robots_parser, \
+    is_known_url, remember_urls
+from services.wait_strategy import take_learned_wait_strategy
+from services.warmup import mark_page_crawled
+from util.util import fix_shortened_url, get_site_ip, canonicalize, is_domain_allowed
+
+
+async def create_site(current_url_parsed: ParseResult, database_manager: DatabaseManager, domain: str,
+                      ip: str) -> (int, RobotFileParser):
+    """
+    Requests site's robots.txt and saves a new site to the database.
+    Returns site's id and robots.txt parser.
+    """
+    logger.debug(f'Domain {domain} has not been visited yet.')
+    robot_file_parser = RobotFileParser()
+    await load_robots_file_url(parsed_url=current_url_parsed,
+                               robot_file_parser=robot_file_parser,
+                               domain=domain,
+                               ip=ip)
+
+    sitemap_content = None
+    if robot_file_parser.site_maps() is not None:
+        sitemap_content = ','.join(robot_file_parser.site_maps())
+    robots_content = robot_file_parser.__str__()
+    site_id = await database_manager.save_site(domain=domain,
+                                               sitemap_content=sitemap_content,
+                                               robots_content=robots_content)
+    cache_site(site_id=site_id, domain=domain, robots_content=robots_content, sitemap_content=sitemap_content)
+    cache_robots_parser(domain=domain, robot_file_parser=robot_file_parser)
+    return site_id, robot_file_parser
+
+
+async def get_or_create_site(current_url_parsed: ParseResult, database_manager: DatabaseManager, domain: str,
+                             ip: str) -> (int, str, RobotFileParser, set[str]):
+    """
+    Gets the saved site (from the cache or the database) or creates a new one.
+    Only one thread at a time can create a site, so robots.txt and sitemaps are requested only once per domain.
+    Returns site's id, domain, robots.txt parser and sitemap urls.
+    """
+    # Get saved site from the cache or the database (if exists)
+    saved_site = get_cached_site(domain=domain) or await database_manager.get_site(domain=domain)
+
+    if not saved_site:
+        site_lock = get_site_lock(domain=domain)
+        await asyncio.to_thread(site_lock.acquire)
+        try:
+            # Another thread might have created the site in the meantime.
+            saved_site = get_cached_site(domain=domain) or await database_manager.get_site(domain=domain)
+            if not saved_site:
+                site_id, robot_file_parser = await create_site(current_url_parsed=current_url_parsed,
+                                                               database_manager=database_manager,
+                                                               domain=domain,
+                                                               ip=ip)
+        finally:
+            site_lock.release()
+
+        if not saved_site:
+            # Sitemaps are requested outside the lock, because they can take a long time.
+            sitemap_urls = await find_sitemap_links(
+                current_url=current_url_parsed,
+                robot_file_parser=robot_file_parser,
+                domain=domain,
+                ip=ip)
+            return site_id, domain, robot_file_parser, sitemap_urls
+
+    # Don't request sitemaps if the domain was already visited
+    logger.debug(f'Domain {domain} was already visited so sitemaps will be ignored.')
+    site_id, domain, robots_content, sitemap_content, wait_strategy = saved_site
+    cache_site(site_id=site_id, domain=domain, robots_content=robots_content, sitemap_content=sitemap_content,
+               wait_strategy=wait_strategy)
+    robot_file_parser = get_robots_parser(domain=domain, robots_content=robots_content)
+    return site_id, domain, robot_file_parser, set()
+
+
+async def save_redirect(database_manager: DatabaseManager, source_url: str, target_url: str) -> str:
+    """
+    Remembers and saves a redirect. Returns the final url or None if the redirect would create a loop
+    or leads outside of allowed domains.
+    """
+    if not is_domain_allowed(target_url):
+        logger.debug(f'Redirect from {source_url} to {target_url} is not remembered, its domain is not allowed.')
+        return None
+    final_url = remember_redirect(source_url=source_url, target_url=target_url)
+    if final_url is not None:
+        await database_manager.save_redirect(source_url=source_url, target_url=final_url)
+    return final_url
+
+
+async def crawl_url(start_url: str, browser_page: Page, database_manager: DatabaseManager, page_id: int,
+                    depth: int, image_fetcher: ImageFetcher, document_downloader: DocumentDownloader,
+                    attempts: int = 0, page_timer: PageTimer = disabled_page_timer):
     """
     Crawls the provided current_url.
     :param start_url: Url to be crawled
     :param browser_page: Browser page
-    :param robot_file_parser: parser for robots.txt
     :param database_manager: manager for database calls
+    :param image_fetcher: downloader of page images
+    :param document_downloader: downloader of binary documents
     :param page_id: If of the current page
+    :param depth: Distance of the current page from the seed pages
+    :param attempts: Number of previous failed attempts to crawl the page
+    :param page_timer: timer of crawling stages, used for the slow page log
     :return:
     """
     logger.info(f'Crawling url {start_url} started.')
 
+    # Follow known redirects, so they aren't requested again.
+    current_url = resolve_redirect(url=start_url)
+
     # Fix shortened URLs (if necessary).
-    current_url = fix_shortened_url(url=start_url)
+    fixed_url = fix_shortened_url(url=current_url)
+    if fixed_url != current_url:
+        current_url = await save_redirect(database_manager=database_manager, source_url=start_url,
+                                          target_url=fixed_url) or fixed_url
 
     # Parse url into a ParseResult object.
     current_url_parsed: ParseResult = urlparse(current_url)
@@ -41,53 +152,69 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
     # Get url domain
     domain = current_url_parsed.netloc
 
+    # Don't crawl domains that keep failing, the page is crawled once the domain's circuit allows it.
+    if not allow_request(domain=domain):
+        logger.info(f'Domain {domain} has an open circuit, url {current_url} will be crawled later.')
+        await database_manager.requeue_page(page_id=page_id,
+                                            priority=get_priority(url=current_url, depth=depth),
+                                            attempts=attempts,
+                                            next_attempt_time=get_reopen_time(domain=domain) or datetime.now())
+        return
+
     # Get site's ip address
     ip = get_site_ip(hostname=domain)
 
     # If the DNS request failed it probably doesn't work.
     if ip is None:
         logger.info(f'DNS request failed for url {current_url}.')
+        record_failure(domain=domain)
         return
 
-    # Get saved site from the database (if exists)
-    saved_site = await database_manager.get_site(domain=domain)
-
-    site_id: int
-    if saved_site:
-        # Don't request sitemaps if the domain was already visited
-        sitemap_urls = set()
-        logger.debug(f'Domain {domain} was already visited so sitemaps will be ignored.')
-        site_id, domain, robots_content, sitemap_content = saved_site
-        load_saved_robots(robots_content=robots_content,
-                          robot_file_parser=robot_file_parser)
-    else:
-        logger.debug(f'Domain {domain} has not been visited yet.')
-        await load_robots_file_url(parsed_url=current_url_parsed,
-                                   robot_file_parser=robot_file_parser,
-                                   domain=domain,
-                                   ip=ip)
-
-        sitemap_content = None
-        if robot_file_parser.site_maps() is not None:
-            sitemap_content = ','.join(robot_file_parser.site_maps())
-        site_id = await database_manager.save_site(domain=domain,
-                                                   sitemap_content=sitemap_content,
-                                                   robots_content=robot_file_parser.__str__())
-
-        sitemap_urls = await find_sitemap_links(
-            current_url=current_url_parsed,
-            robot_file_parser=robot_file_parser,
-            domain=domain,
-            ip=ip)
+    # Get saved site or create a new one
+    site_id, domain, robot_file_parser, sitemap_urls = await get_or_create_site(
+        current_url_parsed=current_url_parsed,
+        database_manager=database_manager,
+        domain=domain,
+        ip=ip)
+
+    if current_url != start_url:
+        logger.info(f'Url {start_url} is known to redirect to {current_url}.')
+        # Save original page as a redirect
+        await database_manager.update_page_redirect(page_id=page_id, site_id=site_id, accessed_time=datetime.now())
+        target_page_id = await database_manager.get_page_id(url=current_url)
+        if target_page_id is not None:
+            # The final page was already crawled.
+            await database_manager.add_page_link(to_page_id=target_page_id, from_page_id=page_id)
+            return
+        # Create the final page and crawl it instead.
+        new_page_id = await database_manager.create_new_page(url=current_url, site_id=site_id)
+        await database_manager.add_page_link(to_page_id=new_page_id, from_page_id=page_id)
+        page_id = new_page_id
 
     page_urls = set()
+    page_timer.mark('prepare')
     # Fetch page
     try:
-        (url, html, data_type, status, accessed_time) = await get_page(url=current_url, page=browser_page,
+        (url, html, data_type, status, accessed_time, page_links) = await get_page(url=current_url, page=browser_page,
                                                                        domain=domain,
                                                                        ip=ip,
                                                                        robot_delay=robot_file_parser.crawl_delay(
                                                                            useragent=USER_AGENT))
+        page_timer.mark('fetch')
+        if html:
+            page_timer.set_page_size(len(html))
+        # Retry temporary errors (e.g. 503) later instead of saving them.
+        if status in transient_status_codes:
+            record_failure(domain=domain)
+        else:
+            record_success(domain=domain)
+        check_transient_status(status=status, attempts=attempts)
+
+        # Save newly learned page load wait strategy
+        wait_strategy = take_learned_wait_strategy(domain=domain)
+        if wait_strategy is not None:
+            await database_manager.update_site_wait_strategy(site_id=site_id, wait_strategy=wait_strategy)
+
         # Convert actual page url to canonical form
         page_url = ''.join(canonicalize({url}))
         # Check if URL is a redirect by matching current_url and returned url and the reassigning Only checking HTTP
@@ -98,6 +225,9 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
             logger.debug(
                 f'Current watched url {current_url} differs from actual browser url {page_url}. Redirect happened.')
 
+            # Remember the redirect, so links to the original url are replaced with the actual url.
+            await save_redirect(database_manager=database_manager, source_url=current_url, target_url=page_url)
+
             # Save original page as a redirect
             await database_manager.update_page_redirect(page_id=page_id, site_id=site_id, accessed_time=accessed_time)
 
@@ -130,18 +260,26 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
                 logger.info(f'Url {current_url} is a duplicate of another page.')
 
             else:
-                # PARSE PAGE
-                # extract any relevant data from the page here, using BeautifulSoup
-                beautiful_soup = BeautifulSoup(html, "html.parser")
-
-                # get images
-                page_images = find_images(beautiful_soup)
-
-                # get URLs
-                page_urls = find_links(beautiful_soup, current_url_parsed, robot_file_parser=robot_file_parser)
+                if page_links is not None:
+                    # Links and images were already collected and resolved by the browser.
+                    base_url, hrefs, onclicks, image_urls = page_links
+                    page_images = find_browser_images(image_urls)
+                    page_urls = find_browser_links(base_url=base_url, hrefs=hrefs, onclicks=onclicks,
+                                                   robot_file_parser=robot_file_parser)
+                else:
+                    # PARSE PAGE
+                    # extract any relevant data from the page here, using BeautifulSoup
+                    beautiful_soup = BeautifulSoup(html, "html.parser")
+
+                    # get images
+                    page_images = find_images(beautiful_soup, current_url=url)
+
+                    # get URLs
+                    page_urls = find_links(beautiful_soup, current_url_parsed, robot_file_parser=robot_file_parser)
 
                 # check page URLs for binary file link and place them in separate list
                 (page_urls, page_data_entries) = extract_binary_links(urls=page_urls)
+                page_timer.mark('parse')
 
                 # SAVE PAGE
                 # Save page to the database
@@ -156,13 +294,17 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
                 for image in page_images:
                     image.page_id = page_id
                 if len(page_images) > 0:
-                    await database_manager.save_images(images=list(page_images))
+                    saved_images = await database_manager.save_images(images=list(page_images))
+                    # Download images in the background.
+                    image_fetcher.add(items=saved_images)
 
                 # SAVE PAGE DATA
                 for page_data in page_data_entries:
                     page_data.page_id = page_id
                 if len(page_data_entries) > 0:
-                    await database_manager.save_page_data(page_data_entries=list(page_data_entries))
+                    saved_page_data = await database_manager.save_page_data(page_data_entries=list(page_data_entries))
+                    # Download documents in the background.
+                    document_downloader.add(items=saved_page_data)
         else:
             logger.debug(
                 f'Page {current_url} html is empty, this hopefully means that the page returned a binary file.')
@@ -175,13 +317,25 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
                                                    page_type_code='BINARY',
                                                    accessed_time=accessed_time)
                 # Save page data
-                await database_manager.save_page_data(
-                    page_data_entries=[PageData(page_id=page_id, data_type_code=data_type)])
+                saved_page_data = await database_manager.save_page_data(
+                    page_data_entries=[PageData(page_id=page_id, data_type_code=data_type, url=url)])
+                document_downloader.add(items=saved_page_data)
                 logger.debug(f'Url {current_url} leads to a binary file {data_type}.')
+        page_timer.mark('save')
 
     except Exception as e:
-        # Mark page as failed
-        await database_manager.mark_page_as_failed(page_id=page_id, site_id=site_id)
+        page_timer.mark('failed')
+        if is_transient_error(e) and not isinstance(e, TransientStatusError):
+            record_failure(domain=domain)
+
+        # Move the page back to the frontier if the error is temporary
+        if await retry_page(database_manager=database_manager, page_id=page_id, url=current_url, depth=depth,
+                            attempts=attempts, error=e):
+            # The page doesn't exist anymore, so new links aren't linked to it.
+            page_id = None
+        else:
+            # Mark page as failed
+            await database_manager.mark_page_as_failed(page_id=page_id, site_id=site_id)
 
         match str(e).split(' at ')[0]:
             case 'net::ERR_BAD_SSL_CLIENT_AUTH_CERT':
@@ -193,66 +347,119 @@ async def crawl_url(start_url: str, browser_page: Page, robot_file_parser: Robot
             case 'net::ERR_EMPTY_RESPONSE':
                 logger.debug(f'Opening page {current_url} failed with an error {e}.')
             case _:
-                logger.warning(f'Opening page {current_url} failed with an error {e}.')
+                if is_transient_error(e):
+                    logger.debug(f'Opening page {current_url} failed with an error {e}.')
+                else:
+                    logger.warning(f'Opening page {current_url} failed with an error {e}.')
 
     # SAVE PAGE LINKS
-    # combine DOM and sitemap URLs
-    new_links = page_urls.union(sitemap_urls)
+    # combine DOM and sitemap URLs and replace urls that are known to redirect
+    links = page_urls.union(sitemap_urls)
+    rewritten_links = rewrite_redirects(links)
+    # Redirect targets weren't checked when the links were found.
+    redirect_targets = [link for link in rewritten_links - links if is_domain_allowed(link)]
+    new_links = (rewritten_links & links).union(filter_allowed_urls(redirect_targets,
+                                                                   robot_file_parser=robot_file_parser))
     logger.debug(f'Got {len(new_links)} new links.')
     # Add new urls to the frontier
+    frontier_changed = False
     for link in new_links:
-        link_id = await database_manager.add_to_frontier(link=link)
-        if link_id is not None:
-            # link previous page to the new link page.
-            await database_manager.add_page_link(to_page_id=link_id, from_page_id=page_id)
+        # Skip urls that are already in the database.
+        if is_known_url(link):
+            continue
+        # Skip urls over the host's budget and likely crawler traps.
+        rejection = check_admission(url=link, depth=depth + 1)
+        if rejection is not None:
+            count_rejection(url=link, reason=rejection)
+            continue
+        # The link from the current page is saved once the new page is popped from the frontier.
+        # Links of hosts with too many frontier entries are spilled over and added to the frontier later.
+        spill = is_host_frontier_full(url=link)
+        frontier_id = await database_manager.add_to_frontier(link=link,
+                                                             depth=depth + 1,
+                                                             priority=get_priority(url=link, depth=depth + 1),
+                                                             from_page_id=page_id,
+                                                             spill=spill)
+        remember_urls([link])
+        if frontier_id is not None:
+            record_admission(url=link)
+            count_frontier_link(url=link)
+            frontier_changed = frontier_changed or not spill
+    # Wake up sleeping threads.
+    if frontier_changed:
+        notify_frontier_changed()
+    page_timer.mark('frontier')
 
     logger.info(f'Crawling url {start_url} finished.')
 
 
-async def start_spiders(database_manager: DatabaseManager, thread_number: int):
+async def setup_browser_page(browser_page: Page):
+    """
+    Prepares a new browser page for crawling.
+    """
+    # Prevent loading some resources for better performance.
+    await install_interceptor(browser_page)
+
+
+async def start_spiders(database_manager: DatabaseManager, browser_pool: BrowserPool, thread_number: int,
+                        n_threads: int):
     """
     Setups the playwright library and starts the crawler.
     """
     logger.info('Spider started.')
     async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(args=["--ignore-certificate-errors",
-                                                         "--ignore-urlfetcher-cert-requests",
-                                                         "--ignore-certificate-errors",
-                                                         "--allow-running-insecure-content",
-                                                         "--ignore-certificate-errors-spki-lis"])
-
-        # browser = await playwright.firefox.launch(firefox_user_prefs={"security.enterprise_roots.enabled": True,
-        # "acceptInsecureCerts": True, "security.ssl.enable_ocsp_stapling": False,
-        # "network.stricttransportsecurity.preloadlist": False})
-
-        # create a new incognito browser context.
-        context = await browser.new_context(ignore_https_errors=True, user_agent=USER_AGENT, )
-        # create a new page in a pristine context.
-        browser_page = await context.new_page()
-        # Prevent loading some resources for better performance.
-        await browser_page.route("**/*", block_aggressively)
-        robot_file_parser = urllib.robotparser.RobotFileParser()
-
-        while any(threads_status.values()):
-            frontier_page = await database_manager.pop_frontier()
+        # Pages are leased from browser processes shared by all threads.
+        browser_slot = BrowserSlot(playwright=playwright, browser_pool=browser_pool, setup_page=setup_browser_page)
+        image_fetcher = ImageFetcher(database_manager=database_manager)
+        image_fetcher.start()
+        document_downloader = DocumentDownloader(database_manager=database_manager)
+        document_downloader.start()
+        if thread_number == 0:
+            # Resume downloads that were interrupted by a restart.
+            document_downloader.add(items=await database_manager.get_pending_page_data())
+
+        while True:
+            # Remember the frontier version before popping, so links added in the meantime wake up the thread.
+            frontier_version = get_frontier_version()
+            # Prefer domains that don't have to be waited for.
+            # Domains with an open circuit are skipped.
+            frontier_page = await database_manager.pop_frontier(excluded_domains=get_unavailable_domains(),
+                                                                blocked_domains=get_open_domains())
             if frontier_page is not None:
-                threads_status[thread_number] = True
-                frontier_id, url = frontier_page
+                frontier_id, url, depth, attempts = frontier_page
+                await refill_host_frontier(database_manager=database_manager, url=url)
+                page_timer = start_page_timer(url=url)
                 try:
                     await crawl_url(start_url=url,
-                                    browser_page=browser_page,
-                                    robot_file_parser=robot_file_parser,
+                                    browser_page=await browser_slot.get_page(),
                                     database_manager=database_manager,
-                                    page_id=frontier_id)
+                                    page_id=frontier_id,
+                                    depth=depth,
+                                    image_fetcher=image_fetcher,
+                                    document_downloader=document_downloader,
+                                    attempts=attempts,
+                                    page_timer=page_timer)
                 except Exception as e:
                     logger.critical(f'Crawling url {url} failed with an error {e}.')
                     await database_manager.mark_page_as_failed(page_id=frontier_id)
-                # logger.info(f'Visited {await database_manager.get_html_pages_count()} unique HTML pages.')
-                # logger.info(f'Frontier contains {len(await database_manager.get_frontier_links())} unique links.')
+                page_timer.finish()
+                record_crawled_page()
+                mark_page_crawled(thread_number=thread_number, n_threads=n_threads)
+                logger.info(format_progress())
             else:
-                threads_status[thread_number] = False
+                # Spilled links are moved back only once the frontier is empty, which wakes up sleeping threads.
+                await refill_empty_frontier(database_manager=database_manager, blocked_domains=get_open_domains())
                 logger.info('Sleeping.')
-                await asyncio.sleep(60)
-
-        await browser.close()
+                # Pages waiting for a retry or for a domain's circuit keep the crawl from finishing.
+                next_attempt_times = [attempt_time for attempt_time in
+                                      [await database_manager.get_next_attempt_time(), get_reopen_time()]
+                                      if attempt_time is not None]
+                next_attempt_time = min(next_attempt_times) if len(next_attempt_times) > 0 else None
+                if not await asyncio.to_thread(wait_for_frontier, thread_number, frontier_version,
+                                               next_attempt_time=next_attempt_time):
+                    break
+
+        await image_fetcher.close()
+        await document_downloader.close()
+        await browser_slot.close()
     logger.info(f'Thread {thread_number} finished.')
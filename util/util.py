@@ -1,16 +1,21 @@
+import hashlib
 import re
 import socket
+from time import time
 from urllib.parse import ParseResult
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
 from urllib.robotparser import RobotFileParser
 
 import requests
 from url_normalize import url_normalize
 from w3lib.url import url_query_cleaner
 
-from common.constants import full_url_regex, USER_AGENT, binary_file_extensions, govsi_regex, excluded_resource_types
+from common.constants import full_url_regex, binary_file_extensions, govsi_regex, DNS_CACHE_TTL
+from common.globals import dns_cache
 from logger.logger import logger
 from services.docoument_extractor import extension_to_datatype
+from services.fetch_archive import call_archived
+from services.robots_matcher import get_robots_matcher, get_url_path
 
 
 def canonicalize(urls: set) -> set[str]:
@@ -50,7 +55,7 @@ def is_url_allowed(url: str, robot_file_parser: RobotFileParser) -> bool:
     if robot_file_parser is None:
         allowed = True
     else:
-        allowed = robot_file_parser.can_fetch(USER_AGENT, url)
+        allowed = get_robots_matcher(robot_file_parser).is_allowed(get_url_path(url)[1])
     logger.debug(f'Url {url} allowed in robots.txt: {allowed}.')
     return allowed
 
@@ -91,13 +96,8 @@ def fill_url(url: str, current_url_parsed: ParseResult) -> str:
     In such cases fill the rest of the URL and return
     """
     logger.debug(f'Filling url {url}.')
-    url_parsed = urlparse(url)
-    filled_url = url
-    # check if full url
-    if not url_parsed.scheme or not url_parsed.netloc:
-        # take URL data from current page and append relative path
-        filled_url = current_url_parsed.scheme + '://' + current_url_parsed.netloc + url
-    return filled_url
+    # resolve the url relative to the current page (handles ../ paths and urls without a leading /)
+    return urljoin(current_url_parsed.geturl(), url)
 
 
 def get_real_url_from_shortlink(url: str) -> str:
@@ -107,10 +107,9 @@ def get_real_url_from_shortlink(url: str) -> str:
     """
     logger.debug(f'Getting real url from the short url {url}.')
     try:
-        resp = requests.get(url)
+        return call_archived(kind='shortlink', url=url, fetch=lambda: requests.get(url).url)
     except:
         return url
-    return resp.url
 
 
 def is_domain_allowed(url: str) -> bool:
@@ -136,22 +135,25 @@ def fix_shortened_url(url: str) -> str:
     return url
 
 
-async def block_aggressively(route):
-    """
-    Prevent loading some resources for better performance.
-    """
-    if route.request.resource_type in excluded_resource_types:
-        await route.abort()
-    else:
-        await route.continue_()
-
-
 def get_site_ip(hostname: str):
     """
     Returns site's ip address.
+    Successful lookups are cached for DNS_CACHE_TTL seconds.
     """
+    cached = dns_cache.get(hostname)
+    if cached is not None and cached[1] > time():
+        return cached[0]
     try:
-        return socket.gethostbyname(hostname)
+        ip = call_archived(kind='dns', url=hostname, fetch=lambda: socket.gethostbyname(hostname))
+        dns_cache[hostname] = (ip, time() + DNS_CACHE_TTL)
+        return ip
     except:
         logger.warning(f'Getting site ip address failed.')
         return None
+
+
+def url_fingerprint(url: str) -> int:
+    """
+    Returns a 64-bit fingerprint of the url.
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)